@@ -31,28 +31,41 @@ import argparse
 sys.path.append("chipinfo")
 import scsi
 import controller
-import flash
+import benchmark
+import surface
+import fakecap
+import scan
+import capture
+import output
+import stats
+import probecache
+import watch
+import devprobe
+import sysfs
 
 _version = "ChipInfo/CHIE v0.3 *ALPHA* by VL // 2019/10/27"
 
-def ProcessDevice(deviceName, report=[], verbose=False, friendlyName=""):
+# banners and progress, moved to stderr when stdout carries machine-readable reports
+_info = sys.stdout
 
+def Info(text=""):
+	print(text, file=_info)
+
+# opener(deviceName) returns the device object, scsi.Device by default
+def ProcessDevice(deviceName, report=None, verbose=False, friendlyName="", opener=None, usbid=None):
+
+	if report == None:
+		report = []
 	if friendlyName == "":
 		friendlyName = deviceName
+	if opener == None:
+		opener = scsi.Device
 
 	try:
 		report.append(("Device", friendlyName))
-		with scsi.Device(deviceName) as dctl:
-
-			capacity = scsi.GetCapacity(dctl)
-			report.append(("Capacity", capacity, "size"))
-
-			detected = False
-			for ctl in controller.DetectController(dctl, verbose=verbose):
-				ctl.ProcessDevice(dctl, report)
-				detected = True
-			if not detected:
-				report.append(("Controller", "Unknown"))
+		with opener(deviceName) as dctl:
+			for entry in devprobe.ProbeDevice(dctl, verbose, usbid):
+				report.append(entry)
 		#report.append(("Status", "OK"))
 	except Exception as e:
 		#print(msg)
@@ -61,90 +74,215 @@ def ProcessDevice(deviceName, report=[], verbose=False, friendlyName=""):
 
 	return report
 
-def ProcessDeviceByLetter(deviceLetter, report=[], verbose=False):
-	letter = deviceLetter[0].upper()
-	device = "\\\\.\\" + letter + ":"
-	return ProcessDevice(device, report, verbose, friendlyName=letter + ":")
-
-def FormatValue(value, format):
-	if value == None:
-		return "Unavailable"
-
-	if format == "X":
-		return "%X"%value
-	if format == "size":
-		return "%d byte(s)"%value
-	if format == "fid":
-		return flash.GetFlashInfo(value)
-
-	return value
-
-def PrintReport(report, filename=None):
-	rawreport = []
-	for entry in report:
-		key = entry[0]
-		# key = Translate(key)
-		value = FormatValue(entry[1], entry[2]) if len(entry) > 2 else entry[1]
-		rawreport.append((key, value))
-
-	keywidth = 0
-	for entry in rawreport:
-		keywidth = max(keywidth, len(entry[0]))
-
-	if filename != None:
-		f = open(filename, "wt")
-		f.write(_version + "\n")
-	else:
-		f = None
-
-	for entry in rawreport:
-		key = entry[0]
-		value = entry[1]
-		line = "{key:{kw}}: {value}".format(key=key, kw=keywidth, value=value)
-		print(line)
-		if f != None:
-			f.write(line + "\n")
-
-	if f != None:
-		f.close()
+def ProcessDeviceByName(deviceName, report=None, verbose=False, opener=None):
+	replay = opener == capture.ReplayDevice
+	device, friendlyName = DevicePath(deviceName, replay=replay)
+	if report == None:
+		report = []
+	usbid = sysfs.UsbId(device) if sys.platform.startswith("linux") and not replay else None
+	start = len(report)
+	ProcessDevice(device, report, verbose, friendlyName=friendlyName, opener=opener, usbid=usbid)
+	if usbid != None:
+		report[start + 1:start + 1] = UsbInfo(sysfs.Find(device), [])
+	return report
+
+# USB details from sysfs
+def UsbInfo(disk, report):
+	report.append(("USB ID", "%04X:%04X"%(disk.vid, disk.pid)))
+	if disk.port != None:
+		report.append(("USB port", disk.port))
+	if disk.speed != None:
+		report.append(("USB speed", "%d Mbps"%disk.speed))
+	return report
+
+# Return OS device path and friendly name for a user-supplied device name
+def DevicePath(deviceName, replay=False):
+	if sys.platform == "win32" and not replay:
+		letter = deviceName[0].upper()
+		return "\\\\.\\" + letter + ":", letter + ":"
+	return deviceName, deviceName
+
+"""
+	Report sink for the whole run. The report file (-r) gets the selected
+	format and the screen gets text, or the selected format goes to stdout
+	if there is no report file. Every device report is written as soon as
+	it is complete
+"""
+class Reports:
+	def __init__(self, args):
+		self.file = None
+		self.writers = []
+		if args.report != None:
+			self.file = open(args.report, "wt", newline="" if args.format == "csv" else None)
+			self.writers.append(output.Writer(args.format, self.file, _version))
+			self.writers.append(output.TextWriter(sys.stdout))
+		else:
+			self.writers.append(output.Writer(args.format, sys.stdout))
+
+	def Write(self, report):
+		for writer in self.writers:
+			writer.Write(report)
+
+	def Close(self):
+		if self.file != None:
+			self.file.close()
+			self.file = None
+
+"""
+	Probe devices concurrently, print reports as they complete
+	With --all, every removable device is probed
+"""
+def ScanAll(args, reports):
+	devices = scsi.EnumerateDevices() if args.all else args.device
+	Info("Devices found: %d"%len(devices))
+	Info()
+
+	opener = Opener(args, len(devices) > 1)
+	probe = lambda device: ProcessDeviceByName(device, verbose=args.verbose, opener=opener)
+	return scan.Scan(devices, probe, workers=args.jobs, timeout=args.timeout, callback=lambda device, report: reports.Write(report))
+
+"""
+	Probe devices as they are plugged in, until interrupted
+"""
+def WatchDevices(args, reports):
+	Info("Watching for new devices, press Ctrl+C to stop")
+	Info()
+
+	opener = Opener(args, True)
+	def probe(device):
+		if sys.platform != "win32":
+			watch.WaitForNode(device)
+		return ProcessDeviceByName(device, verbose=args.verbose, opener=opener)
+	def event(action, device):
+		Info("%s: %s"%("Device added" if action == "add" else "Device removed", device))
+
+	try:
+		watch.Watch(probe, lambda device, report: reports.Write(report), workers=args.jobs, timeout=args.timeout, event=event)
+	except KeyboardInterrupt:
+		pass
+
+# Device opener for --record/--replay/--sg-async, None for plain devices
+def Opener(args, multiple=False):
+	if args.replay:
+		return capture.ReplayDevice
+	device = None
+	if getattr(args, "sg_async", False):
+		import sgasync
+		device = sgasync.Device
+	if args.record:
+		def record(path):
+			filename = args.record
+			if multiple:
+				filename += "." + "".join(c if c.isalnum() else "_" for c in path).strip("_")
+			return capture.RecordingDevice((device or scsi.Device)(path), filename)
+		return record
+	return device
 
 def SetCommonParams(parser):
-	parser.add_argument("device", help="Device name (in form of F: (volume F) or /dev/sdb)", type=str)
-	#TODO: also support #0 (PhysicalDrive 0) or :VID:PID or &intance
+	parser.add_argument("device", help="Device name(s) (in form of F: (volume F) or /dev/sdb). On Linux also :VID:PID, @PORT, #N or a /dev/sd* glob", type=str, nargs="*")
+	#TODO: also support #0 (PhysicalDrive 0) on Windows
+	parser.add_argument("-a", "--all", help="Probe all removable devices", action="store_true")
+	parser.add_argument("-j", "--jobs", help="Number of devices probed at once (default: 16)", type=int, default=16)
+	parser.add_argument("-w", "--watch", help="Probe devices as they are plugged in", action="store_true")
+	parser.add_argument("-t", "--timeout", help="Per-device probe timeout for multiple devices, seconds (default: 60)", type=float, default=60)
 	parser.add_argument("-b", "--benchmark", help="Perform IO benchmark", action="store_true")
+	parser.add_argument("-s", "--scan", help="Read the whole device, report speed profile and bad sectors", action="store_true")
+	parser.add_argument("-c", "--check-capacity", help="Detect fake capacity by writing sample sectors (original data is restored)", action="store_true")
 	parser.add_argument("-r", "--report", help="Write report to file", dest="report")
+	parser.add_argument("-f", "--format", help="Report format: text, JSON Lines or CSV (default: text)", choices=output.formats, default="text")
 	parser.add_argument("-v", "--verbose", help="Verbose output", action="store_true")
 	parser.add_argument("-p", "--plugin", help="Force plugin(s)", type=str)
+	parser.add_argument("--record", help="Record device traffic to a capture file (device name is appended for multiple devices)", metavar="FILE")
+	parser.add_argument("--replay", help="Device names are capture files to replay", action="store_true")
+	parser.add_argument("--stats", help="Print SCSI command statistics per plugin and command", action="store_true")
+	parser.add_argument("--scsi-timeout", help="Default SCSI command timeout, seconds (default: %d)"%scsi.defaultTimeout, type=float, default=scsi.defaultTimeout)
+	parser.add_argument("--no-retry", help="Do not retry failed SCSI commands", action="store_true")
+	if sys.platform.startswith("linux"):
+		parser.add_argument("--sg-async", help="Queue SCSI commands to the sg driver asynchronously, one completion thread for all devices", action="store_true")
+	parser.add_argument("--no-cache", help="Do not use cached probe results", action="store_true")
+	parser.add_argument("--cache-ttl", help="Probe cache lifetime, seconds (default: %d)"%probecache.ttl, type=float, default=probecache.ttl)
+	benchmark.AddParameters(parser)
+	surface.AddParameters(parser)
 
 def Main():
-	print(_version)
-	controller.LoadPlugins()
-	print("Supported controllers: %s"%(",".join(controller.GetPlugins())))
-	print("")
-
-	#TODO: need to apply plugin's options now to show correct help
+	global _info
 
-	parser = argparse.ArgumentParser()
+	# first pass only picks the plugins, help is shown once their options are known
+	parser = argparse.ArgumentParser(add_help=False)
 	SetCommonParams(parser)
 	args = parser.parse_known_args()[0]
+	if args.format != "text" and args.report == None:
+		_info = sys.stderr
+
+	Info(_version)
+	controller.LoadPlugins()
+	Info("Supported controllers: %s"%(",".join(controller.GetPlugins())))
+	Info()
+
 	plugins = args.plugin.split(",") if args.plugin else None
 	#controller.LoadPlugins(plugins, args.verbose)
 	# all plugins are already loaded, just remove those we don't want
 	if plugins != None:
 		controller.UnloadPlugins(keep=plugins)
-		print("Selected controllers: %s"%(",".join(controller.GetPlugins())))
+		Info("Selected controllers: %s"%(",".join(controller.GetPlugins())))
 
 	# register controller-specific options and parse args again
+	parser = argparse.ArgumentParser()
+	SetCommonParams(parser)
 	for plugin in controller.plugins:
 		controller.plugins[plugin].AddParameters(parser)
 	args = parser.parse_args()
 
-	report = ProcessDeviceByLetter(args.device, verbose=args.verbose)
+	if sys.platform.startswith("linux") and not args.replay:
+		args.device, unmatched = sysfs.Expand(args.device)
+		for selector in unmatched:
+			Info("No device matches %s"%selector)
+		if len(unmatched) > 0 and len(args.device) == 0:
+			sys.exit(1)
 
-	if args.benchmark:
-		#TODO benchmark the device
-		pass
+	if not args.all and not args.watch and len(args.device) == 0:
+		parser.error("device name, --all or --watch is required")
+	# benchmark, capacity check and surface scan work on one device only
+	if (args.benchmark or args.check_capacity or args.scan) and (args.all or args.watch or len(args.device) > 1):
+		parser.error("-b, -c and -s take a single device, not several, --all or --watch")
+
+	scsi.defaultTimeout = args.scsi_timeout
+	if args.no_retry:
+		scsi.defaultRetries.clear()
+	# a capture needs the real traffic
+	probecache.enabled = not (args.no_cache or args.record or args.replay)
+	probecache.ttl = args.cache_ttl
+	collector = stats.Stats().Install() if args.stats else None
+	reports = Reports(args)
+	try:
+		if args.watch:
+			WatchDevices(args, reports)
+			return
+		if args.all or len(args.device) > 1:
+			ScanAll(args, reports)
+			return
+		device = args.device[0]
+
+		report = ProcessDeviceByName(device, verbose=args.verbose, opener=Opener(args))
+
+		if args.benchmark and not args.replay:
+			benchmark.Benchmark(DevicePath(device)[0], report, mode=args.bench_mode, qd=args.bench_qd,
+				seconds=args.bench_time, budget=args.bench_bytes, warmup=args.bench_warmup)
+		if args.check_capacity and not args.replay:
+			fakecap.Check(DevicePath(device)[0], report)
+		if args.scan and not args.replay:
+			surface.Surface(DevicePath(device)[0], report, mode=args.scan_mode, chunk=args.scan_chunk * 1024,
+				depth=args.scan_depth, regions=args.scan_regions, mapfile=args.scan_map,
+				progress=output.PrintProgress if args.verbose else None)
 
-	PrintReport(report, args.report)
+		reports.Write(report)
+	finally:
+		reports.Close()
+		probecache.Flush()
+		if collector != None:
+			collector.Uninstall()
+			Info()
+			for line in collector.Summary():
+				Info(line)
 
 Main()
@@ -0,0 +1,173 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+# asyncio API
+# Probes run on a dedicated thread pool, device IO stays blocking there.
+# Requests to one device are serialized. A cancelled or timed out probe
+# stops before its next SCSI command, the device is only released once
+# its worker thread has actually finished
+#
+#	prober = asyncprobe.Prober(workers=64)
+#	async for entry in prober.Entries("/dev/sdb", timeout=30):
+#		...
+#	report = await prober.Probe("/dev/sdc")
+
+import asyncio
+import threading
+import concurrent.futures
+import scsi
+import controller
+import devprobe
+import sysfs
+
+# Derived from BaseException, so retry loops and report error handlers
+# that catch Exception let it through
+class Cancelled(BaseException):
+	pass
+
+"""
+	Device wrapper that refuses to send more commands once cancelled
+"""
+class CancellableDevice:
+	def __init__(self, dctl, event):
+		self.dctl = dctl
+		self.event = event
+
+	def ScsiRequest(self, cdb, data, dataIn=True, mayFail=False, timeout=5):
+		if self.event.is_set():
+			raise Cancelled()
+		return scsi.SendRequest(self.dctl, cdb, data, dataIn, mayFail, timeout)
+
+	def GetCapacity(self):
+		if self.event.is_set():
+			raise Cancelled()
+		return scsi.GetCapacity(self.dctl)
+
+	def LastStatus(self):
+		return scsi.LastStatus(self.dctl)
+
+class Prober:
+	def __init__(self, workers=32, timeout=None, opener=None):
+		self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chipinfo")
+		self.timeout = timeout
+		self.opener = opener if opener != None else scsi.Device
+		self._locks = {}
+		if len(controller.plugins) == 0:
+			controller.LoadPlugins()
+
+	def _Lock(self, device):
+		lock = self._locks.get(device)
+		if lock == None:
+			lock = self._locks[device] = asyncio.Lock()
+		return lock
+
+	"""
+		Async iterator over the report entries of device, starting with
+		("Device", device). A probe failure gives an ("Error", e) entry like
+		the command line tool does, running past timeout (seconds) raises
+		asyncio.TimeoutError
+	"""
+	async def Entries(self, device, timeout=None, verbose=False):
+		loop = asyncio.get_running_loop()
+		entries = asyncio.Queue()
+		cancel = threading.Event()
+		done = object()
+		if timeout == None:
+			timeout = self.timeout
+
+		def Put(item):
+			try:
+				loop.call_soon_threadsafe(entries.put_nowait, item)
+			except RuntimeError:
+				cancel.set()	# loop is gone
+
+		def Run():
+			try:
+				Put(("Device", device))
+				with self.opener(device) as dctl:
+					for entry in devprobe.ProbeDevice(CancellableDevice(dctl, cancel), verbose, sysfs.UsbId(device)):
+						Put(entry)
+			except Cancelled:
+				pass
+			except Exception as e:
+				Put(("Error", e))
+			finally:
+				Put(done)
+
+		# waiting for an earlier probe of the device counts against timeout,
+		# that one may be stuck in the device
+		deadline = loop.time() + timeout if timeout != None else None
+		lock = self._Lock(device)
+		acquire = asyncio.ensure_future(lock.acquire())
+		try:
+			await asyncio.wait([acquire], timeout=max(0, deadline - loop.time()) if deadline != None else None)
+		finally:
+			if not acquire.done():
+				acquire.cancel()
+				# it may still get the lock before the cancellation lands
+				acquire.add_done_callback(lambda f: lock.release() if not f.cancelled() else None)
+		if not acquire.done() or acquire.cancelled():
+			raise asyncio.TimeoutError("Probe of %s timed out after %g s waiting for the device"%(device, timeout))
+		try:
+			worker = loop.run_in_executor(self.executor, Run)
+		except BaseException:
+			lock.release()
+			raise
+		worker.add_done_callback(lambda f: lock.release())
+
+		try:
+			while True:
+				wait = max(0, deadline - loop.time()) if deadline != None else None
+				try:
+					item = await asyncio.wait_for(entries.get(), wait)
+				except asyncio.TimeoutError:
+					raise asyncio.TimeoutError("Probe of %s timed out after %g s"%(device, timeout))
+				if item is done:
+					break
+				yield item
+		finally:
+			cancel.set()
+
+	# Complete report of device as a list
+	async def Probe(self, device, timeout=None, verbose=False):
+		return [entry async for entry in self.Entries(device, timeout, verbose)]
+
+	def Close(self):
+		self.executor.shutdown(wait=False)
+
+_default = None
+
+def DefaultProber():
+	global _default
+	if _default == None:
+		_default = Prober()
+	return _default
+
+def Entries(device, timeout=None, verbose=False):
+	return DefaultProber().Entries(device, timeout, verbose)
+
+async def Probe(device, timeout=None, verbose=False):
+	return await DefaultProber().Probe(device, timeout, verbose)
@@ -0,0 +1,256 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+# Disk IO benchmark
+# Reads go either through SCSI READ commands or through the plain
+# block device (or a regular file standing in for it), the latter either
+# buffered with one thread per request or through an IO engine keeping
+# qd requests in flight from a single thread
+
+import os
+import math
+import mmap
+import errno
+import time
+import random
+import threading
+import ioengine
+import scsi
+
+SectorSize = 512
+
+# (name, sequential, block size)
+defaultTests = [
+	("Seq 1M", True, 1024 * 1024),
+	("Seq 64K", True, 64 * 1024),
+	("Seq 4K", True, 4 * 1024),
+	("Rnd 1M", False, 1024 * 1024),
+	("Rnd 64K", False, 64 * 1024),
+	("Rnd 4K", False, 4 * 1024),
+	]
+
+def AddParameters(parser):
+	group = parser.add_argument_group("Benchmark")
+	group.add_argument("--bench-mode", help="IO path: block device, SCSI commands or an IO engine (default: block)", choices=list(readers) + ioengine.names, default="block")
+	group.add_argument("--bench-qd", help="Queue depth (default: 1)", type=int, default=1)
+	group.add_argument("--bench-time", help="Time budget per test, seconds (default: 5)", type=float, default=5)
+	group.add_argument("--bench-bytes", help="Byte budget per test, 0 for unlimited (default: 0)", type=int, default=0)
+	group.add_argument("--bench-warmup", help="Warm-up time per test, seconds (default: 1)", type=float, default=1)
+
+# Plain block device/file reader. Opened with O_DIRECT where the file
+# system allows it, so reads measure the device rather than the page
+# cache. Buffers must then be page-aligned
+class BlockReader:
+	def __init__(self, path):
+		self.path = path
+		self.fd, self.direct = ioengine.OpenDirect(path)
+		self._buffered = None
+
+	def Read(self, offset, buf):
+		if not hasattr(os, "preadv"):
+			os.lseek(self.fd, offset, os.SEEK_SET)
+			data = os.read(self.fd, len(buf))
+			count = len(data)
+			buf[:count] = data
+		else:
+			try:
+				count = os.preadv(self.fd, [buf], offset)
+			except OSError as e:
+				if e.errno != errno.EINVAL or not self.direct:
+					raise
+				# transfer the device will not take unbuffered
+				if self._buffered == None:
+					self._buffered = os.open(self.path, os.O_RDONLY)
+				count = os.preadv(self._buffered, [buf], offset)
+		# past the end of the device, or it stopped answering part way
+		if count != len(buf):
+			raise Exception("Short read at offset %d: %d of %d bytes"%(offset, count, len(buf)))
+
+	def Close(self):
+		if self._buffered != None:
+			os.close(self._buffered)
+		os.close(self.fd)
+
+# SCSI READ(10) reader, each instance owns its own device handle
+class ScsiReader:
+	def __init__(self, path):
+		self.dctl = scsi.Device(path).__enter__()
+
+	def Read(self, offset, buf):
+		scsi.ReadSectors(self.dctl, offset // SectorSize, len(buf) // SectorSize, buf)
+
+	def Close(self):
+		self.dctl.__exit__(None, None, None)
+
+readers = {
+	"block": BlockReader,
+	"scsi": ScsiReader,
+	}
+
+def Percentile(values, p):
+	if len(values) == 0:
+		return None
+	index = min(len(values) - 1, max(0, math.ceil(p / 100.0 * len(values)) - 1))
+	return values[index]
+
+"""
+	One benchmark run: qd workers issue reads of blocksize bytes until
+	either time or byte budget is exhausted
+"""
+class Run:
+	def __init__(self, path, mode, capacity, sequential, blocksize, qd=1):
+		self.path = path
+		self.mode = mode
+		self.blocks = capacity // blocksize
+		self.sequential = sequential
+		self.blocksize = blocksize
+		self.qd = max(1, qd)
+		self.engine = None
+		self._lock = threading.Lock()
+
+	def _NextOffset(self, rnd):
+		if self.sequential:
+			with self._lock:
+				block = self._next
+				self._next = (self._next + 1) % self.blocks
+		else:
+			block = rnd.randrange(self.blocks)
+		return block * self.blocksize
+
+	def _Worker(self, reader, seed, deadline, latencies):
+		with scsi.Context("Bench"):
+			self._Loop(reader, seed, deadline, latencies)
+
+	def _Loop(self, reader, seed, deadline, latencies):
+		rnd = random.Random(seed)
+		buf = mmap.mmap(-1, self.blocksize)
+		while time.perf_counter() < deadline:
+			if self.budget:
+				with self._lock:
+					if self._done >= self.budget:
+						break
+					self._done += self.blocksize
+			offset = self._NextOffset(rnd)
+			start = time.perf_counter()
+			reader.Read(offset, buf)
+			latencies.append(time.perf_counter() - start)
+		buf.close()
+
+	# Seeds for the workers of the next pass. Every pass gets its own, so the
+	# measured random reads do not repeat the warm-up ones
+	def _Seeds(self, count):
+		seeds = list(range(self._seed, self._seed + count))
+		self._seed += count
+		return seeds
+
+	def _Pass(self, seconds, budget):
+		self._done = 0
+		self.budget = budget
+		deadline = time.perf_counter() + seconds
+		latencies = [[] for i in range(self.qd)]
+		seeds = self._Seeds(self.qd)
+		workers = [threading.Thread(target=self._Worker, args=(self._readers[i], seeds[i], deadline, latencies[i])) for i in range(self.qd)]
+		start = time.perf_counter()
+		for w in workers:
+			w.start()
+		for w in workers:
+			w.join()
+		elapsed = time.perf_counter() - start
+		return elapsed, sorted(sum(latencies, []))
+
+	def _Jobs(self, rnd, deadline, budget):
+		done = 0
+		while time.perf_counter() < deadline and (not budget or done < budget):
+			done += self.blocksize
+			yield self._NextOffset(rnd), self.blocksize
+
+	def _EnginePass(self, seconds, budget):
+		latencies = []
+		jobs = self._Jobs(random.Random(self._Seeds(1)[0]), time.perf_counter() + seconds, budget)
+		start = time.perf_counter()
+		for offset, view, result, latency in ioengine.Stream(self._engine, jobs):
+			if result != len(view):
+				raise Exception("Read failure at offset %d: %d" % (offset, result))
+			latencies.append(latency)
+		elapsed = time.perf_counter() - start
+		return elapsed, sorted(latencies)
+
+	def Execute(self, seconds=5, budget=0, warmup=1):
+		if self.blocks == 0:
+			raise Exception("Device is smaller than the block size")
+		if self.mode in ioengine.names:
+			self._engine = ioengine.Create(self.path, self.mode, self.qd, self.blocksize)
+			self.engine = self._engine.name
+			run, close = self._EnginePass, [self._engine]
+		else:
+			self._readers = [readers[self.mode](self.path) for i in range(self.qd)]
+			run, close = self._Pass, self._readers
+		# sequential reads go on from where the warm-up stopped
+		self._next = 0
+		self._seed = 0
+		try:
+			if warmup > 0:
+				run(warmup, 0)
+			elapsed, latencies = run(seconds, budget)
+		finally:
+			for reader in close:
+				reader.Close()
+
+		count = len(latencies)
+		return {
+			"mbps": count * self.blocksize / elapsed / 1000000 if elapsed > 0 else 0,
+			"iops": count / elapsed if elapsed > 0 else 0,
+			"p50": Percentile(latencies, 50),
+			"p99": Percentile(latencies, 99),
+			"p999": Percentile(latencies, 99.9),
+			"ios": count,
+			"bytes": count * self.blocksize,
+			"engine": self.engine,
+			}
+
+def FormatResult(result):
+	lat = ["%.3f"%(result[p] * 1000) if result[p] != None else "-" for p in ("p50", "p99", "p999")]
+	text = "%.2f MB/s, %d IOPS, latency p50/p99/p99.9 %s/%s/%s ms"%(result["mbps"], result["iops"], lat[0], lat[1], lat[2])
+	if result.get("engine") != None:
+		text += " (%s)"%result["engine"]
+	return text
+
+"""
+	Run the benchmark set and append results to the report
+"""
+def Benchmark(path, report, mode="block", qd=1, seconds=5, budget=0, warmup=1, tests=defaultTests):
+	with scsi.Device(path) as dctl:
+		capacity = scsi.GetCapacity(dctl)
+
+	for name, sequential, blocksize in tests:
+		key = "Bench %s QD%d"%(name, qd)
+		try:
+			run = Run(path, mode, capacity, sequential, blocksize, qd)
+			report.append((key, run.Execute(seconds, budget, warmup), "bench"))
+		except Exception as e:
+			report.append((key, e))
+
+	return report
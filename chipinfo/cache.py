@@ -0,0 +1,78 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+# Per-user cache files
+# Location: $CHIPINFO_CACHE, else %LOCALAPPDATA%\chipinfo on Windows,
+# else $XDG_CACHE_HOME/chipinfo or ~/.cache/chipinfo
+
+import os
+import sys
+import json
+
+def CacheDir():
+	path = os.environ.get("CHIPINFO_CACHE")
+	if not path:
+		if sys.platform == "win32" and os.environ.get("LOCALAPPDATA"):
+			root = os.environ["LOCALAPPDATA"]
+		else:
+			root = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+		path = os.path.join(root, "chipinfo")
+	return path
+
+def CachePath(name):
+	return os.path.join(CacheDir(), name)
+
+# Load a JSON cache file, None if missing or broken
+def LoadJson(name):
+	try:
+		with open(CachePath(name), "rt") as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return None
+
+# Save a cache file atomically. Failures are ignored, cache is optional
+def SaveBinary(name, data):
+	path = CachePath(name)
+	temp = "%s.%d.tmp"%(path, os.getpid())
+	try:
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(temp, "wb") as f:
+			f.write(data)
+		os.replace(temp, path)
+		return True
+	except OSError:
+		try:
+			os.remove(temp)
+		except OSError:
+			pass
+		return False
+
+def SaveJson(name, data):
+	try:
+		data = json.dumps(data).encode()
+	except (TypeError, ValueError):
+		return False
+	return SaveBinary(name, data)
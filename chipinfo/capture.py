@@ -0,0 +1,229 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+# Device session capture and replay
+#
+# RecordingDevice wraps any device and logs every command to a capture
+# file. ReplayDevice serves the logged responses back, so the whole
+# detection and reporting stack can run without the hardware.
+#
+# File format: 8-byte magic, then records of
+#   <BBBBIIIIH kind, flags, cdb length, SCSI status, transfer length,
+#              data-out length, data-in length, latency (us), sense length
+# followed by cdb, data-out, data-in and sense bytes. Version 1 files
+# (<BBBxIIII, no status or sense) are still read
+
+import struct
+import time
+import collections
+import scsi
+
+_magic = b"CHIECAP\x02"
+_header = struct.Struct("<BBBBIIIIH")
+_magic1 = b"CHIECAP\x01"
+_header1 = struct.Struct("<BBBxIIII")
+
+KIND_SCSI = 1
+KIND_CAPACITY = 2
+
+FLAG_DATAIN = 1
+FLAG_OK = 2
+
+Record = collections.namedtuple("Record", "kind dataIn ok cdb length dataOut response latency status sense")
+
+def _Bytes(data):
+	if isinstance(data, list):
+		return bytes(x & 0xFF for x in data)
+	return bytes(memoryview(data).cast('B'))
+
+def _Length(data):
+	if isinstance(data, int):
+		return data
+	if isinstance(data, list):
+		return len(data)
+	return memoryview(data).nbytes
+
+# Store a replayed payload the same way a transport would
+def _Deliver(data, payload):
+	length = _Length(data)
+	payload = payload[:length].ljust(length, b"\0")
+	if isinstance(data, int):
+		return memoryview(bytearray(payload))
+	if isinstance(data, list):
+		data[:] = payload
+	else:
+		memoryview(data).cast('B')[:] = payload
+	return data
+
+def WriteRecord(f, kind, dataIn, ok, cdb, length, dataOut, response, latency, status=0, sense=b""):
+	flags = (FLAG_DATAIN if dataIn else 0) | (FLAG_OK if ok else 0)
+	f.write(_header.pack(kind, flags, len(cdb), status & 0xFF, length, len(dataOut), len(response), int(latency * 1000000), len(sense)))
+	f.write(cdb)
+	f.write(dataOut)
+	f.write(response)
+	f.write(sense)
+
+def ReadCapture(filename):
+	with open(filename, "rb") as f:
+		raw = f.read()
+	version1 = raw[:len(_magic1)] == _magic1
+	if raw[:len(_magic)] != _magic and not version1:
+		raise Exception("%s is not a capture file"%filename)
+	header = _header1 if version1 else _header
+	records = []
+	pos = len(_magic)
+	while pos + header.size <= len(raw):
+		if version1:
+			kind, flags, cdblen, length, outlen, inlen, latency = header.unpack_from(raw, pos)
+			status, senselen = (0 if flags & FLAG_OK else 2), 0
+		else:
+			kind, flags, cdblen, status, length, outlen, inlen, latency, senselen = header.unpack_from(raw, pos)
+		pos += header.size
+		cdb = raw[pos:pos + cdblen]
+		pos += cdblen
+		dataOut = raw[pos:pos + outlen]
+		pos += outlen
+		response = raw[pos:pos + inlen]
+		pos += inlen
+		sense = raw[pos:pos + senselen]
+		pos += senselen
+		records.append(Record(kind, bool(flags & FLAG_DATAIN), bool(flags & FLAG_OK), cdb, length, dataOut, response, latency / 1000000.0, status, sense))
+	return records
+
+"""
+	Wrap an (unopened) device and log all traffic to filename
+"""
+class RecordingDevice:
+	def __init__(self, device, filename):
+		self.device = device
+		self.filename = filename
+		self._file = None
+
+	def __enter__(self):
+		self.dctl = self.device.__enter__()
+		self._file = open(self.filename, "wb")
+		self._file.write(_magic)
+		return self
+
+	def __exit__(self, typ, val, tb):
+		self._file.close()
+		return self.device.__exit__(typ, val, tb)
+
+	# retries are left to the caller, so every attempt is recorded
+	def ScsiRequest(self, cdb, data, dataIn=True, mayFail=False, timeout=5):
+		cdbBytes = _Bytes(cdb)
+		dataOut = b"" if dataIn else _Bytes(data)
+		start = time.perf_counter()
+		try:
+			result = scsi.SendRequest(self.dctl, cdb, data, dataIn, True, timeout)
+		except Exception:
+			result = None
+		latency = time.perf_counter() - start
+
+		ok = result != None
+		payload = _Bytes(result) if ok and dataIn else b""
+		status, sense = 0, b""
+		if not ok:
+			try:
+				status, sense = scsi.LastStatus(self.dctl)
+			except Exception:
+				status = 2
+		WriteRecord(self._file, KIND_SCSI, dataIn, ok, cdbBytes, _Length(data), dataOut, payload, latency, status, bytes(sense or b""))
+
+		if not ok and mayFail == False:
+			raise Exception("SCSI request failure (opcode 0x%02X)"%cdbBytes[0])
+		return result
+
+	def LastStatus(self):
+		return scsi.LastStatus(self.dctl)
+
+	def GetCapacity(self):
+		start = time.perf_counter()
+		capacity = scsi.GetCapacity(self.dctl)
+		WriteRecord(self._file, KIND_CAPACITY, True, True, b"", 8, b"", struct.pack("<Q", capacity), time.perf_counter() - start)
+		return capacity
+
+"""
+	Serve responses from a capture file. Requests are matched by CDB,
+	direction and data-out payload. Repeated requests get the recorded
+	responses in order, the last one is reused once they run out
+	If realtime is set, recorded latencies are reproduced
+"""
+class ReplayDevice:
+	def __init__(self, filename, realtime=False):
+		self.filename = filename
+		self.realtime = realtime
+
+	def __enter__(self):
+		self._ok = True
+		self._status = 0
+		self._sense = b""
+		self._responses = {}
+		self._capacity = collections.deque()
+		for record in ReadCapture(self.filename):
+			if record.kind == KIND_CAPACITY:
+				self._capacity.append(record)
+			else:
+				key = (record.cdb, record.dataIn, record.dataOut)
+				self._responses.setdefault(key, collections.deque()).append(record)
+		return self
+
+	def __exit__(self, typ, val, tb):
+		return
+
+	def _Next(self, queue):
+		record = queue[0] if len(queue) == 1 else queue.popleft()
+		if self.realtime:
+			time.sleep(record.latency)
+		return record
+
+	def ScsiRequest(self, cdb, data, dataIn=True, mayFail=False, timeout=5):
+		cdbBytes = _Bytes(cdb)
+		queue = self._responses.get((cdbBytes, dataIn, b"" if dataIn else _Bytes(data)))
+		record = self._Next(queue) if queue else None
+		self._ok = record != None and record.ok
+		if record != None:
+			self._status, self._sense = record.status, record.sense
+		else:
+			self._status, self._sense = 2, b""
+
+		if not self._ok:
+			if mayFail == False:
+				raise Exception("SCSI request failure (opcode 0x%02X, replayed)"%cdbBytes[0])
+			return None
+		if dataIn:
+			return _Deliver(data, record.response)
+		return True
+
+	# recorded status and sense, so the retry policy sees what the device said.
+	# Unknown requests and version 1 failures report CHECK CONDITION
+	def LastStatus(self):
+		return self._status, self._sense
+
+	def GetCapacity(self):
+		if len(self._capacity) == 0:
+			raise Exception("No capacity recorded in %s"%self.filename)
+		return struct.unpack("<Q", self._Next(self._capacity).response)[0]
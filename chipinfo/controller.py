@@ -26,28 +26,248 @@
 
 import scsi
 import os
-import glob
-import imp
+import sys
+import json
+import threading
+import importlib
+import importlib.util
+import cache
 
 plugins = {}
 
+# Standard inquiry data fields, for use in plugin signatures
+VENDOR = 8
+PRODUCT = 16
+REVISION = 32
+
+# Detection index: (signatures, unindexed plugin names, USB IDs, load order)
+# signatures: (offset, length) -> {bytes: [plugin names]}
+# USB IDs: vid -> [(first pid, last pid, plugin name)]
+# Built on first detection, dropped whenever the plugin set changes. It is
+# replaced as a whole, so scan threads always see one consistent index
+_index = None
+
+# Plugin manifest: whatever is needed before a plugin is actually used
+# (name, signatures, command line options) is cached, so plugin modules
+# are only imported once detection selects them
+_manifestName = "plugins.json"
+_manifestVersion = 2
+_entryPointGroup = "chipinfo.plugins"
+
+# argparse types that can be stored in the manifest
+_types = {"str": str, "int": int, "float": float}
+
+"""
+	Records parser.add_argument calls made by a plugin's AddParameters
+"""
+class _OptionRecorder:
+	def __init__(self):
+		self.calls = []
+
+	def add_argument_group(self, *args, **kwargs):
+		group = _OptionRecorder()
+		self.calls.append(["group", args, kwargs, group.calls])
+		return group
+
+	def add_argument(self, *args, **kwargs):
+		if "type" in kwargs:
+			if kwargs["type"] not in _types.values():
+				raise TypeError("Option type can not be cached")
+			kwargs["type"] = kwargs["type"].__name__
+		self.calls.append(["arg", args, kwargs])
+
+def _ReplayOptions(parser, calls):
+	for call in calls:
+		if call[0] == "group":
+			_ReplayOptions(parser.add_argument_group(*call[1], **call[2]), call[3])
+		else:
+			kwargs = dict(call[2])
+			if "type" in kwargs:
+				kwargs["type"] = _types[kwargs["type"]]
+			parser.add_argument(*call[1], **kwargs)
+
+"""
+	Stand-in for a plugin module. Answers manifest queries itself and
+	imports the real module on first access to anything else
+"""
+class PluginProxy:
+	def __init__(self, entry, load):
+		self._entry = entry
+		self._load = load
+		self._module = None
+
+	# Probes run in parallel, the first one to need the module imports it
+	# while the others wait
+	def Module(self):
+		module = self._module
+		if module == None:
+			with _importLock:
+				if self._module == None:
+					self._module = self._load()
+				module = self._module
+		return module
+
+	def Name(self):
+		return self._entry["name"]
+
+	def Enabled(self):
+		return self._entry["enabled"]
+
+	def AddParameters(self, parser):
+		if self._entry["options"] == None:
+			return self.Module().AddParameters(parser)
+		_ReplayOptions(parser, self._entry["options"])
+
+	def __getattr__(self, attr):
+		if attr.startswith("_"):
+			raise AttributeError(attr)
+		if attr == "Signatures":
+			signatures = self._entry["signatures"]
+			if signatures == None:
+				raise AttributeError(attr)
+			return lambda: [(offset, bytes.fromhex(tag)) for offset, tag in signatures]
+		if attr == "UsbIds":
+			usbids = self._entry["usbids"]
+			if usbids == None:
+				raise AttributeError(attr)
+			return lambda: [(vid, (first, last)) for vid, first, last in usbids]
+		return getattr(self.Module(), attr)
+
+# Collect manifest data from an imported plugin module
+def _Describe(plugin):
+	entry = {"name": plugin.Name(), "enabled": bool(plugin.Enabled())}
+
+	if hasattr(plugin, "Signatures"):
+		entry["signatures"] = [[offset, bytes(tag).hex()] for offset, tag in plugin.Signatures()]
+	else:
+		entry["signatures"] = None
+
+	if hasattr(plugin, "UsbIds"):
+		entry["usbids"] = [[vid, first, last] for vid, (first, last) in (_PidRange(usbid) for usbid in plugin.UsbIds())]
+	else:
+		entry["usbids"] = None
+
+	# options are kept only if they can be replayed without the module
+	recorder = _OptionRecorder()
+	try:
+		plugin.AddParameters(recorder)
+		json.dumps(recorder.calls)
+		entry["options"] = recorder.calls
+	except Exception:
+		entry["options"] = None
+
+	return entry
+
+# Plugin imports are serialised, a module sits in sys.modules half
+# initialised while its code runs
+_importLock = threading.RLock()
+
+def _LoadFile(pn, path):
+	def load():
+		with _importLock:
+			if pn in sys.modules:
+				return sys.modules[pn]
+			spec = importlib.util.spec_from_file_location(pn, path)
+			module = importlib.util.module_from_spec(spec)
+			sys.modules[pn] = module
+			try:
+				spec.loader.exec_module(module)
+			except Exception:
+				del sys.modules[pn]
+				raise
+			return module
+	return load
+
+# Third-party plugins registered under the chipinfo.plugins entry point group
+# Return [[value, version]]. Reading package metadata is slow, so the list
+# is cached and only rebuilt when a sys.path directory changes
+def _EntryPoints(manifest):
+	stamp = []
+	for path in sys.path:
+		try:
+			stamp.append([path, os.stat(path or ".").st_mtime_ns])
+		except OSError:
+			pass
+	cached = manifest.get("entrypoints")
+	if cached != None and cached["stamp"] == stamp:
+		return cached["list"]
+
+	found = []
+	try:
+		import importlib.metadata as metadata
+		eps = metadata.entry_points()
+		if hasattr(eps, "select"):
+			eps = eps.select(group=_entryPointGroup)
+		else:
+			eps = eps.get(_entryPointGroup, [])
+		for ep in eps:
+			dist = getattr(ep, "dist", None)
+			found.append([ep.value, getattr(dist, "version", None)])
+	except Exception:
+		pass
+	manifest["entrypoints"] = {"stamp": stamp, "list": found}
+	return found
+
+# Import an entry point given as "module:attr"
+def _LoadEntryPoint(value):
+	def load():
+		module, _, attrs = value.partition(":")
+		plugin = importlib.import_module(module.strip())
+		for attr in attrs.strip().split(".") if attrs.strip() else []:
+			plugin = getattr(plugin, attr)
+		return plugin
+	return load
+
+"""
+	Enumerate plugin sources: built-in ctl_*.py files, then entry points
+	Yield (manifest key, stamp, loader)
+"""
+def _Sources(manifest):
+	root = os.path.dirname(os.path.abspath(__file__))
+	for fn in sorted(os.listdir(root)):
+		if fn.startswith("ctl_") and fn.endswith(".py"):
+			path = os.path.join(root, fn)
+			st = os.stat(path)
+			yield path, [st.st_mtime_ns, st.st_size], _LoadFile(fn[:-3], path)
+
+	for value, version in _EntryPoints(manifest):
+		yield "entrypoint:" + value, [version], _LoadEntryPoint(value)
+
 """
 	Load controller plugins
 	If names specified, load named plugins only
 """
 def LoadPlugins(names=None, verbose=False):
-	root = os.path.dirname(os.path.abspath(__file__))
-	for p in glob.glob(root + "/ctl_*.py"):
-		pn = os.path.splitext(os.path.basename(p))[0]
-		fp, path, desc = imp.find_module(pn)
-		#print(fp, path, desc)
-		try:
-			plugin = imp.load_module(pn, fp, path, desc)
-			if plugin.Enabled():
-				if names == None or names == [] or plugin.Name() in names:
-					plugins[plugin.Name()] = plugin
-		finally:
-			if fp: fp.close
+	manifest = cache.LoadJson(_manifestName)
+	if manifest == None or manifest.get("version") != _manifestVersion:
+		manifest = {"version": _manifestVersion, "plugins": {}}
+	known = manifest["plugins"]
+	current = {}
+	changed = False
+
+	entrypoints = manifest.get("entrypoints")
+	for key, stamp, load in _Sources(manifest):
+		entry = known.get(key)
+		module = None
+		# entry points without a version are never cached
+		if entry == None or entry["stamp"] != stamp or None in stamp:
+			try:
+				module = load()
+				entry = _Describe(module)
+			except Exception as e:
+				if verbose:
+					print("Failed to load plugin %s: %s"%(key, e), file=sys.stderr)
+				continue
+			entry["stamp"] = stamp
+			changed = True
+		current[key] = entry
+
+		if entry["enabled"]:
+			if names == None or names == [] or entry["name"] in names:
+				plugin = PluginProxy(entry, load)
+				plugin._module = module
+				plugins[entry["name"]] = plugin
+				_InvalidateIndex()
 		# TODO: IDEA: let plugin to dictate which other plugins it want to disable
 		#pn = GetPlugins()
 		#for p in pn:
@@ -55,7 +275,10 @@ def LoadPlugins(names=None, verbose=False):
 		#		for candidate in p.OverridePlugins():
 		#			if candidate in plugins:
 		#				del(plugins[candidate])
-	# TODO: sort by names
+
+	if changed or len(current) != len(known) or manifest.get("entrypoints") is not entrypoints:
+		manifest["plugins"] = current
+		cache.SaveJson(_manifestName, manifest)
 	return
 
 """
@@ -63,30 +286,147 @@ def LoadPlugins(names=None, verbose=False):
 	If keep is specified, do not unload these plugins
 """
 def UnloadPlugins(names=None, keep=None):
-	pns = GetPlugins()
+	pns = list(GetPlugins())
 	for name in pns:
 		if keep != None and name in keep:
 			continue
 		if names == None or name in names:
 			del(plugins[name]) 
+			_InvalidateIndex()
 
 def GetPlugins():
 	return plugins.keys()
 
+# (vid, pid), (vid, None) or (vid, (first, last)) to (vid, (first, last))
+def _PidRange(usbid):
+	vid, pid = usbid
+	if pid == None:
+		return vid, (0, 0xFFFF)
+	if isinstance(pid, int):
+		return vid, (pid, pid)
+	return vid, tuple(pid)
+
+def _InvalidateIndex():
+	global _index
+	_index = None
+
 """
-	Controller detection
+	Compile inquiry signatures of all plugins into a single lookup index
+	Plugins without Signatures() are always polled
 """
-def DetectController(dctl, verbose=False):
-	inquiry = scsi.Inquiry(dctl)
-	if verbose:
-		open("_inq_12.bin", "wb+").write(bytearray(inquiry))
-
+def _BuildIndex():
+	global _index
+	index = {}
+	unindexed = []
+	usbindex = {}
 	for pn in plugins:
 		plugin = plugins[pn]
-		ctl = plugin.Detect(dctl, inquiry, verbose=verbose)
-		if ctl != None:
-			if ctl.Detect(dctl) == True:
+		if hasattr(plugin, "UsbIds"):
+			for vid, (first, last) in (_PidRange(usbid) for usbid in plugin.UsbIds()):
+				usbindex.setdefault(vid, []).append((first, last, pn))
+		if not hasattr(plugin, "Signatures"):
+			unindexed.append(pn)
+			continue
+		for offset, tag in plugin.Signatures():
+			names = index.setdefault((offset, len(tag)), {}).setdefault(bytes(tag), [])
+			if pn not in names:
+				names.append(pn)
+	order = dict((pn, i) for i, pn in enumerate(plugins))
+	_index = (index, unindexed, usbindex, order)
+	return _index
+
+def _Index():
+	index = _index
+	if index == None:
+		index = _BuildIndex()
+	return index
+
+# Check inquiry data against a list of (offset, bytes) signatures
+def MatchSignatures(inquiry, signatures):
+	if inquiry is None:
+		return False
+	for offset, tag in signatures:
+		if bytes(inquiry[offset:offset + len(tag)]) == bytes(tag):
+			return True
+	return False
+
+"""
+	Names of plugins that may handle a device with given inquiry data,
+	in plugin load order
+"""
+def Candidates(inquiry):
+	index, unindexed, usbindex, order = _Index()
+	inquiry = bytes(inquiry)
+	matched = set(unindexed)
+	for (offset, length), tags in index.items():
+		names = tags.get(inquiry[offset:offset + length])
+		if names != None:
+			matched.update(names)
+	return sorted(matched, key=order.get)
+
+"""
+	Names of plugins that declare the USB ID, in plugin load order
+"""
+def UsbCandidates(vid, pid):
+	index, unindexed, usbindex, order = _Index()
+	matched = set(pn for first, last, pn in usbindex.get(vid, []) if first <= pid <= last)
+	return sorted(matched, key=order.get)
+
+"""
+	Controller detection. Plugins declaring the USB ID (vid, pid) go
+	straight to deep detection, without an INQUIRY. Otherwise, or if none
+	of them takes the device, standard inquiry data is read unless given
+"""
+def DetectController(dctl, verbose=False, inquiry=None, usbid=None):
+	# plugins that looked at the device by USB ID and turned it down. One
+	# that failed with an exception still gets its turn by inquiry data
+	tried = []
+	found = False
+	for pn in (UsbCandidates(*usbid) if usbid != None else []):
+		plugin = plugins[pn]
+		if inquiry != None and hasattr(plugin, "Signatures") and not MatchSignatures(inquiry, plugin.Signatures()):
+			# no vendor commands on the strength of the USB ID alone
+			if verbose:
+				print("%s: USB ID %04X:%04X matches, inquiry data does not"%(pn, usbid[0], usbid[1]), file=sys.stderr)
+			continue
+		with scsi.Context(pn):
+			# forced detection on a device the plugin may not handle after all
+			try:
+				ctl = plugin.Detect(dctl, inquiry, force=True, verbose=verbose)
+				if ctl != None and ctl.Detect(dctl) != True:
+					ctl = None
+				if ctl == None:
+					tried.append(pn)
+			except Exception as e:
+				if verbose:
+					print("%s: Detection by USB ID failed: %s"%(pn, e), file=sys.stderr)
+				ctl = None
+			if ctl != None:
+				found = True
 				yield ctl
+	if found:
+		return
+
+	if inquiry == None:
+		inquiry = scsi.Inquiry(dctl)
+	if verbose:
+		open("_inq_12.bin", "wb+").write(inquiry)
+
+	candidates = [pn for pn in Candidates(inquiry) if pn not in tried]
+	if verbose:
+		for pn in plugins:
+			if pn not in candidates and pn not in tried:
+				print("%s: No signature found in inquiry data"%pn, file=sys.stderr)
+
+	# requests are tagged with the plugin name. The tag stays set while the
+	# caller handles the yielded controller, so ProcessDevice is tagged too
+	for pn in candidates:
+		plugin = plugins[pn]
+		with scsi.Context(pn):
+			ctl = plugin.Detect(dctl, inquiry, verbose=verbose)
+			if ctl != None:
+				if ctl.Detect(dctl) == True:
+					yield ctl
 
 	#return None
 
@@ -28,7 +28,10 @@
 
 import controller
 import scsi
+import flash
 import struct
+import collections
+import sys
 
 _verbose = False
 
@@ -44,6 +47,24 @@ def Enabled():
 def AddParameters(parser):
 	return
 
+# Inquiry data signatures: list of (offset, bytes)
+# Basic detection is only attempted if one of them matches
+def Signatures():
+	return [
+		(controller.REVISION, b"7.7"),		# old models
+		(controller.REVISION, b"8.0"),
+		]
+
+# USB IDs: list of (vid, pid), pid may be a (first, last) range
+# Deep detection is attempted right away for a matching device, so only flash
+# drive PIDs are listed, not the card readers and hubs of the same vendor
+def UsbIds():
+	return [
+		(0x058F, 0x1234),				# Alcor Micro flash drives
+		(0x058F, 0x6387),
+		(0x058F, (0x9380, 0x9384)),
+		]
+
 # Basic detection routine
 # Should perform minimal amount of device interaction to ensure the device
 # can be handled by this plugin and not set to unstable state in process
@@ -55,21 +76,11 @@ def Detect(dctl, inquiry, force=False, verbose=False):
 	global _verbose
 	_verbose = verbose
 
-	# old models
-	if len(inquiry) > 0x23:
-		if  inquiry[0x20] == ord('7') \
-		and inquiry[0x21] == ord('.') \
-		and inquiry[0x22] == ord('7'):
-			return Alcor()
-
-	if len(inquiry) > 0x24:
-		if  inquiry[0x20] == ord('8') \
-		and inquiry[0x21] == ord('.') \
-		and inquiry[0x22] == ord('0'):
-			return Alcor()
+	if controller.MatchSignatures(inquiry, Signatures()):
+		return Alcor()
 
 	if _verbose:
-		print("%s: No alcor tag found in inquiry data"%Name())
+		print("%s: No alcor tag found in inquiry data"%Name(), file=sys.stderr)
 
 	if force:
 		return Alcor()
@@ -78,13 +89,13 @@ def Detect(dctl, inquiry, force=False, verbose=False):
 
 # All controller-related work resides in this class
 
-class ChipModel:
-	def __init__(self, Chip, Rev=None, Otp=None, Gen=0, Name=("???")):
-		self.Chip = Chip
-		self.Rev = Rev
-		self.Otp = Otp
-		self.Gen = Gen
-		self.Name = ("AU" + x for x in Name)
+class ChipModel(collections.namedtuple("ChipModel", "Chip Rev Otp Gen Name")):
+	__slots__ = ()
+
+	def __new__(cls, Chip, Rev=None, Otp=None, Gen=0, Name=("???")):
+		if isinstance(Name, str):
+			Name = (Name,)
+		return super(ChipModel, cls).__new__(cls, Chip, Rev, Otp, Gen, tuple("AU" + x for x in Name))
 
 knownControllers = [
 	# from old tools
@@ -104,11 +115,7 @@ knownControllers = [
 	#ChipModel(Chip=0xCA00,                           Gen= 0, Name=('6990')),
 	#ChipModel(Chip=0xD000,                           Gen= 0, Name=('6986T')),
 	# from new tools
-	ChipModel(Chip=0xAC43,                           Gen= 0, Name=('9387')),
-	ChipModel(Chip=0xAB41,                           Gen= 0, Name=('6981')),
-	ChipModel(Chip=0xAB42,                           Gen= 0, Name=('6981')),
 	ChipModel(Chip=0xAB43,                           Gen= 0, Name=('6981')),
-	ChipModel(Chip=0xAE41,                           Gen= 0, Name=('6982')),
 	ChipModel(Chip=0xAE42,                           Gen= 0, Name=('6982')),
 	ChipModel(Chip=0xBA01,                           Gen= 1, Name=('6983')),
 	ChipModel(Chip=0xBB06,                           Gen= 1, Name=('6984')),
@@ -265,44 +272,74 @@ knownControllers = [
 	ChipModel(Chip=0xF000, Rev=0x00,                 Gen=10),	# some test prototype?
 	]
 
+# Chip lookup index, built once. First entry in the table wins
+# _chipIndex: (Chip, Rev, Otp) -> ChipModel, Otp and/or Rev may be None (any)
+# _chipFamily: Chip -> ChipModel, first entry for the chip id
+_chipIndex = {}
+_chipFamily = {}
+
+def _BuildChipIndex():
+	for chip in knownControllers:
+		_chipIndex.setdefault((chip.Chip, chip.Rev, chip.Otp), chip)
+		_chipIndex.setdefault((chip.Chip, chip.Rev, None), chip)
+		_chipFamily.setdefault(chip.Chip, chip)
+
+_BuildChipIndex()
+
+"""
+	Find chip model by chip id, revision and OTP value
+	Return (model, exact). Unknown revision gives the first model
+	with that chip id and exact = False. Unknown chip gives (None, False).
+	Models told apart by OTP only match exactly with the right OTP, without
+	it the first of them is returned with exact = False
+"""
+def LookupChip(chip, rev=None, otp=None):
+	if otp != None:
+		model = _chipIndex.get((chip, rev, otp))
+		if model != None:
+			return model, True
+	model = _chipIndex.get((chip, rev, None)) or _chipIndex.get((chip, None, None))
+	if model != None:
+		return model, model.Otp == None
+	return _chipFamily.get(chip), False
+
 class Alcor():
 
 	def __init__(self):
 		#super().__init__(self)
 		self.vendor = "Alcor Micro"
 		self.model = "Unknown"
-		self.chips = []
+		self.chip = None
 		self.chipver = None
 		self.chiprev = None
 		self.chipotp = None
 		self.chipgen = -1
 		self.badblocks = 0
+		self.fwloaded = False
 		return
 
 	# Deep detection. Fill class fields with device-specific info
 	def Detect(self, dctl, force=False):
 
-		cdb = [0] * 16
-		cdb[0] = 0x9A
-		data = [0] * 512
-		info = scsi.ScsiRequest(dctl, cdb, data)
+		cdb = scsi.CDB(16, [0x9A])
+		data = bytearray(512)
+		info = scsi.ScsiRequest(dctl, cdb.data, data)
 		if info == None:
 			if _verbose:
-				print("%s: Command 0x%02X failed"%(Name(), cdb[0]))
+				print("%s: Command 0x%02X failed"%(Name(), cdb.data[0]), file=sys.stderr)
 			return False
 
-		if _verbose: open("_alc_9A.bin", "wb+").write(bytearray(info))
+		if _verbose: open("_alc_9A.bin", "wb+").write(info)
 
-		self.chipver = info[4] * 256 + info[5]
+		self.chipver = struct.unpack_from(">H", info, 4)[0]
 
-		for chip in knownControllers:
-			if chip.Chip == self.chipver:
-				self.chips.append(chip)
-				self.chipgen = chip.Gen
+		self.chip = _chipFamily.get(self.chipver)
+		if self.chip != None:
+			self.chipgen = self.chip.Gen
 
 		if info[0x2B] == 0xAA:
 			self.fwloaded = info[0x2C] != 0
-			self.fwversionold = info[0x2D] * 256 + info[0x2E]
+			self.fwversionold = struct.unpack_from(">H", info, 0x2D)[0]
 			# 0x2E is always zero?
 
 		if self.chipver in [0x0C0E, 0xAA06]:
@@ -313,15 +350,16 @@ class Alcor():
 		return True
 
 	def ControllerModel(self):
-		for chip in self.chips:
-			if chip.Rev == None or chip.Rev == self.chiprev:
-				self.model = " / ".join(chip.Name)
-				break
+		chip, exact = LookupChip(self.chipver, self.chiprev, self.chipotp)
+		if chip == None:
+			self.model = "Unknown"
+		elif exact:
+			self.model = " / ".join(chip.Name)
 		else:
 			self.model = " / ".join(chip.Name) + " variant"
 
 		self.chipverstr = "%04X"%self.chipver
-		if self.chips[0].Rev != None and self.chiprev != None:
+		if self.chip != None and self.chip.Rev != None and self.chiprev != None:
 			self.chipverstr += "-%02X"%self.chiprev
 
 		# TODO: ignore OTP for now
@@ -334,16 +372,14 @@ class Alcor():
 	# Gather device info and fill the report
 	def ProcessDevice(self, dctl, report):
 			
-		cdb = [0] * 16
-		cdb[0] = 0xFA
-		cdb[1] = 0x0E
-		data = [0] * 512
-		info = scsi.ScsiRequest(dctl, cdb, data)
+		cdb = scsi.CDB(16, [0xFA, 0x0E])
+		data = bytearray(512)
+		info = scsi.ScsiRequest(dctl, cdb.data, data)
 		if info == None:
 			if _verbose:
-				print("%s: Command 0x%02X%02X failed"%(Name(), cdb[0], cdb[1]))
+				print("%s: Command 0x%02X%02X failed"%(Name(), cdb.data[0], cdb.data[1]), file=sys.stderr)
 		else:
-			if _verbose: open("_alc_FA0E.bin", "wb+").write(bytearray(info))
+			if _verbose: open("_alc_FA0E.bin", "wb+").write(info)
 			self.chiprev = info[0xB]
 
 		report.append(("Controller", self.ControllerName()))
@@ -359,25 +395,13 @@ class Alcor():
 				else:
 					self.fwversionstr = "%08X"%(self.fwversion & 0xFFFFFFFF)
 				if(self.fwversion & 0xFF000000) == 0xF0000000:
-					self.fwversionstr += "_%02X"(self.fwversion >> 32)
+					self.fwversionstr += "_%02X"%(self.fwversion >> 32)
 		else:
 			self.fwversionstr = "Not loaded"
 
 		report.append(("Firmware", self.fwversionstr))
 
-		flashinfo = self._GetFlashId(dctl)
-		if flashinfo != None:
-			#TODO: 8-byte entries on old versions?
-			flashids = [flashinfo[i*16:i*16 + 6] for i in range(8)]
-			# pick a non-zero entry
-			for flash in flashids:
-				if flash[:6] != [0, 0, 0, 0, 0, 0]:
-					break
-			else:
-				flash = flashids[0]
-			report.append(("Flash ID", flash, "fid"))
-		else:
-			report.append(("Flash ID", "Unavailable"))
+		self._GetFlashTopology(dctl).Report(report)
 
 		return report
 
@@ -385,58 +409,59 @@ class Alcor():
 	def _GetFirmwareVersion(self, dctl):
 		version = -1
 		cdb = scsi.CDB(cdb=[0xFA, 0x0E])
-		data = [0] * 512
+		data = bytearray(512)
 		data = scsi.ScsiRequest(dctl, cdb.data, data)
 
-		if data[6] >= 0xF0:
-			version = (data[6] << 24) | (data[4] << 16) | (data[5] << 8) | data[7]
-		elif data[6] == 0x36:
-			version = (data[6] << 24) | (data[7] << 16) | (data[4] << 8) | data[5]
+		v4, v5, v6, v7 = struct.unpack_from("4B", data, 4)
+		if v6 >= 0xF0:
+			version = (v6 << 24) | (v4 << 16) | (v5 << 8) | v7
+		elif v6 == 0x36:
+			version = (v6 << 24) | (v7 << 16) | (v4 << 8) | v5
 		else:
-			version = (data[6] << 8) | data[7]
+			version = (v6 << 8) | v7
 
-		data = [0] * 512 * 18
+		data = bytearray(512 * 18)
 		cdb = scsi.CDB(cdb=[0xFA, 0x10])
-		cdb.PB(2, len(data) / 512).PB(4, 0xC0)
+		cdb.PB(2, len(data) // 512).PB(4, 0xC0)
 		data = scsi.ScsiRequest(dctl, cdb.data, data, mayFail=True)
 
 		if data != None:
-			if _verbose: open("_alc_FA10.bin", "wb+").write(bytearray(data))
+			if _verbose: open("_alc_FA10.bin", "wb+").write(data)
 			if data[0xFFB] == 0x51:
 				version |= data[0xFFA] << 32
 		else:
 			if _verbose:
-				print("%s: Command 0x%02X%02X failed (norm for old chips)"%(Name(), cdb.data[0], cdb.data[1]))
+				print("%s: Command 0x%02X%02X failed (norm for old chips)"%(Name(), cdb.data[0], cdb.data[1]), file=sys.stderr)
 
 		return version
 
-	def _GetFlashId(self, dctl):
+	"""
+		Flash topology of all populated chip enables
+		Gen 0: 0xD0 command per CE selector, 2 IDs per selector at 0x00
+		and 0x80. Selectors are populated in order, so enumeration stops
+		at the first empty one after a populated one
+		Others: 0xFA 00 page with up to 8 IDs, 16 bytes apart
+	"""
+	def _GetFlashTopology(self, dctl):
+		topology = flash.FlashTopology()
 		if self.chipgen == 0:
-			info = []
-			for ch in [0, 1, 3, 7]:
+			for i, ch in enumerate([0, 1, 3, 7]):
 				# TODO: send nand reset command first?
 				# 4-byte fid, 2 per channel
-				cdb = [0] * 16
-				cdb[0] = 0xD0
-				cdb[1] = ch
-				cdb[2] = 0xF0
-				cdb[3] = 0x90
-				cdb[4] = 0xF1
-				cdb[5] = 1
-				cdb[6] = 0
-				cdb[7] = 0xF2
-				cdb[8] = 4
-				data = [0] * 512
-				data = scsi.ScsiRequest(dctl, cdb, data)
-				if _verbose: open("_alc_D0%02X.bin"%ch, "wb+").write(bytearray(data))
-				info += data[0:16]
-				info += data[0x80:0x80+16]
-			return info
+				cdb = scsi.CDB(16, [0xD0, ch, 0xF0, 0x90, 0xF1, 1, 0, 0xF2, 4])
+				# fresh buffer, a short reply must not repeat the previous channel
+				data = bytearray(512)
+				scsi.ScsiRequest(dctl, cdb.data, data)
+				if _verbose: open("_alc_D0%02X.bin"%ch, "wb+").write(data)
+				found = len(topology.chips)
+				topology.AddPage(data, count=2, stride=0x80, idlen=6, channel=i)
+				if len(topology.chips) == found and found > 0:
+					break
 		else:
-			cdb = [0] * 16
-			cdb[0] = 0xFA
-			cdb[1] = 0
-			data = [0] * 512
-			info = scsi.ScsiRequest(dctl, cdb, data)
-			if _verbose: open("_alc_FA00.bin", "wb+").write(bytearray(info))
-			return info
+			cdb = scsi.CDB(16, [0xFA, 0])
+			data = bytearray(512)
+			scsi.ScsiRequest(dctl, cdb.data, data)
+			if _verbose: open("_alc_FA00.bin", "wb+").write(data)
+			#TODO: 8-byte entries on old versions?
+			topology.AddPage(data, idlen=6)
+		return topology
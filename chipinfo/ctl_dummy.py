@@ -26,6 +26,7 @@
 # SOFTWARE.
 """
 
+import controller
 import scsi
 
 _verbose = False
@@ -42,6 +43,21 @@ def Enabled():
 def AddParameters(parser):
 	return
 
+# Inquiry data signatures: list of (offset, bytes), e.g. (controller.VENDOR, b"ACME")
+# Basic detection is only attempted if one of them matches
+# Omit this function to have Detect() called for every device
+def Signatures():
+	return []
+
+# USB IDs: list of (vid, pid), pid may be None for any or a (first, last) range
+# Deep detection is attempted right away for a matching device, Detect() gets
+# force=True and inquiry may be None then. Vendor commands go to every device
+# listed, so avoid None unless the vendor makes nothing else. Skipped if the
+# inquiry data is known and matches none of the signatures. Omit this
+# function if unsure
+def UsbIds():
+	return []
+
 # Basic detection routine
 # Should perform minimal amount of device interaction to ensure the device
 # can be handled by this plugin and not set to unstable state in process
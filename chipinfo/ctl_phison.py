@@ -28,7 +28,10 @@
 
 import controller
 import scsi
+import flash
 import argparse
+import struct
+import sys
 
 _verbose = False
 
@@ -46,6 +49,23 @@ def AddParameters(parser):
 	group.add_argument("-x", "--extractfw", help="Extract firmware", action="store_true")
 	return
 
+# Inquiry data signatures: list of (offset, bytes)
+# Basic detection is only attempted if one of them matches
+def Signatures():
+	return [(0x24, b"PMAP")]
+
+# USB IDs: list of (vid, pid), pid may be a (first, last) range
+# Deep detection is attempted right away for a matching device, so only flash
+# drive PIDs are listed, not the card readers and hubs of the same vendor
+def UsbIds():
+	return [
+		(0x13FE, (0x1A00, 0x1FFF)),		# Phison flash drives
+		(0x13FE, (0x3100, 0x3FFF)),
+		(0x13FE, (0x4100, 0x42FF)),
+		(0x13FE, (0x5000, 0x55FF)),
+		(0x13FE, (0x6700, 0x67FF)),
+		]
+
 # Basic detection routine
 # Should perform minimal amount of device interaction to ensure the device
 # can be handled by this plugin and not set to unstable state in process
@@ -58,15 +78,11 @@ def Detect(dctl, inquiry, force=False, verbose=False):
 	global _verbose
 	_verbose = verbose
 
-	if len(inquiry) > 0x27:
-		if  inquiry[0x24] == ord('P') \
-		and inquiry[0x25] == ord('M') \
-		and inquiry[0x26] == ord('A') \
-		and inquiry[0x27] == ord('P'):
-			return Phison()
+	if controller.MatchSignatures(inquiry, Signatures()):
+		return Phison()
 
 	if _verbose:
-		print("%s: No PMAP tag found in inquiry data"%Name())
+		print("%s: No PMAP tag found in inquiry data"%Name(), file=sys.stderr)
 
 	if force:
 		return Phison()
@@ -91,10 +107,10 @@ class Phison():
 			return False
 
 		self.chip = info[0x1C6];
-		self.model = "PS%02X%02X (0x%02X)"%(info[0x17E], info[0x17F], self.chip)
-		self.product = str(info[0x9C:0x9C + 16]).split("\0")[0]
-		self.version = "%d.%02X.%02X"%(info[0x94], info[0x95], info[0x96])
-		self.date = "%02d/%02d/%02d"%(info[0x97], info[0x98], info[0x99])
+		self.model = "PS%02X%02X (0x%02X)"%(struct.unpack_from("BB", info, 0x17E) + (self.chip,))
+		self.product = bytes(info[0x9C:0x9C + 16]).split(b"\0")[0].decode("latin-1")
+		self.version = "%d.%02X.%02X"%struct.unpack_from("3B", info, 0x94)
+		self.date = "%02d/%02d/%02d"%struct.unpack_from("3B", info, 0x97)
 		self.usbver = "%X"%info[0xF5]
 
 		return True
@@ -113,14 +129,7 @@ class Phison():
 
 		flashinfo = self._GetFlashId(dctl)
 		if flashinfo != None:
-			flashids = [flashinfo[i*16:i*16 + 16] for i in range(8)]
-			# pick a non-zero entry
-			for flash in flashids:
-				if flash[:8] != [0, 0, 0, 0, 0, 0, 0, 0]:
-					break
-			else:
-				flash = flashids[0]
-			report.append(("Flash ID", flash, "fid"))
+			flash.FlashTopology().AddPage(flashinfo).Report(report)
 		else:
 			report.append(("Flash ID", "Unavailable"))
 
@@ -129,26 +138,21 @@ class Phison():
 		return report
 
 	def _GetInfoPage(self, dctl, kind = "", size = 512 + 16):
-		cdb = [0] * 12
-		cdb[0] = 6
-		cdb[1] = 5
-		if kind != "":
-			for i in range(min(len(kind), 10)):
-				cdb[2 + i] = ord(kind[i])
-		data = [0] * (size)
-		info = scsi.ScsiRequest(dctl, cdb, data)
+		cdb = scsi.CDB(12, [6, 5])
+		for i in range(min(len(kind), 10)):
+			cdb.PB(2 + i, ord(kind[i]))
+		data = bytearray(size)
+		info = scsi.ScsiRequest(dctl, cdb.data, data)
 		if info != None:
-			#open("_ph_0605%s.bin"%kind, "wb+").write(bytearray(info))
+			#open("_ph_0605%s.bin"%kind, "wb+").write(info)
 			if _verbose == True:
 				if len(info) == 512 + 16:
-					if info[512] != ord('I') or info[513] != ord('F'):
-						print("* Warning: Strange info page mark")
+					if info[512:514] != b"IF":
+						print("* Warning: Strange info page mark", file=sys.stderr)
 		return info
 
 	def _GetFlashId(self, dctl):
-		cdb = [0] * 12
-		cdb[0] = 6
-		cdb[1] = 0x56 # also 4, but unavailable on newer firmwares
-		data = [0] * 512
-		info = scsi.ScsiRequest(dctl, cdb, data)
+		cdb = scsi.CDB(12, [6, 0x56]) # also 4, but unavailable on newer firmwares
+		data = bytearray(512)
+		info = scsi.ScsiRequest(dctl, cdb.data, data)
 		return info
@@ -28,6 +28,8 @@
 
 import controller
 import scsi
+import flash
+import sys
 
 _verbose = False
 
@@ -43,6 +45,23 @@ def Enabled():
 def AddParameters(parser):
 	return
 
+# Inquiry data signatures: list of (offset, bytes)
+# Basic detection is only attempted if one of them matches
+def Signatures():
+	return [
+		(5, b"smi"),		# old models
+		(0x35, b"smi"),		# SMI3280+ models
+		]
+
+# USB IDs: list of (vid, pid), pid may be a (first, last) range
+# Deep detection is attempted right away for a matching device, so only flash
+# drive PIDs are listed, not the card readers and hubs of the same vendor
+def UsbIds():
+	return [
+		(0x090C, 0x1000),				# Silicon Motion flash drives
+		(0x090C, (0x3000, 0x37FF)),
+		]
+
 # Basic detection routine
 # Should perform minimal amount of device interaction to ensure the device
 # can be handled by this plugin and not set to unstable state in process
@@ -54,22 +73,11 @@ def Detect(dctl, inquiry, force=False, verbose=False):
 	global _verbose
 	_verbose = verbose
 
-	# old models
-	if len(inquiry) > 7:
-		if  inquiry[5] == ord('s') \
-		and inquiry[6] == ord('m') \
-		and inquiry[7] == ord('i'):
-			return SMI()
-
-	# SMI3280+ models
-	if len(inquiry) > 0x37:
-		if  inquiry[0x35] == ord('s') \
-		and inquiry[0x36] == ord('m') \
-		and inquiry[0x37] == ord('i'):
-			return SMI()
+	if controller.MatchSignatures(inquiry, Signatures()):
+		return SMI()
 
 	if _verbose:
-		print("%s: No smi tag found in inquiry data"%Name())
+		print("%s: No smi tag found in inquiry data"%Name(), file=sys.stderr)
 
 	if force:
 		return SMI()
@@ -88,20 +96,17 @@ class SMI():
 	# Deep detection. Fill class fields with device-specific info
 	def Detect(self, dctl, force=False):
 
-		cdb = [0] * 16
-		cdb[0] = 0xF0
-		cdb[1] = 0x2A
-		cdb[11] = 1		# sectors
-		data = [0] * 512
-		info = scsi.ScsiRequest(dctl, cdb, data)
+		cdb = scsi.CDB(16, [0xF0, 0x2A]).PB(11, 1)		# sectors
+		data = bytearray(512)
+		info = scsi.ScsiRequest(dctl, cdb.data, data)
 		if info == None:
 			return False
 
-		#open("_smi_F02A.bin", "wb+").write(bytearray(info))
+		#open("_smi_F02A.bin", "wb+").write(info)
 
-		if info[0x1AE] == ord('S') and info[0x1AF] == ord('M'):
-			self.model = "".join([chr(x) for x in info[0x1AE:0x1AE + 8]]).split('\0')[0]
-			self.version = "".join([chr(x) for x in info[0x190:0x1AE]]).split('\0')[0]
+		if info[0x1AE:0x1B0] == b"SM":
+			self.model = bytes(info[0x1AE:0x1AE + 8]).split(b"\0")[0].decode("latin-1")
+			self.version = bytes(info[0x190:0x1AE]).split(b"\0")[0].decode("latin-1")
 		else:
 			return False
 
@@ -121,24 +126,14 @@ class SMI():
 
 		flashinfo = self._GetFlashId(dctl)
 		if flashinfo != None:
-			flashids = [flashinfo[0x30+i*16:0x30+i*16 + 16] for i in range(8)]
-			# pick a non-zero entry
-			for flash in flashids:
-				if flash[:8] != [0, 0, 0, 0, 0, 0, 0, 0]:
-					break
-			else:
-				flash = flashids[0]
-			report.append(("Flash ID", flash, "fid"))
+			flash.FlashTopology().AddPage(flashinfo, 0x30).Report(report)
 		else:
 			report.append(("Flash ID", "Unavailable"))
 
 		return report
 
 	def _GetFlashId(self, dctl):
-		cdb = [0] * 16
-		cdb[0] = 0xF0
-		cdb[1] = 0x06
-		cdb[11] = 1		# sectors
-		data = [0] * 512
-		info = scsi.ScsiRequest(dctl, cdb, data)
+		cdb = scsi.CDB(16, [0xF0, 0x06]).PB(11, 1)		# sectors
+		data = bytearray(512)
+		info = scsi.ScsiRequest(dctl, cdb.data, data)
 		return info
@@ -0,0 +1,67 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+# Device probe sequence shared by the command line tool and the async API
+
+import sys
+import scsi
+import controller
+import probecache
+
+"""
+	Probe an open device. Yield report entries as they become available:
+	capacity first, then the entries of each detected controller.
+	usbid (vid, pid), if known, selects plugins without an INQUIRY
+"""
+def ProbeDevice(dctl, verbose=False, usbid=None):
+	capacity = scsi.GetCapacity(dctl)
+	yield ("Capacity", capacity, "size")
+
+	# the cache key needs inquiry data, detection only without a USB ID
+	inquiry = None
+	key = None
+	if probecache.enabled:
+		inquiry = scsi.Inquiry(dctl)
+		key = probecache.Fingerprint(dctl, inquiry, capacity, controller.GetPlugins())
+	cached = probecache.Lookup(key)
+	if cached != None:
+		if verbose:
+			print("Using cached probe results", file=sys.stderr)
+		for entry in cached:
+			yield entry
+		return
+
+	report = []
+	for ctl in controller.DetectController(dctl, verbose=verbose, inquiry=inquiry, usbid=usbid):
+		start = len(report)
+		ctl.ProcessDevice(dctl, report)
+		for entry in report[start:]:
+			yield entry
+	if len(report) == 0:
+		# not cached, the next probe may well get further
+		yield ("Controller", "Unknown")
+		return
+	probecache.Store(key, report)
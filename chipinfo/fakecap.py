@@ -0,0 +1,254 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+# Fake capacity check
+# A signed pattern is written to a logarithmic sample of sectors (a few per
+# power of two), then all of them are read back. Counterfeit drives either
+# drop writes beyond the real capacity or wrap the address, so two sample
+# LBAs end up on the same physical sector and one reads back the other's
+# pattern. The original contents of the samples are read first and written
+# back afterwards, whatever happens in between
+
+import os
+import struct
+import hashlib
+import scsi
+
+SectorSize = 512
+
+_magic = b"CHIEFAKE"
+
+# a few hundred sectors cover any disk size
+def SampleLbas(sectors, perOctave=8):
+	lbas = set([0, sectors - 1])
+	k = 1
+	while k < sectors:
+		for j in range(perOctave):
+			lba = k + k * j // perOctave
+			if lba < sectors:
+				lbas.add(lba)
+		k *= 2
+	return sorted(lbas)
+
+# Sector contents for lba: magic, lba, then a keyed hash stream
+def Pattern(nonce, lba):
+	header = _magic + struct.pack("<Q", lba)
+	body = bytearray()
+	counter = 0
+	while len(header) + len(body) < SectorSize:
+		body += hashlib.blake2b(struct.pack("<QI", lba, counter), key=nonce).digest()
+		counter += 1
+	return (header + body)[:SectorSize]
+
+# LBA a sector was written for in this run, None if it is not a valid pattern
+def Identify(nonce, data):
+	data = bytes(data)
+	if data[:len(_magic)] != _magic:
+		return None
+	lba = struct.unpack_from("<Q", data, len(_magic))[0]
+	return lba if Pattern(nonce, lba) == data else None
+
+# Sector numbers a write to lba lands on if the drive drops high address
+# bits: lba modulo every power of two up to lba
+def _Aliases(lba):
+	aliases = set()
+	p = 1
+	while p <= lba:
+		aliases.add(lba % p)
+		p *= 2
+	return aliases
+
+"""
+	Write lba and check it reads back, without showing up at the anchor (a
+	good sample at a low LBA, written first) or at a power-of-two alias.
+	Both sectors are restored, LBAs that could not be are added to
+	unrestored
+"""
+def _Holds(dctl, nonce, lba, anchor, unrestored):
+	original = {}
+	try:
+		for l in (anchor, lba):
+			original[l] = bytes(scsi.ReadSectors(dctl, l, 1))
+	except Exception:
+		return False
+	written = []
+	try:
+		for l in (anchor, lba):
+			scsi.WriteSectors(dctl, l, Pattern(nonce, l))
+			written.append(l)
+		if Identify(nonce, scsi.ReadSectors(dctl, lba, 1)) != lba:
+			return False
+		if Identify(nonce, scsi.ReadSectors(dctl, anchor, 1)) != anchor:
+			return False
+		for alias in sorted(_Aliases(lba) - set([anchor])):
+			try:
+				if Identify(nonce, scsi.ReadSectors(dctl, alias, 1)) == lba:
+					return False
+			except Exception:
+				pass
+		return True
+	except Exception:
+		return False
+	finally:
+		unrestored.extend(_Restore(dctl, written, original))
+
+# Write the original contents back, lowest LBA first. LBAs sharing a
+# sector were all read with the same original data. Return the LBAs
+# that failed
+def _Restore(dctl, lbas, original):
+	failed = []
+	for lba in sorted(lbas):
+		try:
+			scsi.WriteSectors(dctl, lba, original[lba])
+		except Exception:
+			failed.append(lba)
+	return failed
+
+"""
+	Check the sectors of an open device. Return a dict:
+	- samples: number of sectors checked
+	- bad: sorted LBAs beyond the real capacity
+	- wraps: {lba: lowest LBA sharing its physical sector} for wrapped ones
+	- good: first LBA past the highest good sample below the first bad one
+	- rejected: (lba, error) of the first failed read or write, None if
+	  all went through. Samples above it are not checked
+	- unrestored: LBAs whose original contents could not be written back
+	Capacity is fake if bad is not empty, the real one lies between
+	good and bad[0] sectors, located to the sector by bisection. Wrapped
+	addresses are found if they wrap at a power of two, as address lines
+	do; other moduli only alias unsampled sectors
+"""
+def Verify(dctl, capacity, perOctave=8):
+	sectors = capacity // SectorSize
+	lbas = SampleLbas(sectors, perOctave)
+	nonce = os.urandom(16)
+	rejected = None
+
+	original = {}
+	for i, lba in enumerate(lbas):
+		try:
+			original[lba] = bytes(scsi.ReadSectors(dctl, lba, 1))
+		except Exception as e:
+			rejected = (lba, e)
+			lbas = lbas[:i]
+			break
+
+	written = []
+	readback = {}
+	try:
+		for lba in lbas:
+			try:
+				scsi.WriteSectors(dctl, lba, Pattern(nonce, lba))
+			except Exception as e:
+				rejected = (lba, e)
+				break
+			written.append(lba)
+		for lba in written:
+			try:
+				readback[lba] = Identify(nonce, scsi.ReadSectors(dctl, lba, 1))
+			except Exception:
+				readback[lba] = None
+	finally:
+		unrestored = _Restore(dctl, written, original)
+
+	# LBAs reading back the same pattern share one physical sector, a wrapped
+	# address lands on a lower one, so all but the lowest are fake
+	bad = set(lba for lba in written if readback[lba] == None)
+	if rejected != None:
+		bad.add(rejected[0])
+	groups = {}
+	for lba in written:
+		if readback[lba] != None:
+			groups.setdefault(readback[lba], set([readback[lba]])).add(lba)
+	wraps = {}
+	for group in groups.values():
+		low = min(group)
+		for lba in group:
+			if lba != low:
+				wraps[lba] = low
+				bad.add(lba)
+	bad = sorted(bad)
+
+	good = sectors
+	if len(bad) > 0:
+		good = 0
+		for lba in written:
+			if lba >= bad[0]:
+				break
+			good = lba + 1
+		# the real end lies somewhere between the samples, find the sector
+		anchors = [lba for lba in written if 0 < lba < good]
+		anchor = anchors[0] if len(anchors) > 0 else 0
+		high = bad[0]
+		while good < high:
+			mid = (good + high) // 2
+			if mid != anchor and _Holds(dctl, nonce, mid, anchor, unrestored):
+				good = mid + 1
+			else:
+				high = mid
+		if good < bad[0]:
+			bad.insert(0, good)
+	return {"samples": len(lbas), "bad": bad, "wraps": wraps, "good": good, "rejected": rejected, "unrestored": sorted(set(unrestored))}
+
+"""
+	Check the device and append results to the report
+"""
+def Check(path, report, perOctave=8):
+	try:
+		with scsi.Device(path) as dctl:
+			capacity = scsi.GetCapacity(dctl)
+			result = Verify(dctl, capacity, perOctave)
+	except Exception as e:
+		report.append(("Capacity check", e))
+		return report
+
+	if len(result["bad"]) == 0:
+		report.append(("Capacity check", "Passed (%d samples)"%result["samples"]))
+		_ReportUnrestored(report, result)
+		return report
+
+	first = result["bad"][0]
+	if first in result["wraps"]:
+		reason = "wraps to LBA %d"%result["wraps"][first]
+	elif result["rejected"] != None and result["rejected"][0] == first:
+		reason = "rejected (%s)"%result["rejected"][1]
+	else:
+		reason = "data lost"
+	report.append(("Capacity check", "FAKE: LBA %d %s"%(first, reason)))
+	if result["good"] == first:
+		report.append(("Real capacity", first * SectorSize, "size"))
+	else:
+		report.append(("Real capacity", "%d..%d byte(s)"%(result["good"] * SectorSize, first * SectorSize)))
+	_ReportUnrestored(report, result)
+	return report
+
+def _ReportUnrestored(report, result):
+	unrestored = result["unrestored"]
+	if len(unrestored) > 0:
+		text = "LBA " + ", ".join("%d"%lba for lba in unrestored[:8])
+		if len(unrestored) > 8:
+			text += ", ... (%d sectors)"%len(unrestored)
+		report.append(("Capacity check restore", "FAILED: " + text))
@@ -24,6 +24,18 @@
 # SOFTWARE.
 """
 
+# Flash ID decoding
+# Part data comes from flashdb.txt. It is compiled once into a hash table
+# file in the cache dir and memory-mapped, so start-up costs nothing and
+# a lookup is a few hash probes (one per known ID prefix length)
+
+import os
+import mmap
+import zlib
+import struct
+import collections
+import cache
+
 vendors = {
 	0x98: ("Toshiba", 8),
 	0x45: ("Sandisk", 8),
@@ -34,9 +46,190 @@ vendors = {
 	0x20: ("ST", 4),
 	0x07: ("Renesas", 4),
 	0xC1: ("Infineon", 4),
-	0xC2: ("Macronix", 6)
+	0xC2: ("Macronix", 6),
+	0x9B: ("YMTC", 6),
+	0xEF: ("Winbond", 4),
+	0x01: ("Spansion", 4)
+	}
+
+cellTypes = {1: "SLC", 2: "MLC", 3: "TLC", 4: "QLC"}
+
+# Legacy JEDEC device codes (second ID byte) -> density per CE, Gbit
+# Micron/Intel use their own codes, those come from the database only
+densities = {
+	0xF1: 1, 0xA1: 1,
+	0xDA: 2, 0xAA: 2,
+	0xDC: 4, 0xAC: 4,
+	0xD3: 8, 0xA3: 8,
+	0xD5: 16, 0xA5: 16,
+	0xD7: 32,
+	0xDE: 64,
+	0x3A: 128,
+	0x3C: 256,
 	}
 
+_jedecMakers = (0x98, 0x45, 0xEC, 0xAD)
+
+# Makers whose third ID byte holds cell type (bits 2-3) and dies per CE
+# (bits 0-1). Micron/Intel share the layout, the others use their own
+_thirdByteMakers = _jedecMakers + (0x2C, 0x89)
+
+_source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "flashdb.txt")
+_compiledName = "flashdb.bin"
+
+# magic, source mtime, source size, record count, hash slots, key lengths mask
+_header = struct.Struct("<8sqqIII")
+_magic = b"CHIFDB\x02\x00"
+# key, key length, bits per cell, planes, dies, process (nm), page size, pages per block, density (Gbit), part name offset
+_record = struct.Struct("<8sBBBBHIHHI")
+_slot = struct.Struct("<I")
+
+_db = None
+
+def _Number(text):
+	if text == "-":
+		return 0
+	if text[-1:].upper() == "K":
+		return int(text[:-1]) * 1024
+	return int(text)
+
+def _ParseSource(path):
+	parts = []
+	with open(path, "rt") as f:
+		for line in f:
+			line = line.split("#")[0].split()
+			if len(line) == 0:
+				continue
+			if len(line) != 9:
+				raise Exception("%s: bad line %s"%(path, " ".join(line)))
+			key = bytes.fromhex(line[0])
+			if len(key) == 0 or len(key) > 8:
+				raise Exception("%s: bad flash ID %s"%(path, line[0]))
+			bits = [b for b, name in cellTypes.items() if name == line[3].upper()]
+			parts.append((key, line[1], _Number(line[2]), bits[0] if bits else 0, _Number(line[4]), _Number(line[5]), _Number(line[6]), _Number(line[7]), _Number(line[8])))
+	return parts
+
+"""
+	Build the compiled database: header, open addressing hash table of
+	record numbers (+1, 0 is empty), fixed size records, part names
+"""
+def _Build(parts, mtime=0, size=0):
+	slots = 16
+	while slots < len(parts) * 2:
+		slots *= 2
+
+	table = [0] * slots
+	records = []
+	names = bytearray()
+	lengths = 0
+	for n, (key, part, nm, bits, page, ppb, planes, dies, gbit) in enumerate(parts):
+		i = zlib.crc32(key) & (slots - 1)
+		while table[i] != 0:
+			if parts[table[i] - 1][0] == key:
+				raise Exception("Duplicate flash ID %s"%key.hex().upper())
+			i = (i + 1) & (slots - 1)
+		table[i] = n + 1
+		lengths |= 1 << len(key)
+		records.append(_record.pack(key, len(key), bits, planes, dies, nm, page, ppb, gbit, len(names)))
+		names += part.encode() + b"\0"
+
+	return b"".join([_header.pack(_magic, mtime, size, len(parts), slots, lengths), struct.pack("<%dI"%slots, *table)] + records) + bytes(names)
+
+def _Compile(path):
+	st = os.stat(path)
+	return _Build(_ParseSource(path), st.st_mtime_ns, st.st_size)
+
+def _Valid(data, st):
+	if len(data) < _header.size:
+		return False
+	magic, mtime, size, count, slots, lengths = _header.unpack_from(data, 0)
+	return magic == _magic and mtime == st.st_mtime_ns and size == st.st_size
+
+"""
+	Memory-mapped compiled database
+"""
+class FlashDb:
+	def __init__(self, data):
+		self.data = data
+		magic, mtime, size, self.count, self.slots, lengthMask = _header.unpack_from(data, 0)
+		self.lengths = [l for l in range(8, 0, -1) if lengthMask & (1 << l)]
+		self._records = _header.size + self.slots * _slot.size
+		self._names = self._records + self.count * _record.size
+
+	def _Find(self, key):
+		mask = self.slots - 1
+		i = zlib.crc32(key) & mask
+		while True:
+			n = _slot.unpack_from(self.data, _header.size + i * _slot.size)[0]
+			if n == 0:
+				return None
+			record = _record.unpack_from(self.data, self._records + (n - 1) * _record.size)
+			if record[0][:record[1]] == key:
+				return record
+			i = (i + 1) & mask
+
+	def _Name(self, offset):
+		start = self._names + offset
+		return bytes(self.data[start:self.data.find(b"\0", start)]).decode()
+
+	# Part with the longest ID prefix matching fid, None if unknown
+	def Lookup(self, fid):
+		fid = bytes(fid[:8])
+		for length in self.lengths:
+			if length <= len(fid):
+				record = self._Find(fid[:length])
+				if record != None:
+					key, keylen, bits, planes, dies, nm, page, ppb, gbit, name = record
+					return {
+						"part": self._Name(name),
+						"process": nm,
+						"bits": bits,
+						"planes": planes,
+						"dies": dies,
+						"pagesize": page,
+						"pagesperblock": ppb,
+						"density": gbit,
+						}
+		return None
+
+"""
+	Open the compiled database, rebuilding it when flashdb.txt changes
+	Without a usable cache dir the database is compiled in memory
+"""
+def LoadDatabase(source=None):
+	source = source or _source
+	st = os.stat(source)
+	try:
+		with open(cache.CachePath(_compiledName), "rb") as f:
+			data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		if _Valid(data, st):
+			return FlashDb(data)
+		data.close()
+	except (OSError, ValueError):
+		pass
+
+	data = _Compile(source)
+	cache.SaveBinary(_compiledName, data)
+	return FlashDb(data)
+
+def Database():
+	global _db
+	if _db == None:
+		try:
+			_db = LoadDatabase()
+		except Exception:
+			# no part data, makers are still decoded
+			_db = FlashDb(_Build([]))
+	return _db
+
+# Cell type, dies and density from the ID bytes, where the maker's format is known
+def _DecodeGeneric(fid, result):
+	if len(fid) > 2 and fid[0] in _thirdByteMakers:
+		result["bits"] = ((fid[2] >> 2) & 3) + 1
+		result["dies"] = 1 << (fid[2] & 3)
+	if len(fid) > 1 and fid[0] in _jedecMakers and fid[1] in densities:
+		result["density"] = densities[fid[1]]
+
 def DecodeFlashId(fid):
 	result = {}
 
@@ -51,11 +244,120 @@ def DecodeFlashId(fid):
 	result["fid"] = fid[:result["fidlen"]]
 	result["fidstr"] = " ".join("%02X"%x for x in result["fid"])
 
-	#TODO: decode more fid values here
+	_DecodeGeneric(fid, result)
+
+	part = Database().Lookup(fid)
+	if part != None:
+		# database knows better, unknown (zero) values keep the decoded ones
+		for key, value in part.items():
+			if value or key not in result:
+				result[key] = value
+
+	if result.get("bits"):
+		result["cell"] = cellTypes.get(result["bits"], "%d bits/cell"%result["bits"])
+	if result.get("pagesize") and result.get("pagesperblock"):
+		result["blocksize"] = result["pagesize"] * result["pagesperblock"]
 
 	return result
 
+def _Size(value):
+	if value >= 1024 * 1024 and value % (1024 * 1024) == 0:
+		return "%dM"%(value // (1024 * 1024))
+	if value >= 1024 and value % 1024 == 0:
+		return "%dK"%(value // 1024)
+	return "%d"%value
+
 def GetFlashInfo(fid):
 	info = DecodeFlashId(fid)
+	details = []
+	if info.get("part"):
+		details.append(info["part"])
+	if info.get("process"):
+		details.append("%dnm"%info["process"])
+	if info.get("cell"):
+		details.append(info["cell"])
+	if info.get("pagesize"):
+		details.append("%s page"%_Size(info["pagesize"]))
+	if info.get("blocksize"):
+		details.append("%s block"%_Size(info["blocksize"]))
+	if info.get("planes"):
+		details.append("%d plane(s)"%info["planes"])
+	if info.get("dies"):
+		details.append("%d die(s)"%info["dies"])
+	if info.get("density"):
+		details.append("%d Gbit"%info["density"])
+
 	result = "%s (%s)"%(info["fidstr"], info["maker"])
+	if len(details) > 0:
+		result += " " + ", ".join(details)
 	return result
+
+# Absent chips read back as all zeros or all ones
+def Populated(fid):
+	return any(fid) and any(x != 0xFF for x in fid)
+
+FlashChip = collections.namedtuple("FlashChip", "channel ce fid")
+
+"""
+	Flash chips of a device: (channel, CE) -> ID of every populated
+	chip enable. Filled from the controller's raw ID pages
+"""
+class FlashTopology:
+	def __init__(self):
+		self.chips = []
+
+	def Add(self, channel, ce, fid):
+		if Populated(fid):
+			self.chips.append(FlashChip(channel, ce, bytes(fid)))
+		return self
+
+	"""
+		Add count IDs of idlen bytes, stride bytes apart, starting at
+		offset. Entry i is CE i % ces of channel channel + i // ces, ces
+		defaults to all entries on one channel
+	"""
+	def AddPage(self, page, offset=0, count=8, stride=16, idlen=8, ces=None, channel=0):
+		view = memoryview(page).cast('B')[offset:offset + count * stride]
+		ces = ces or count
+		for i, (entry,) in enumerate(struct.iter_unpack("%ds"%stride, view[:len(view) // stride * stride])):
+			self.Add(channel + i // ces, i % ces, entry[:idlen])
+		return self
+
+	def Ids(self):
+		return [chip.fid for chip in self.chips]
+
+	def Dies(self):
+		return sum(DecodeFlashId(chip.fid).get("dies", 1) for chip in self.chips)
+
+	# Raw NAND size in bytes, None if the density of some chip is unknown
+	def RawSize(self):
+		total = 0
+		for chip in self.chips:
+			density = DecodeFlashId(chip.fid).get("density")
+			if not density:
+				return None
+			total += density << 27
+		return total
+
+	# Chips of different kinds on one device, a sign of rebuilt or fake flash
+	def Mixed(self):
+		return len(set(chip.fid[:5] for chip in self.chips)) > 1
+
+	"""
+		Append flash entries to the report: first ID as "Flash ID", others
+		as "Flash ID #n", then CE and die count and raw size
+	"""
+	def Report(self, report):
+		if len(self.chips) == 0:
+			report.append(("Flash ID", "Unavailable"))
+			return report
+		for i, chip in enumerate(self.chips):
+			report.append(("Flash ID" if i == 0 else "Flash ID #%d"%(i + 1), chip.fid, "fid"))
+		report.append(("Flash CEs", len(self.chips)))
+		report.append(("Flash dies", self.Dies()))
+		size = self.RawSize()
+		if size != None:
+			report.append(("Flash size", size, "size"))
+		if self.Mixed():
+			report.append(("Flash warning", "Mixed flash chips"))
+		return report
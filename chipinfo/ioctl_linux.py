@@ -0,0 +1,322 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+# Linux IO via SG_IO ioctl (/dev/sg*, /dev/sd*)
+# Regular files are accepted too and act as a simple emulated disk
+
+import os
+import stat
+import errno
+import fcntl
+import mmap
+import struct
+import ctypes
+import sysfs
+
+SG_IO = 0x2285
+BLKGETSIZE64 = 0x80081272
+
+SG_DXFER_NONE = -1
+SG_DXFER_TO_DEV = -2
+SG_DXFER_FROM_DEV = -3
+
+SG_INFO_OK_MASK = 0x1
+SG_INFO_OK = 0x0
+
+SenseLength = 32
+SectorSize = 512
+
+class SG_IO_HDR(ctypes.Structure):
+	"""See: include/scsi/sg.h, struct sg_io_hdr"""
+	_fields_ = [
+		('interface_id', ctypes.c_int),
+		('dxfer_direction', ctypes.c_int),
+		('cmd_len', ctypes.c_ubyte),
+		('mx_sb_len', ctypes.c_ubyte),
+		('iovec_count', ctypes.c_ushort),
+		('dxfer_len', ctypes.c_uint),
+		('dxferp', ctypes.c_void_p),
+		('cmdp', ctypes.c_void_p),
+		('sbp', ctypes.c_void_p),
+		('timeout', ctypes.c_uint),
+		('flags', ctypes.c_uint),
+		('pack_id', ctypes.c_int),
+		('usr_ptr', ctypes.c_void_p),
+		('status', ctypes.c_ubyte),
+		('masked_status', ctypes.c_ubyte),
+		('msg_status', ctypes.c_ubyte),
+		('sb_len_wr', ctypes.c_ubyte),
+		('host_status', ctypes.c_ushort),
+		('driver_status', ctypes.c_ushort),
+		('resid', ctypes.c_int),
+		('duration', ctypes.c_uint),
+		('info', ctypes.c_uint)
+		]
+
+"""
+	Open device. Owns one sg_io_hdr, CDB, sense and page-aligned data
+	buffer which are reused by every request sent to this device
+"""
+class SgDevice(object):
+
+	def __init__(self, path):
+		self.path = path
+		self.fd = None
+		self.emulated = False
+		self.hdr = SG_IO_HDR()
+		self.cdb = (ctypes.c_ubyte * 16)()
+		self.sense = (ctypes.c_ubyte * SenseLength)()
+		self._mmap = None
+		self._array = None
+		self.buffer = None
+		self.status = 0
+
+		self.hdr.interface_id = ord('S')
+		self.hdr.cmdp = ctypes.addressof(self.cdb)
+		self.hdr.sbp = ctypes.addressof(self.sense)
+		self.hdr.mx_sb_len = SenseLength
+		self._Reserve(mmap.PAGESIZE)
+
+	def __enter__(self):
+		try:
+			self.fd = os.open(self.path, os.O_RDWR)
+		except OSError as e:
+			raise Exception('Failed to open %s. errno: %d' % (self.path, e.errno))
+		self.emulated = stat.S_ISREG(os.fstat(self.fd).st_mode)
+		return self
+
+	def __exit__(self, typ, val, tb):
+		if self.fd != None:
+			os.close(self.fd)
+			self.fd = None
+
+	# Grow the data buffer to hold at least size bytes
+	# mmap'ed memory is always page-aligned. Old buffer stays alive
+	# as long as somebody still holds a view of it
+	def _Reserve(self, size):
+		if self._mmap != None and len(self._mmap) >= size:
+			return
+		size = (size + mmap.PAGESIZE - 1) & ~(mmap.PAGESIZE - 1)
+		self._mmap = mmap.mmap(-1, size)
+		self._array = (ctypes.c_ubyte * size).from_buffer(self._mmap)
+		self.buffer = memoryview(self._mmap)
+
+	# Execute a CDB, transferring data to/from a writable buffer
+	# (self.buffer by default). Data-out payload must already be there
+	# Return True if the command completed with GOOD status
+	def Execute(self, cdb, length, dataIn=True, timeout=5, buffer=None):
+		if self.fd == None:
+			raise Exception('No file handle')
+		if buffer is None:
+			self._Reserve(length)
+			buffer = self.buffer
+			address = ctypes.addressof(self._array)
+		elif length > 0:
+			address = ctypes.addressof(ctypes.c_char.from_buffer(buffer))
+		else:
+			address = None
+
+		cdblen = min(len(cdb), 16)
+		if isinstance(cdb, list):
+			cdb = [x & 0xFF for x in cdb[:cdblen]]
+		self.cdb[:] = bytes(cdb[:cdblen]).ljust(16, b"\0")
+		ctypes.memset(self.sense, 0, SenseLength)
+		self.status = 0
+
+		if self.emulated:
+			self.status = _Emulate(self, buffer, length, dataIn)
+			return self.status == 0
+
+		hdr = self.hdr
+		hdr.cmd_len = cdblen
+		hdr.dxfer_len = length
+		hdr.dxferp = address
+		if length == 0:
+			hdr.dxfer_direction = SG_DXFER_NONE
+		else:
+			hdr.dxfer_direction = SG_DXFER_FROM_DEV if dataIn else SG_DXFER_TO_DEV
+		hdr.timeout = int(timeout * 1000)
+		hdr.status = 0
+		hdr.host_status = 0
+		hdr.driver_status = 0
+		hdr.info = 0
+
+		# releases the GIL for the duration of the command
+		fcntl.ioctl(self.fd, SG_IO, hdr)
+
+		# the buffer may hold an earlier command's data, clear what a
+		# short transfer did not reach
+		if dataIn and 0 < hdr.resid <= length:
+			memoryview(buffer).cast('B')[length - hdr.resid:length] = bytes(hdr.resid)
+		self.status = hdr.status
+		return (hdr.info & SG_INFO_OK_MASK) == SG_INFO_OK
+
+# Fixed-format sense data for emulated failures
+def _SetSense(dctl, key, asc, ascq=0):
+	dctl.sense[0] = 0x70
+	dctl.sense[2] = key
+	dctl.sense[7] = 10
+	dctl.sense[12] = asc
+	dctl.sense[13] = ascq
+	return 2	# CHECK CONDITION
+
+"""
+	Minimal SCSI disk emulation on top of a regular file
+	Enough for standard commands, vendor commands are rejected
+"""
+def _Emulate(dctl, buf, length, dataIn):
+	cdb = dctl.cdb
+	op = cdb[0]
+	buf = memoryview(buf).cast('B')
+	sectors = os.fstat(dctl.fd).st_size // SectorSize
+	# data-in buffers are reused, whatever a command does not fill reads as zeros
+	if dataIn and op not in (0x28, 0x88) and length > 0:
+		buf[:length] = bytes(length)
+
+	if op == 0x00:		# TEST UNIT READY
+		return 0
+
+	if op == 0x12:		# INQUIRY
+		if cdb[1] & 1:
+			if cdb[2] == 0x00:		# supported VPD pages
+				inquiry = bytes([0, 0, 0, 2, 0x00, 0x80])
+			elif cdb[2] == 0x80:	# unit serial number, made from the file's inode
+				serial = b"%016X"%os.fstat(dctl.fd).st_ino
+				inquiry = bytes([0, 0x80, 0, len(serial)]) + serial
+			else:
+				return _SetSense(dctl, 5, 0x24)		# ILLEGAL REQUEST, invalid field in CDB
+		else:
+			inquiry = struct.pack(">BBBBB3x8s16s4s", 0, 0x80, 5, 2, 31, b"CHIPINFO", b"File backed disk", b"0001")
+		n = min(length, len(inquiry))
+		buf[:n] = inquiry[:n]
+		return 0
+
+	if op == 0x25:		# READ CAPACITY(10)
+		last = min(sectors - 1, 0xFFFFFFFF)
+		buf[:8] = struct.pack(">II", last, SectorSize)
+		return 0
+
+	if op == 0x9E and cdb[1] & 0x1F == 0x10:		# READ CAPACITY(16)
+		buf[:12] = struct.pack(">QI", sectors - 1, SectorSize)
+		return 0
+
+	if op in (0x28, 0x2A):		# READ(10), WRITE(10)
+		lba = struct.unpack_from(">I", cdb, 2)[0]
+		count = struct.unpack_from(">H", cdb, 7)[0]
+	elif op in (0x88, 0x8A):	# READ(16), WRITE(16)
+		lba = struct.unpack_from(">Q", cdb, 2)[0]
+		count = struct.unpack_from(">I", cdb, 10)[0]
+	else:
+		return _SetSense(dctl, 5, 0x20)		# ILLEGAL REQUEST, invalid command opcode
+
+	if lba + count > sectors:
+		return _SetSense(dctl, 5, 0x21)		# ILLEGAL REQUEST, LBA out of range
+	size = min(count * SectorSize, length)
+	if op in (0x28, 0x88):
+		os.preadv(dctl.fd, [buf[:size]], lba * SectorSize)
+		if length > size:
+			buf[size:length] = bytes(length - size)
+	else:
+		os.pwrite(dctl.fd, buf[:size], lba * SectorSize)
+	return 0
+
+# Removable or USB attached SCSI disks
+def EnumerateDevices(root="/sys"):
+	return [disk.node for disk in sysfs.Disks(root, refresh=True).values() if sysfs.IsRemovable(disk)]
+
+def GetCapacity(dctl):
+	st = os.fstat(dctl.fd)
+	if stat.S_ISREG(st.st_mode):
+		return st.st_size
+
+	if stat.S_ISBLK(st.st_mode):
+		size = bytearray(8)
+		fcntl.ioctl(dctl.fd, BLKGETSIZE64, size)
+		return struct.unpack("<Q", size)[0]
+
+	# sg node, ask the device itself
+	if dctl.Execute([0x25] + [0] * 9, 8):
+		last, blocksize = struct.unpack_from(">II", dctl.buffer, 0)
+		if last != 0xFFFFFFFF:
+			return (last + 1) * blocksize
+	if dctl.Execute([0x9E, 0x10] + [0] * 11 + [12, 0, 0], 12):
+		last, blocksize = struct.unpack_from(">QI", dctl.buffer, 0)
+		return (last + 1) * blocksize
+
+	raise Exception('Unable to read capacity. ScsiStatus: %d' % dctl.status)
+
+def LastStatus(dctl):
+	return dctl.status, bytes(dctl.sense)
+
+"""
+	Send a CDB (list, bytes or scsi.CDB data) to the device. data may be:
+	- int: transfer length. Device's own buffer is used and a memoryview
+	  into it is returned. It is only valid until the next request
+	- bytearray/memoryview: transfer directly from/into it, no copies
+	- bytes: data-out payload
+	- list of ints: legacy callers, copied in and out
+"""
+def ScsiRequest(dctl, cdb, data, dataIn=True, mayFail=False, timeout=5):
+	if isinstance(data, int):
+		length = data
+		buffer = None
+	elif isinstance(data, list):
+		length = len(data)
+		buffer = None
+		if dataIn == False:
+			dctl._Reserve(length)
+			dctl.buffer[:length] = bytes(x & 0xFF for x in data)
+	else:
+		view = memoryview(data)
+		length = view.nbytes
+		if view.readonly:
+			dctl._Reserve(length)
+			dctl.buffer[:length] = view.cast('B')
+			buffer = None
+		else:
+			buffer = data
+
+	try:
+		ok = dctl.Execute(cdb, length, dataIn, timeout, buffer)
+	except OSError as e:
+		if mayFail == False:
+			raise Exception('SCSI request failure. errno: %d (%s)' % (e.errno, errno.errorcode.get(e.errno, "?")))
+		return None
+
+	if ok:
+		if dataIn == True:
+			if isinstance(data, int):
+				return dctl.buffer[:length]
+			if isinstance(data, list):
+				data[:] = dctl.buffer[:length]
+			return data
+		else:
+			return True
+	else:
+		if mayFail == False:
+			raise Exception('SCSI request failure. ScsiStatus: %d' % dctl.status)
+
+	return None
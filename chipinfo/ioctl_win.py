@@ -22,6 +22,7 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import math
 import ctypes
 import ctypes.wintypes as wintypes
 from ctypes import windll
@@ -56,22 +57,34 @@ FALSE = wintypes.BOOL(0)
 TRUE = wintypes.BOOL(1)
 
 
+_prototypes = {}
+
+def _Kernel32Fn(name, argtypes, restype):
+    """Bind a kernel32 function prototype once and cache it"""
+    fn = _prototypes.get(name)
+    if fn is None:
+        fn = getattr(windll.kernel32, name)
+        fn.argtypes = argtypes
+        fn.restype = restype
+        _prototypes[name] = fn
+    return fn
+
+
 def _CreateFile(filename, access, mode, creation, flags):
     """See: CreateFile function
 
     http://msdn.microsoft.com/en-us/library/windows/desktop/aa363858(v=vs.85).aspx
 
     """
-    CreateFile_Fn = windll.kernel32.CreateFileW
-    CreateFile_Fn.argtypes = [
+    CreateFile_Fn = _Kernel32Fn('CreateFileW', [
             wintypes.LPWSTR,                    # _In_          LPCTSTR lpFileName
             wintypes.DWORD,                     # _In_          DWORD dwDesiredAccess
             wintypes.DWORD,                     # _In_          DWORD dwShareMode
             LPSECURITY_ATTRIBUTES,              # _In_opt_      LPSECURITY_ATTRIBUTES lpSecurityAttributes
             wintypes.DWORD,                     # _In_          DWORD dwCreationDisposition
             wintypes.DWORD,                     # _In_          DWORD dwFlagsAndAttributes
-            wintypes.HANDLE]                    # _In_opt_      HANDLE hTemplateFile
-    CreateFile_Fn.restype = wintypes.HANDLE
+            wintypes.HANDLE],                   # _In_opt_      HANDLE hTemplateFile
+            wintypes.HANDLE)
 
     return wintypes.HANDLE(CreateFile_Fn(filename,
                          access,
@@ -88,8 +101,7 @@ def _DeviceIoControl(devhandle, ioctl, inbuf, inbufsiz, outbuf, outbufsiz):
     http://msdn.microsoft.com/en-us/library/aa363216(v=vs.85).aspx
 
     """
-    DeviceIoControl_Fn = windll.kernel32.DeviceIoControl
-    DeviceIoControl_Fn.argtypes = [
+    DeviceIoControl_Fn = _Kernel32Fn('DeviceIoControl', [
             wintypes.HANDLE,                    # _In_          HANDLE hDevice
             wintypes.DWORD,                     # _In_          DWORD dwIoControlCode
             wintypes.LPVOID,                    # _In_opt_      LPVOID lpInBuffer
@@ -97,8 +109,8 @@ def _DeviceIoControl(devhandle, ioctl, inbuf, inbufsiz, outbuf, outbufsiz):
             wintypes.LPVOID,                    # _Out_opt_     LPVOID lpOutBuffer
             wintypes.DWORD,                     # _In_          DWORD nOutBufferSize
             LPDWORD,                            # _Out_opt_     LPDWORD lpBytesReturned
-            LPOVERLAPPED]                       # _Inout_opt_   LPOVERLAPPED lpOverlapped
-    DeviceIoControl_Fn.restype = wintypes.BOOL
+            LPOVERLAPPED],                      # _Inout_opt_   LPOVERLAPPED lpOverlapped
+            wintypes.BOOL)
 
     # allocate a DWORD, and take its reference
     dwBytesReturned = wintypes.DWORD(0)
@@ -121,6 +133,7 @@ class DeviceIoControl(object):
     def __init__(self, path):
         self.path = path
         self._fhandle = None
+        self._request = None
 
     def _validate_handle(self):
         if self._fhandle is None:
@@ -133,6 +146,13 @@ class DeviceIoControl(object):
         self._validate_handle()
         return _DeviceIoControl(self._fhandle, ctl, inbuf, inbufsiz, outbuf, outbufsiz)
 
+    def request(self, size):
+        """Prepared SCSI pass-through block with a data buffer of at least size bytes"""
+        if self._request is None:
+            self._request = PreparedRequest()
+        self._request.reserve(size)
+        return self._request
+
     def __enter__(self):
         self._fhandle = _CreateFile(
                 self.path,
@@ -152,20 +172,32 @@ class DeviceIoControl(object):
         else:
             windll.kernel32.CloseHandle(self._fhandle)
 
-def GetCapacity(dctl):
-	# first, define the Structure in ctypes language
-	class DISK_GEOMETRY(ctypes.Structure):
-		"""See: http://msdn.microsoft.com/en-us/library/aa363972(v=vs.85).aspx"""
-		_fields_ = [
-			('Cylinders', wintypes.LARGE_INTEGER),
-			('MediaType', wintypes.BYTE),   # MEDIA_TYPE
-			('TracksPerCylinder', wintypes.DWORD),
-			('SectorsPerTrack', wintypes.DWORD),
-			('BytesPerSector', wintypes.DWORD)
-			]
-
-	IOCTL_DISK_GET_DRIVE_GEOMETRY = 0x70000
+DRIVE_REMOVABLE = 2
+
+def EnumerateDevices():
+	"""Drive letters of all removable drives"""
+	mask = windll.kernel32.GetLogicalDrives()
+	devices = []
+	for i in range(26):
+		if mask & (1 << i):
+			letter = chr(ord('A') + i)
+			if windll.kernel32.GetDriveTypeW(letter + ":\\") == DRIVE_REMOVABLE:
+				devices.append(letter + ":")
+	return devices
+
+class DISK_GEOMETRY(ctypes.Structure):
+	"""See: http://msdn.microsoft.com/en-us/library/aa363972(v=vs.85).aspx"""
+	_fields_ = [
+		('Cylinders', ctypes.c_int64),
+		('MediaType', ctypes.c_uint32),	# MEDIA_TYPE
+		('TracksPerCylinder', ctypes.c_uint32),
+		('SectorsPerTrack', ctypes.c_uint32),
+		('BytesPerSector', ctypes.c_uint32)
+		]
 
+IOCTL_DISK_GET_DRIVE_GEOMETRY = 0x70000
+
+def GetCapacity(dctl):
 	disk_geometry = DISK_GEOMETRY()
 	p_disk_geometry = ctypes.pointer(disk_geometry)
 
@@ -181,88 +213,137 @@ def GetCapacity(dctl):
 
 	return None
 
-class PointerSizeTest(ctypes.Structure):
-		_fields_ = [
-			('P', ctypes.POINTER(wintypes.BYTE))
-			]
+# SPTI structures. Fixed-size field types keep the layout identical to the
+# Windows headers regardless of the host the module is imported on
+
+SenseLength = 24
+
+class SCSI_SENSE_DATA(ctypes.Structure):
+	_fields_ = [
+		('Data', ctypes.c_ubyte * SenseLength)
+	]
+
+class SCSI_PASS_THROUGH_DIRECT(ctypes.Structure):
+	_fields_ = [
+		('Length', ctypes.c_uint16),
+		('ScsiStatus', ctypes.c_ubyte),
+		('PathId', ctypes.c_ubyte),
+		('TargetId', ctypes.c_ubyte),
+		('Lun', ctypes.c_ubyte),
+		('CdbLength', ctypes.c_ubyte),
+		('SenseInfoLength', ctypes.c_ubyte),
+		('DataIn', ctypes.c_ubyte),
+		('Padding9', ctypes.c_ubyte * 3),
+		('DataTransferLength', ctypes.c_uint32),
+		('TimeOutValue', ctypes.c_uint32),
+		('DataBuffer', ctypes.c_void_p),
+		('SenseInfoOffset', ctypes.c_uint32),
+		('Cdb', ctypes.c_ubyte * 16)
+		]
 
-def ScsiRequest(dctl, cdb, data, dataIn=True, mayFail=False):
-	SenseLength = 24
-	class SCSI_SENSE_DATA(ctypes.Structure):
-		_fields_ = [
-			('Data', wintypes.BYTE * SenseLength)
+class SCSI_PASS_THROUGH_DIRECT_WITH_SENSE(SCSI_PASS_THROUGH_DIRECT):
+	_fields_ = [
+		('Sense', ctypes.c_ubyte * SenseLength)
 		]
 
-	class SCSI_PASS_THROUGH_DIRECT(ctypes.Structure):
-		_fields_ = [
-			('Length', wintypes.USHORT),
-			('ScsiStatus', wintypes.BYTE),
-			('PathId', wintypes.BYTE),
-			('TargetId', wintypes.BYTE),
-			('Lun', wintypes.BYTE),
-			('CdbLength', wintypes.BYTE),
-			('SenseInfoLength', wintypes.BYTE),
-			('DataIn', wintypes.BYTE),
-			('Padding9', wintypes.BYTE * 3),
-			('DataTransferLength', wintypes.DWORD),
-			('TimeOutValue', wintypes.DWORD),
-			('DataBuffer', ctypes.POINTER(wintypes.BYTE)),
-			('SenseInfoOffset', wintypes.DWORD),
-			('Cdb', wintypes.BYTE * 16)
-			]
-
-	class SCSI_PASS_THROUGH_DIRECT_WITH_SENSE(SCSI_PASS_THROUGH_DIRECT):
-		_fields_ = [
-			('Sense', wintypes.BYTE * SenseLength)
-			]
-
-	#print("0x%X"%(ctypes.sizeof(SCSI_PASS_THROUGH_DIRECT)))
-	#print("0x%X"%(ctypes.sizeof(SCSI_PASS_THROUGH_DIRECT_WITH_SENSE)))
-	#print("0x%X"%(SCSI_PASS_THROUGH_DIRECT_WITH_SENSE.Sense.offset))
-
-	IOCTL_SCSI_PASS_THROUGH_DIRECT = 0x4D014
-
-	buf = (wintypes.BYTE * len(data))()
-	if dataIn == False:
-		for i in range(len(data)):
-			buf[i] = data[i] & 0xFF
-
-	pass_through = SCSI_PASS_THROUGH_DIRECT_WITH_SENSE()
-	pass_through.Length = ctypes.sizeof(SCSI_PASS_THROUGH_DIRECT)
-	pass_through.CdbLength = 16
-	pass_through.SenseInfoLength = SenseLength
-	pass_through.DataIn = 1 if dataIn == True else 0
-	pass_through.DataBuffer = buf
-	pass_through.DataTransferLength = len(buf)
-	pass_through.TimeOutValue = 5
-	pass_through.SenseInfoOffset = SCSI_PASS_THROUGH_DIRECT_WITH_SENSE.Sense.offset #0x30 #pass_through.Sense.offset
-
-	# validate structure size
-	if (ctypes.sizeof(PointerSizeTest) == 4 and pass_through.Length == 0x2C) \
-	or (ctypes.sizeof(PointerSizeTest) == 8 and pass_through.Length == 0x38):
-			pass
+IOCTL_SCSI_PASS_THROUGH_DIRECT = 0x4D014
+
+# SPTD size the driver expects for the given pointer size
+def ValidSptdLength(length, pointerSize):
+	return (pointerSize == 4 and length == 0x2C) \
+		or (pointerSize == 8 and length == 0x38)
+
+def ValidateStructures():
+	length = ctypes.sizeof(SCSI_PASS_THROUGH_DIRECT)
+	if not ValidSptdLength(length, ctypes.sizeof(ctypes.c_void_p)):
+		raise Exception("Invalid SPTD structure size 0x%X, 0x%X"%(length, ctypes.sizeof(SCSI_PASS_THROUGH_DIRECT_WITH_SENSE)))
+
+ValidateStructures()
+
+"""
+	Pass-through block and data buffer owned by a device.
+	Constant fields are filled once, the data buffer only grows
+	so it always fits the largest transfer seen so far
+"""
+class PreparedRequest:
+	def __init__(self):
+		self.sptd = SCSI_PASS_THROUGH_DIRECT_WITH_SENSE()
+		self.sptd.Length = ctypes.sizeof(SCSI_PASS_THROUGH_DIRECT)
+		self.sptd.CdbLength = 16
+		self.sptd.SenseInfoLength = SenseLength
+		self.sptd.TimeOutValue = 5
+		self.sptd.SenseInfoOffset = SCSI_PASS_THROUGH_DIRECT_WITH_SENSE.Sense.offset
+		self.pointer = ctypes.pointer(self.sptd)
+		self.size = ctypes.sizeof(SCSI_PASS_THROUGH_DIRECT_WITH_SENSE)
+		self.buffer = None
+
+	def reserve(self, size):
+		if self.buffer is None or len(self.buffer) < size:
+			self.buffer = (ctypes.c_ubyte * max(size, 512))()
+			self.sptd.DataBuffer = ctypes.addressof(self.buffer)
+
+	def prepare(self, cdb, length, dataIn, timeout=5):
+		sptd = self.sptd
+		cdblen = min(len(cdb), 16)
+		if isinstance(cdb, list):
+			cdb = [x & 0xFF for x in cdb[:cdblen]]
+		sptd.Cdb[:] = bytes(cdb[:cdblen]).ljust(16, b"\0")
+		#TODO: fix CdbLength according to SCSI specs
+		sptd.DataIn = 1 if dataIn == True else 0
+		sptd.DataTransferLength = length
+		sptd.TimeOutValue = max(1, int(math.ceil(timeout)))
+		sptd.ScsiStatus = 0
+		return self.pointer
+
+def LastStatus(dctl):
+	request = dctl._request
+	if request is None:
+		return 0, b""
+	return request.sptd.ScsiStatus, bytes(request.sptd.Sense)
+
+"""
+	Send a CDB (list, bytes or scsi.CDB data) to the device. data may be:
+	- int: transfer length. A memoryview into the device's own buffer
+	  is returned. It is only valid until the next request
+	- bytearray/memoryview: data-in is stored into it
+	- bytes/bytearray: data-out payload
+	- list of ints: legacy callers, copied in and out
+"""
+def ScsiRequest(dctl, cdb, data, dataIn=True, mayFail=False, timeout=5):
+	if isinstance(data, int):
+		length = data
 	else:
-			raise Exception("Invalid SPTD structure size 0x%X, 0x%X"%(pass_through.Length, ctypes.sizeof(SCSI_PASS_THROUGH_DIRECT_WITH_SENSE)))
-
-	for i in range(len(cdb)):
-		if i >= 16:
-			break
-		pass_through.Cdb[i] = cdb[i] & 0xFF
-
-	#TODO: fix CdbLength according to SCSI specs
-
-	p_pass_through = ctypes.pointer(pass_through)
+		length = len(data) if isinstance(data, list) else memoryview(data).nbytes
+	request = dctl.request(length)
+	buf = request.buffer
+	# the buffer is reused, a short data-in transfer must not leave the
+	# previous command's bytes behind
+	ctypes.memset(request.sptd.Sense, 0, SenseLength)
+	if dataIn == True and length > 0:
+		ctypes.memset(buf, 0, length)
+	if dataIn == False and length > 0:
+		if isinstance(data, list):
+			data = bytes(x & 0xFF for x in data)
+		memoryview(buf).cast('B')[:length] = memoryview(data).cast('B')
+
+	p_pass_through = request.prepare(cdb, length, dataIn, timeout)
 
 	status, _ = dctl.ioctl(IOCTL_SCSI_PASS_THROUGH_DIRECT,
-			p_pass_through, ctypes.sizeof(SCSI_PASS_THROUGH_DIRECT_WITH_SENSE),
-			p_pass_through, ctypes.sizeof(SCSI_PASS_THROUGH_DIRECT_WITH_SENSE))
+			p_pass_through, request.size,
+			p_pass_through, request.size)
 
+	pass_through = request.sptd
 	#print(status, pass_through.ScsiStatus, pass_through.Sense[0])
 
 	if status and pass_through.ScsiStatus == 0:
 		if dataIn == True:
-			for i in range(len(data)):
-				data[i] = buf[i] & 0xFF
+			view = memoryview(buf).cast('B')[:length]
+			if isinstance(data, int):
+				return view
+			if isinstance(data, list):
+				data[:] = view
+			else:
+				memoryview(data).cast('B')[:] = view
 			return data
 		else:
 			return True
@@ -0,0 +1,493 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+# Block device IO engines for bulk data
+# Every engine owns depth page-aligned buffers of blocksize bytes, reused
+# for the whole run. Submit(index, offset, length) queues a transfer into
+# or out of buffer index, Reap(wait) returns finished (index, result)
+# pairs, result being the byte count or -errno. The device is opened with
+# O_DIRECT where the file system allows it.
+#	direct	pread/pwrite, one transfer at a time
+#	libaio	Linux native AIO, io_submit/io_getevents
+#	uring	io_uring, shared submission and completion rings
+# libaio and uring are raw system calls through ctypes, no library needed.
+# Create() falls back along that list when the kernel lacks a feature
+
+import os
+import mmap
+import time
+import errno
+import ctypes
+import platform
+import collections
+
+# system call numbers, io_uring ones are shared by all architectures
+_syscalls = {
+	"x86_64": {"io_setup": 206, "io_destroy": 207, "io_getevents": 208, "io_submit": 209, "io_uring_setup": 425, "io_uring_enter": 426},
+	"aarch64": {"io_setup": 0, "io_destroy": 1, "io_submit": 2, "io_getevents": 4, "io_uring_setup": 425, "io_uring_enter": 426},
+	}
+
+_libc = None
+
+def _Syscall(name, *args):
+	global _libc
+	numbers = _syscalls.get(platform.machine())
+	if numbers == None or name not in numbers:
+		return -errno.ENOSYS
+	if _libc == None:
+		_libc = ctypes.CDLL(None, use_errno=True)
+		_libc.syscall.restype = ctypes.c_long
+	args = [ctypes.c_long(a) if isinstance(a, int) else a for a in args]
+	result = _libc.syscall(ctypes.c_long(numbers[name]), *args)
+	return result if result >= 0 else -ctypes.get_errno()
+
+# Open for direct IO, (fd, True) or (fd, False) if O_DIRECT is refused
+def OpenDirect(path, write=False):
+	flags = (os.O_RDWR if write else os.O_RDONLY) | getattr(os, "O_BINARY", 0)
+	if hasattr(os, "O_DIRECT"):
+		try:
+			return os.open(path, flags | os.O_DIRECT), True
+		except OSError as e:
+			if e.errno != errno.EINVAL:
+				raise Exception('Failed to open %s. errno: %d' % (path, e.errno))
+	try:
+		return os.open(path, flags), False
+	except OSError as e:
+		raise Exception('Failed to open %s. errno: %d' % (path, e.errno))
+
+class _Engine:
+	name = None
+
+	def __init__(self, path, depth=1, blocksize=1024 * 1024, write=False):
+		self.path = path
+		self.depth = max(1, depth)
+		self.blocksize = blocksize
+		self.write = write
+		self.fd, self.direct = OpenDirect(path, write)
+		self._buffered = None
+		self.buffers = [mmap.mmap(-1, blocksize) for i in range(self.depth)]
+		self._chars = [ctypes.c_char.from_buffer(b) for b in self.buffers]
+		self._addresses = [ctypes.addressof(c) for c in self._chars]
+		# index: (offset, length, write) of transfers in flight
+		self.inflight = {}
+
+	def Buffer(self, index, length=None):
+		return memoryview(self.buffers[index])[:self.blocksize if length == None else length]
+
+	def Submit(self, index, offset, length, write=False):
+		if index in self.inflight:
+			raise Exception("Buffer %d is busy" % index)
+		if length > self.blocksize:
+			raise Exception("Transfer of %d bytes exceeds the buffer" % length)
+		self.inflight[index] = (offset, length, write)
+		self._Submit(index, offset, length, write)
+
+	"""
+		Wait for at least wait transfers (fewer if fewer are in flight),
+		return the finished ones as (index, result) pairs
+	"""
+	def Reap(self, wait=1):
+		wait = min(wait, len(self.inflight))
+		results = []
+		while True:
+			for index, result in self._Reap(wait - len(results)):
+				results.append((index, self._Finish(index, result)))
+			if len(results) >= wait:
+				return results
+
+	def _Finish(self, index, result):
+		offset, length, write = self.inflight.pop(index)
+		if result != -errno.EINVAL or not self.direct:
+			return result
+		# O_DIRECT alignment is up to the device and file system, redo the
+		# odd transfer through the page cache
+		if self._buffered == None:
+			self._buffered = os.open(self.path, (os.O_RDWR if self.write else os.O_RDONLY) | getattr(os, "O_BINARY", 0))
+		return _Transfer(self._buffered, self.Buffer(index, length), offset, write)
+
+	def Close(self):
+		while len(self.inflight) > 0:
+			self.Reap(len(self.inflight))
+		self._Close()
+		del self._chars[:]
+		for b in self.buffers:
+			b.close()
+		if self._buffered != None:
+			os.close(self._buffered)
+		os.close(self.fd)
+
+	def _Close(self):
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.Close()
+
+def _Transfer(fd, view, offset, write):
+	try:
+		if write:
+			return os.pwritev(fd, [view], offset)
+		return os.preadv(fd, [view], offset)
+	except OSError as e:
+		return -e.errno
+
+# Synchronous pread/pwrite, the transfer is done by the time Submit returns
+class DirectEngine(_Engine):
+	name = "direct"
+
+	def __init__(self, path, depth=1, blocksize=1024 * 1024, write=False):
+		_Engine.__init__(self, path, depth, blocksize, write)
+		self._done = collections.deque()
+
+	def _Submit(self, index, offset, length, write):
+		self._done.append((index, _Transfer(self.fd, self.Buffer(index, length), offset, write)))
+
+	def _Reap(self, wait):
+		done = list(self._done)
+		self._done.clear()
+		return done
+
+	@staticmethod
+	def Available():
+		return hasattr(os, "preadv")
+
+# linux/aio_abi.h, little endian
+class _Iocb(ctypes.Structure):
+	_fields_ = [
+		("data", ctypes.c_uint64),
+		("key", ctypes.c_uint32),
+		("rw_flags", ctypes.c_uint32),
+		("opcode", ctypes.c_uint16),
+		("reqprio", ctypes.c_int16),
+		("fildes", ctypes.c_uint32),
+		("buf", ctypes.c_uint64),
+		("nbytes", ctypes.c_uint64),
+		("offset", ctypes.c_int64),
+		("reserved2", ctypes.c_uint64),
+		("flags", ctypes.c_uint32),
+		("resfd", ctypes.c_uint32),
+		]
+
+class _IoEvent(ctypes.Structure):
+	_fields_ = [
+		("data", ctypes.c_uint64),
+		("obj", ctypes.c_uint64),
+		("res", ctypes.c_int64),
+		("res2", ctypes.c_int64),
+		]
+
+_IOCB_CMD_PREAD = 0
+_IOCB_CMD_PWRITE = 1
+
+# Linux native AIO. Submissions are batched until the next Reap
+class AioEngine(_Engine):
+	name = "libaio"
+
+	def __init__(self, path, depth=1, blocksize=1024 * 1024, write=False):
+		_Engine.__init__(self, path, depth, blocksize, write)
+		self._ctx = ctypes.c_ulong(0)
+		result = _Syscall("io_setup", self.depth, ctypes.byref(self._ctx))
+		if result < 0:
+			_Engine.Close(self)
+			raise Exception('io_setup failure. errno: %d (%s)' % (-result, errno.errorcode.get(-result, "?")))
+		self._iocbs = (_Iocb * self.depth)()
+		self._events = (_IoEvent * self.depth)()
+		self._queue = []
+		self._failed = []
+
+	def _Submit(self, index, offset, length, write):
+		iocb = self._iocbs[index]
+		ctypes.memset(ctypes.addressof(iocb), 0, ctypes.sizeof(iocb))
+		iocb.data = index
+		iocb.opcode = _IOCB_CMD_PWRITE if write else _IOCB_CMD_PREAD
+		iocb.fildes = self.fd
+		iocb.buf = self._addresses[index]
+		iocb.nbytes = length
+		iocb.offset = offset
+		self._queue.append(index)
+
+	def _Flush(self):
+		while len(self._queue) > 0:
+			pointers = (ctypes.c_void_p * len(self._queue))(*[ctypes.addressof(self._iocbs[i]) for i in self._queue])
+			result = _Syscall("io_submit", self._ctx.value, len(self._queue), pointers)
+			if result == -errno.EINTR:
+				continue
+			if result < 0:
+				# the first one was refused, the rest may still go
+				self._failed.append((self._queue.pop(0), result))
+				continue
+			del self._queue[:result]
+
+	def _Reap(self, wait):
+		self._Flush()
+		if len(self._failed) > 0:
+			failed = self._failed
+			self._failed = []
+			return failed
+		while True:
+			count = _Syscall("io_getevents", self._ctx.value, max(0, wait), self.depth, self._events, None)
+			if count != -errno.EINTR:
+				break
+		if count < 0:
+			raise Exception('io_getevents failure. errno: %d (%s)' % (-count, errno.errorcode.get(-count, "?")))
+		return [(self._events[i].data, self._events[i].res) for i in range(count)]
+
+	def _Close(self):
+		_Syscall("io_destroy", self._ctx.value)
+
+	@staticmethod
+	def Available():
+		ctx = ctypes.c_ulong(0)
+		if _Syscall("io_setup", 1, ctypes.byref(ctx)) < 0:
+			return False
+		_Syscall("io_destroy", ctx.value)
+		return True
+
+# linux/io_uring.h
+class _SqOffsets(ctypes.Structure):
+	_fields_ = [(n, ctypes.c_uint32) for n in ("head", "tail", "ring_mask", "ring_entries", "flags", "dropped", "array", "resv1")] + [("user_addr", ctypes.c_uint64)]
+
+class _CqOffsets(ctypes.Structure):
+	_fields_ = [(n, ctypes.c_uint32) for n in ("head", "tail", "ring_mask", "ring_entries", "overflow", "cqes", "flags", "resv1")] + [("user_addr", ctypes.c_uint64)]
+
+class _UringParams(ctypes.Structure):
+	_fields_ = [(n, ctypes.c_uint32) for n in ("sq_entries", "cq_entries", "flags", "sq_thread_cpu", "sq_thread_idle", "features", "wq_fd")] + [
+		("resv", ctypes.c_uint32 * 3),
+		("sq_off", _SqOffsets),
+		("cq_off", _CqOffsets),
+		]
+
+class _Sqe(ctypes.Structure):
+	_fields_ = [
+		("opcode", ctypes.c_uint8),
+		("flags", ctypes.c_uint8),
+		("ioprio", ctypes.c_uint16),
+		("fd", ctypes.c_int32),
+		("off", ctypes.c_uint64),
+		("addr", ctypes.c_uint64),
+		("len", ctypes.c_uint32),
+		("rw_flags", ctypes.c_uint32),
+		("user_data", ctypes.c_uint64),
+		("buf_index", ctypes.c_uint16),
+		("personality", ctypes.c_uint16),
+		("splice_fd_in", ctypes.c_int32),
+		("pad", ctypes.c_uint64 * 2),
+		]
+
+class _Cqe(ctypes.Structure):
+	_fields_ = [
+		("user_data", ctypes.c_uint64),
+		("res", ctypes.c_int32),
+		("flags", ctypes.c_uint32),
+		]
+
+class _Iovec(ctypes.Structure):
+	_fields_ = [
+		("base", ctypes.c_void_p),
+		("len", ctypes.c_size_t),
+		]
+
+# READV/WRITEV rather than READ/WRITE, those need 5.6
+_IORING_OP_READV = 1
+_IORING_OP_WRITEV = 2
+_IORING_ENTER_GETEVENTS = 1
+_IORING_OFF_SQ_RING = 0
+_IORING_OFF_CQ_RING = 0x8000000
+_IORING_OFF_SQES = 0x10000000
+
+# io_uring without SQ polling: the kernel only looks at the submission
+# ring inside io_uring_enter, so the system call orders ring updates
+class UringEngine(_Engine):
+	name = "uring"
+
+	def __init__(self, path, depth=1, blocksize=1024 * 1024, write=False):
+		_Engine.__init__(self, path, depth, blocksize, write)
+		params = _UringParams()
+		self._ring = _Syscall("io_uring_setup", self.depth, ctypes.byref(params))
+		if self._ring < 0:
+			_Engine.Close(self)
+			raise Exception('io_uring_setup failure. errno: %d (%s)' % (-self._ring, errno.errorcode.get(-self._ring, "?")))
+		try:
+			self._Map(params)
+		except Exception:
+			self._Unmap()
+			os.close(self._ring)
+			_Engine.Close(self)
+			raise
+		self._iovecs = (_Iovec * self.depth)()
+		for i in range(self.depth):
+			self._iovecs[i].base = self._addresses[i]
+		self._pending = 0
+
+	def _Map(self, params):
+		sq, cq = params.sq_off, params.cq_off
+		self._maps = []
+		self._views = []
+		sqring = self._Mmap(sq.array + params.sq_entries * 4, _IORING_OFF_SQ_RING)
+		cqring = self._Mmap(cq.cqes + params.cq_entries * ctypes.sizeof(_Cqe), _IORING_OFF_CQ_RING)
+		sqes = self._Mmap(params.sq_entries * ctypes.sizeof(_Sqe), _IORING_OFF_SQES)
+		self._sqTail = self._View(ctypes.c_uint32, sqring, sq.tail)
+		self._sqMask = self._View(ctypes.c_uint32, sqring, sq.ring_mask).value
+		self._sqArray = self._View(ctypes.c_uint32 * params.sq_entries, sqring, sq.array)
+		self._sqes = self._View(_Sqe * params.sq_entries, sqes, 0)
+		self._cqHead = self._View(ctypes.c_uint32, cqring, cq.head)
+		self._cqTail = self._View(ctypes.c_uint32, cqring, cq.tail)
+		self._cqMask = self._View(ctypes.c_uint32, cqring, cq.ring_mask).value
+		self._cqes = self._View(_Cqe * params.cq_entries, cqring, cq.cqes)
+
+	def _Mmap(self, size, offset):
+		m = mmap.mmap(self._ring, size, mmap.MAP_SHARED | getattr(mmap, "MAP_POPULATE", 0), mmap.PROT_READ | mmap.PROT_WRITE, offset=offset)
+		self._maps.append(m)
+		return m
+
+	def _View(self, ctype, m, offset):
+		view = ctype.from_buffer(m, offset)
+		self._views.append(view)
+		return view
+
+	def _Unmap(self):
+		self._sqTail = self._sqArray = self._sqes = self._cqHead = self._cqTail = self._cqes = None
+		del self._views[:]
+		for m in self._maps:
+			m.close()
+
+	def _Submit(self, index, offset, length, write):
+		tail = self._sqTail.value
+		slot = tail & self._sqMask
+		sqe = self._sqes[slot]
+		ctypes.memset(ctypes.addressof(sqe), 0, ctypes.sizeof(sqe))
+		sqe.opcode = _IORING_OP_WRITEV if write else _IORING_OP_READV
+		sqe.fd = self.fd
+		sqe.off = offset
+		self._iovecs[index].len = length
+		sqe.addr = ctypes.addressof(self._iovecs[index])
+		sqe.len = 1
+		sqe.user_data = index
+		self._sqArray[slot] = slot
+		self._sqTail.value = (tail + 1) & 0xFFFFFFFF
+		self._pending += 1
+
+	def _Harvest(self):
+		head = self._cqHead.value
+		tail = self._cqTail.value
+		done = []
+		while head != tail:
+			cqe = self._cqes[head & self._cqMask]
+			done.append((cqe.user_data, cqe.res))
+			head = (head + 1) & 0xFFFFFFFF
+		self._cqHead.value = head
+		return done
+
+	def _Reap(self, wait):
+		done = self._Harvest()
+		if self._pending == 0 and len(done) >= wait:
+			return done
+		need = max(0, wait - len(done))
+		while True:
+			result = _Syscall("io_uring_enter", self._ring, self._pending, need, _IORING_ENTER_GETEVENTS if need > 0 else 0, None, 0)
+			if result != -errno.EINTR:
+				break
+		if result < 0:
+			raise Exception('io_uring_enter failure. errno: %d (%s)' % (-result, errno.errorcode.get(-result, "?")))
+		self._pending -= result
+		return done + self._Harvest()
+
+	def _Close(self):
+		self._Unmap()
+		os.close(self._ring)
+
+	@staticmethod
+	def Available():
+		params = _UringParams()
+		ring = _Syscall("io_uring_setup", 1, ctypes.byref(params))
+		if ring < 0:
+			return False
+		os.close(ring)
+		return True
+
+# preferred first, Create falls back down the list
+engines = collections.OrderedDict([
+	("uring", UringEngine),
+	("libaio", AioEngine),
+	("direct", DirectEngine),
+	])
+
+names = list(engines) + ["auto"]
+
+_available = {}
+
+def Available(name):
+	if name not in _available:
+		_available[name] = engines[name].Available()
+	return _available[name]
+
+"""
+	Open path with the named engine, "auto" for the best one. An engine
+	the kernel does not offer is replaced with the next one in the list
+"""
+def Create(path, name="auto", depth=1, blocksize=1024 * 1024, write=False):
+	order = list(engines)
+	for candidate in order[0 if name == "auto" else order.index(name):]:
+		if Available(candidate):
+			return engines[candidate](path, depth, blocksize, write)
+	raise Exception("No IO engine available")
+
+"""
+	Keep every buffer of the engine busy with jobs, an iterable of
+	(offset, length). Yield (offset, view, result, seconds) in completion
+	order: view holds the data and is valid until the next item is asked
+	for, result is the byte count or -errno, seconds the time since the
+	transfer was queued. For writes fill(offset, view) provides the data
+"""
+def Stream(engine, jobs, write=False, fill=None):
+	jobs = iter(jobs)
+	free = list(range(engine.depth - 1, -1, -1))
+	started = {}
+	more = True
+	while True:
+		while more and len(free) > 0:
+			try:
+				offset, length = next(jobs)
+			except StopIteration:
+				more = False
+				break
+			index = free.pop()
+			if write:
+				fill(offset, engine.Buffer(index, length))
+			started[index] = (offset, length, time.perf_counter())
+			engine.Submit(index, offset, length, write)
+		if len(engine.inflight) == 0:
+			return
+		for index, result in engine.Reap(1):
+			offset, length, start = started.pop(index)
+			view = engine.Buffer(index, length)
+			try:
+				yield offset, view, result, time.perf_counter() - start
+			finally:
+				view.release()
+			free.append(index)
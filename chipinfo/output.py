@@ -0,0 +1,163 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+# Report writers
+# A report is a list of (key, value) or (key, value, format) tuples
+# Text output is for humans, JSON Lines and CSV keep the raw typed values
+# and are written one device at a time, as soon as its report is ready
+
+import sys
+import json
+import csv
+import flash
+import benchmark
+import surface
+
+formats = ["text", "jsonl", "csv"]
+
+# Progress line of long operations (surface scan), on stderr
+def PrintProgress(done, total, rate):
+	print("\r%d/%d KiB, %.1f KiB/s "%(done // 1024, total // 1024, rate / 1024), end="" if done < total else "\n", flush=True, file=sys.stderr)
+
+def FormatValue(value, format):
+	if value == None:
+		return "Unavailable"
+
+	if format == "X":
+		return "%X"%value
+	if format == "size":
+		return "%d byte(s)"%value
+	if format == "fid":
+		return flash.GetFlashInfo(value)
+	if format == "bench":
+		return benchmark.FormatResult(value)
+	if format == "scan":
+		return surface.FormatResult(value)
+	if format == "profile":
+		return surface.FormatProfile(value)
+
+	return value
+
+# Value as plain JSON data: numbers stay numbers, raw bytes become hex
+def RawValue(value):
+	if value == None or isinstance(value, (bool, int, float, str)):
+		return value
+	if isinstance(value, (bytes, bytearray, memoryview)):
+		return bytes(value).hex().upper()
+	if isinstance(value, dict):
+		return dict((k, RawValue(v)) for k, v in value.items())
+	if isinstance(value, (list, tuple)):
+		return [RawValue(v) for v in value]
+	return str(value)
+
+"""
+	Aligned "key: value" text, same as printed on screen
+"""
+class TextWriter:
+	def __init__(self, f, header=None):
+		self.f = f
+		self.header = header
+		self.count = 0
+
+	def Write(self, report):
+		rawreport = []
+		for entry in report:
+			key = entry[0]
+			# key = Translate(key)
+			value = FormatValue(entry[1], entry[2]) if len(entry) > 2 else entry[1]
+			rawreport.append((key, value))
+
+		keywidth = 0
+		for entry in rawreport:
+			keywidth = max(keywidth, len(entry[0]))
+
+		lines = []
+		if self.count == 0 and self.header != None:
+			lines.append(self.header)
+		elif self.count > 0:
+			lines.append("")
+		for key, value in rawreport:
+			lines.append("{key:{kw}}: {value}".format(key=key, kw=keywidth, value=value))
+		self.f.write("\n".join(lines) + "\n")
+		self.f.flush()
+		self.count += 1
+
+"""
+	One JSON object per device and line. Repeated keys are collected
+	into a list, formats go to "_formats" so values can be decoded later
+"""
+class JsonlWriter:
+	def __init__(self, f, header=None):
+		self.f = f
+
+	def Write(self, report):
+		record = {}
+		formats = {}
+		repeated = set()
+		for entry in report:
+			key = entry[0]
+			value = RawValue(entry[1])
+			if key in repeated:
+				record[key].append(value)
+			elif key in record:
+				record[key] = [record[key], value]
+				repeated.add(key)
+			else:
+				record[key] = value
+			if len(entry) > 2:
+				formats[key] = entry[2]
+		if len(formats) > 0:
+			record["_formats"] = formats
+		self.f.write(json.dumps(record) + "\n")
+		self.f.flush()
+
+"""
+	Long format CSV, one row per report entry: device, key, value, format
+	Structured values (benchmark results) are stored as JSON
+"""
+class CsvWriter:
+	def __init__(self, f, header=None):
+		self.f = f
+		self.csv = csv.writer(f, lineterminator="\n")
+		self.csv.writerow(["device", "key", "value", "format"])
+
+	def Write(self, report):
+		device = report[0][1] if len(report) > 0 and report[0][0] == "Device" else ""
+		for entry in report:
+			value = RawValue(entry[1])
+			if isinstance(value, (dict, list)):
+				value = json.dumps(value)
+			self.csv.writerow([device, entry[0], "" if value == None else value, entry[2] if len(entry) > 2 else ""])
+		self.f.flush()
+
+writers = {
+	"text": TextWriter,
+	"jsonl": JsonlWriter,
+	"csv": CsvWriter,
+	}
+
+def Writer(format, f, header=None):
+	return writers[format](f, header)
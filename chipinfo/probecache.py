@@ -0,0 +1,148 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+# Probe result cache
+# Controller reports are stored per device, keyed by a fingerprint of the
+# standard inquiry data, capacity, unit serial number and the plugin set.
+# Devices without a serial number are never cached: identical sticks of
+# one model would share an entry. Entries expire after ttl seconds and
+# the least recently used ones are dropped beyond maxEntries
+
+import time
+import hashlib
+import threading
+import cache
+import scsi
+
+ttl = 24 * 3600
+maxEntries = 1000
+enabled = True
+
+_name = "probes.json"
+_version = 2
+_lock = threading.Lock()
+_entries = None
+_dirty = False
+
+"""
+	Cache key for a device, None if it can not be identified reliably
+"""
+def Fingerprint(dctl, inquiry, capacity, plugins):
+	serial = scsi.SerialNumber(dctl)
+	if serial == None:
+		return None
+	h = hashlib.sha1()
+	h.update(bytes(inquiry))
+	h.update(b"%d\0"%capacity)
+	h.update(serial + b"\0")
+	h.update(",".join(sorted(plugins)).encode())
+	return h.hexdigest()
+
+# Report entries as JSON data, None if some value can not be stored
+def _Encode(entries):
+	result = []
+	for entry in entries:
+		value = entry[1]
+		if isinstance(value, (bytes, bytearray, memoryview)):
+			value = {"hex": bytes(value).hex()}
+		elif not (value == None or isinstance(value, (bool, int, float, str))):
+			return None
+		result.append([entry[0], value] + list(entry[2:]))
+	return result
+
+def _Decode(entries):
+	result = []
+	for entry in entries:
+		value = entry[1]
+		if isinstance(value, dict):
+			value = bytearray.fromhex(value["hex"])
+		result.append(tuple([entry[0], value] + entry[2:]))
+	return result
+
+def _Load():
+	global _entries
+	if _entries == None:
+		data = cache.LoadJson(_name)
+		if data == None or data.get("version") != _version:
+			data = {"entries": {}}
+		_entries = data["entries"]
+	return _entries
+
+def _Save():
+	global _dirty
+	cache.SaveJson(_name, {"version": _version, "entries": _entries})
+	_dirty = False
+
+"""
+	Cached report entries for key, None if missing or expired
+"""
+def Lookup(key):
+	global _dirty
+	if key == None:
+		return None
+	with _lock:
+		entries = _Load()
+		entry = entries.get(key)
+		if entry == None:
+			return None
+		now = time.time()
+		if now - entry["time"] > ttl:
+			del entries[key]
+			_Save()
+			return None
+		# saved by Flush, a hit alone is not worth a write
+		entry["used"] = now
+		_dirty = True
+		return _Decode(entry["report"])
+
+def Store(key, report):
+	if key == None:
+		return
+	report = _Encode(report)
+	if report == None:
+		return
+	with _lock:
+		entries = _Load()
+		now = time.time()
+		entries[key] = {"time": now, "used": now, "report": report}
+		for k in [k for k, e in entries.items() if now - e["time"] > ttl]:
+			del entries[k]
+		if len(entries) > maxEntries:
+			for k in sorted(entries, key=lambda k: entries[k]["used"])[:len(entries) - maxEntries]:
+				del entries[k]
+		_Save()
+
+# Save pending LRU updates
+def Flush():
+	with _lock:
+		if _dirty:
+			_Save()
+
+def Clear():
+	global _entries
+	with _lock:
+		_entries = {}
+		_Save()
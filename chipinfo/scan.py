@@ -0,0 +1,163 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+# Multi-device scan
+# Devices are probed concurrently by a pool of worker threads. Device
+# IO releases the GIL, so probes of different devices overlap.
+# A hung device can not be interrupted, so its worker is abandoned and
+# replaced to keep the rest of the batch going
+# The pool also serves the watch mode, which submits devices as they appear
+
+import time
+import threading
+import itertools
+import queue
+
+"""
+	Worker pool. probe(device) is called on worker threads and must
+	return a report list. Workers are daemon threads, so abandoned ones
+	do not keep the process alive. Devices can be submitted at any time,
+	at most workers probes run at once
+"""
+class Pool:
+	def __init__(self, probe, workers=8, timeout=None):
+		self.probe = probe
+		self.workers = max(1, workers)
+		self.timeout = timeout
+		self._jobs = queue.Queue()
+		self._done = queue.Queue()
+		self._lock = threading.Lock()
+		self._running = {}	# job id -> (device, start time)
+		self._ids = itertools.count()
+		self._alive = 0
+		self._stuck = 0
+		self._idle = 0
+		self.pending = 0
+
+	def _Spawn(self):
+		with self._lock:
+			self._alive += 1
+		thread = threading.Thread(target=self._Worker)
+		thread.daemon = True
+		thread.start()
+
+	def _Worker(self):
+		while True:
+			with self._lock:
+				self._idle += 1
+			job = self._jobs.get()
+			with self._lock:
+				self._idle -= 1
+			if job == None:
+				break
+			# jobs are told apart by id, the same device may be submitted
+			# again while an abandoned probe of it is still running
+			jobid, device = job
+			with self._lock:
+				self._running[jobid] = (device, time.monotonic())
+			try:
+				report = self.probe(device)
+			except Exception as e:
+				report = [("Device", device), ("Error", e)]
+			with self._lock:
+				started = self._running.pop(jobid, None)
+				if started == None:
+					self._stuck -= 1
+			# a late result of a timed out device is dropped
+			if started != None:
+				self._done.put((device, report))
+		with self._lock:
+			self._alive -= 1
+
+	def _Expired(self):
+		if self.timeout == None:
+			return []
+		now = time.monotonic()
+		with self._lock:
+			expired = [jobid for jobid, (d, t) in self._running.items() if now - t > self.timeout]
+			devices = [self._running.pop(jobid)[0] for jobid in expired]
+			self._stuck += len(expired)
+		return devices
+
+	# Start a worker if jobs are waiting and the limit allows
+	# Workers stuck with timed out devices do not count
+	def _Grow(self):
+		with self._lock:
+			spawn = self._jobs.qsize() > self._idle and self._alive - self._stuck < self.workers
+		if spawn:
+			self._Spawn()
+
+	# Queue a device for probing
+	def Submit(self, device):
+		self.pending += 1
+		self._jobs.put((next(self._ids), device))
+		self._Grow()
+
+	"""
+		Wait up to wait seconds for completed probes. Return a list of
+		(device, report), timed out devices get an error report
+	"""
+	def Collect(self, wait=0.1):
+		results = []
+		try:
+			results.append(self._done.get(timeout=wait) if wait > 0 else self._done.get_nowait())
+			while True:
+				results.append(self._done.get_nowait())
+		except queue.Empty:
+			pass
+		for device in self._Expired():
+			self._Grow()
+			results.append((device, [("Device", device), ("Error", "Timeout after %g s"%self.timeout)]))
+		self.pending -= len(results)
+		return results
+
+	# Stop all workers once they finish the queued work
+	def Close(self):
+		for i in range(self._alive):
+			self._jobs.put(None)
+
+	"""
+		Probe all devices. Yield (device, report) as soon as each one completes
+	"""
+	def Run(self, devices):
+		for device in dict.fromkeys(devices):
+			self.Submit(device)
+		while self.pending > 0:
+			for result in self.Collect():
+				yield result
+		self.Close()
+
+"""
+	Probe devices concurrently, return reports in the same order as devices
+"""
+def Scan(devices, probe, workers=8, timeout=None, callback=None):
+	devices = list(dict.fromkeys(devices))
+	results = {}
+	for device, report in Pool(probe, workers, timeout).Run(devices):
+		results[device] = report
+		if callback != None:
+			callback(device, report)
+	return [results[device] for device in devices]
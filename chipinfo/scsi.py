@@ -24,20 +24,250 @@
 # SOFTWARE.
 """
 
-import ioctl_win
+import sys
+import time
+import threading
+import collections
 
 # Platform-agnostic proxy methods
 
-ScsiRequest = ioctl_win.ScsiRequest
-GetCapacity = ioctl_win.GetCapacity
-Device = ioctl_win.DeviceIoControl
+if sys.platform == "win32":
+	import ioctl_win as _backend
+	Device = _backend.DeviceIoControl
+else:
+	import ioctl_linux as _backend
+	Device = _backend.SgDevice
+EnumerateDevices = _backend.EnumerateDevices
+
+# Device objects may implement their own transport (e.g. capture replay)
+# by providing ScsiRequest/GetCapacity/LastStatus methods. Others go to the backend
+
+"""
+	Send one request to the device's transport: no retries, no hooks.
+	For device wrappers (capture, cancellation) that pass requests on
+	and leave the retry policy to scsi.ScsiRequest on top of them
+"""
+def SendRequest(dctl, cdb, data, dataIn=True, mayFail=False, timeout=None):
+	if timeout == None:
+		timeout = defaultTimeout
+	request = getattr(dctl, "ScsiRequest", None)
+	if request != None:
+		return request(cdb, data, dataIn, mayFail, timeout)
+	return _backend.ScsiRequest(dctl, cdb, data, dataIn, mayFail, timeout)
+
+"""
+	Send a request, retrying failures the retry table allows. timeout
+	(seconds) overrides the per-command and default timeouts
+"""
+def ScsiRequest(dctl, cdb, data, dataIn=True, mayFail=False, timeout=None):
+	policy = _Policy(cdb)
+	if timeout == None:
+		timeout = policy.timeout if policy.timeout != None else defaultTimeout
+	attempt = 0
+	while True:
+		error = None
+		try:
+			if _hooks:
+				result = _InstrumentedRequest(dctl, cdb, data, dataIn, mayFail, timeout, attempt)
+			else:
+				result = SendRequest(dctl, cdb, data, dataIn, mayFail, timeout)
+			if result is not None:
+				return result
+		except Exception as e:
+			error = e
+
+		status, sense = _Status(dctl)
+		delay = _RetryDelay(policy.retries, status, sense, attempt)
+		if delay == None:
+			break
+		if delay > 0:
+			time.sleep(delay)
+		attempt += 1
+
+	if error != None:
+		if sense != None:
+			raise Exception("%s, %s"%(error, FormatSense(sense)))
+		raise error
+	return None
+
+def GetCapacity(dctl):
+	capacity = getattr(dctl, "GetCapacity", None)
+	if capacity != None:
+		return capacity()
+	return _backend.GetCapacity(dctl)
+
+# SCSI status and raw sense data of the last request sent to dctl
+def LastStatus(dctl):
+	status = getattr(dctl, "LastStatus", None)
+	if status != None:
+		return status()
+	return _backend.LastStatus(dctl)
+
+Sense = collections.namedtuple("Sense", "key asc ascq")
+
+senseKeys = {
+	0x0: "NO SENSE",
+	0x1: "RECOVERED ERROR",
+	0x2: "NOT READY",
+	0x3: "MEDIUM ERROR",
+	0x4: "HARDWARE ERROR",
+	0x5: "ILLEGAL REQUEST",
+	0x6: "UNIT ATTENTION",
+	0x7: "DATA PROTECT",
+	0x8: "BLANK CHECK",
+	0x9: "VENDOR SPECIFIC",
+	0xA: "COPY ABORTED",
+	0xB: "ABORTED COMMAND",
+	0xD: "VOLUME OVERFLOW",
+	0xE: "MISCOMPARE",
+	}
+
+# Sense key/ASC/ASCQ from fixed (0x70/0x71) or descriptor (0x72/0x73)
+# format sense data, None if there is none
+def DecodeSense(sense):
+	if sense == None or len(sense) < 4:
+		return None
+	code = sense[0] & 0x7F
+	if code in (0x70, 0x71) and len(sense) >= 14:
+		return Sense(sense[2] & 0x0F, sense[12], sense[13])
+	if code in (0x72, 0x73):
+		return Sense(sense[1] & 0x0F, sense[2], sense[3])
+	return None
+
+def FormatSense(sense):
+	return "%s (ASC/ASCQ %02X/%02X)"%(senseKeys.get(sense.key, "0x%X"%sense.key), sense.asc, sense.ascq)
+
+# Timeouts and retries
+# Failed requests are retried according to a retry table, which maps
+# (sense key, ASC) or sense key to (retries, first delay in seconds).
+# The delay doubles with every attempt. "busy" covers BUSY and TASK SET
+# FULL status, which come without sense data
+
+defaultTimeout = 5
+
+defaultRetries = {
+	0x6: (2, 0),			# UNIT ATTENTION, reported once after reset or media change
+	0x2: (4, 0.02),			# NOT READY
+	(0x2, 0x3A): (0, 0),	# NOT READY, medium not present
+	0xB: (2, 0.01),			# ABORTED COMMAND
+	"busy": (3, 0.02),
+	}
+
+CommandPolicy = collections.namedtuple("CommandPolicy", "timeout retries")
+
+_defaultPolicy = CommandPolicy(None, defaultRetries)
+
+# opcode or (opcode, second CDB byte) -> CommandPolicy
+commandPolicies = {}
+
+"""
+	Set timeout (seconds) and/or retry table for a command. command is
+	an opcode or (opcode, sub-command) for vendor commands. Unset values
+	fall back to the defaults
+"""
+def SetCommandPolicy(command, timeout=None, retries=None):
+	commandPolicies[command] = CommandPolicy(timeout, retries if retries != None else defaultRetries)
+
+def _Policy(cdb):
+	if commandPolicies:
+		policy = commandPolicies.get((cdb[0] & 0xFF, cdb[1] & 0xFF) if len(cdb) > 1 else None)
+		if policy == None:
+			policy = commandPolicies.get(cdb[0] & 0xFF)
+		if policy != None:
+			return policy
+	return _defaultPolicy
+
+# SCSI status and decoded sense of a failed request
+def _Status(dctl):
+	try:
+		status, sense = LastStatus(dctl)
+	except Exception:
+		return None, None
+	return status, DecodeSense(sense) if status == 2 else None
+
+# Delay before the next attempt, None if the failure is not retried
+def _RetryDelay(retries, status, sense, attempt):
+	if status in (0x08, 0x28):
+		rule = retries.get("busy")
+	elif sense != None:
+		rule = retries.get((sense.key, sense.asc))
+		if rule == None:
+			rule = retries.get(sense.key)
+	else:
+		return None
+	if rule == None or attempt >= rule[0]:
+		return None
+	return rule[1] * (1 << attempt)
+
+# Request instrumentation
+# Hooks are called after every request with a RequestInfo. Without hooks
+# requests take the plain path, so instrumentation costs nothing when off
+
+RequestInfo = collections.namedtuple("RequestInfo", "tag cdb length dataIn duration ok status sense attempt")
+
+_hooks = []
+_context = threading.local()
+
+def AddHook(hook):
+	_hooks.append(hook)
+
+def RemoveHook(hook):
+	if hook in _hooks:
+		_hooks.remove(hook)
+
+# Tag of requests sent by the current thread, the plugin name during detection
+def CurrentTag():
+	return getattr(_context, "tag", None)
+
+"""
+	Tag requests issued inside the with block
+"""
+class Context:
+	def __init__(self, tag):
+		self.tag = tag
+
+	def __enter__(self):
+		self.previous = CurrentTag()
+		_context.tag = self.tag
+		return self
+
+	def __exit__(self, typ, val, tb):
+		_context.tag = self.previous
+
+def _Length(data):
+	if isinstance(data, int):
+		return data
+	if isinstance(data, list):
+		return len(data)
+	return memoryview(data).nbytes
+
+def _InstrumentedRequest(dctl, cdb, data, dataIn, mayFail, timeout, attempt):
+	error = None
+	result = None
+	start = time.perf_counter()
+	try:
+		result = SendRequest(dctl, cdb, data, dataIn, mayFail, timeout)
+	except Exception as e:
+		error = e
+	duration = time.perf_counter() - start
+
+	ok = error == None and result is not None
+	status, sense = _Status(dctl) if not ok else (0, None)
+	cdbBytes = bytes(x & 0xFF for x in cdb) if isinstance(cdb, list) else bytes(cdb)
+	info = RequestInfo(CurrentTag(), cdbBytes, _Length(data), dataIn, duration, ok, status, sense, attempt)
+	for hook in list(_hooks):
+		hook(info)
+
+	if error != None:
+		raise error
+	return result
 
 # CDB helper class
 class CDB:
 	def __init__(self, size=16, cdb=[]):
-		self.cdb = [0] * size
+		self.cdb = bytearray(size)
 		for i in range(min(len(cdb), size)):
-			self.cdb[i] = cdb[i]
+			self.cdb[i] = cdb[i] & 255
 
 	def Put(self, offset, value, size=0, little=True):
 		if size == 0:
@@ -84,39 +314,41 @@ class CDB:
 
 	@property
 	def data(self):
-		#return bytes(self.cdb)
-		return self.cdb
+		return bytes(self.cdb)
 
 # Standard SCSI operations
+# Data buffers are bytearrays, parse them with struct.unpack_from
+
+# Standard inquiry data, or the given VPD page
+def Inquiry(dctl, page=0, size=0x38, mayFail=False):
+	cdb = CDB(12, [0x12]).PB(4, size)
+	if page != 0:
+		cdb.PB(1, 1).PB(2, page)
+	data = bytearray(size)
+	return ScsiRequest(dctl, cdb.data, data, mayFail=mayFail)
+
+# Unit serial number (VPD page 0x80), None if the device has none
+def SerialNumber(dctl):
+	data = Inquiry(dctl, 0x80, 0xFF, mayFail=True)
+	if data == None or data[1] != 0x80:
+		return None
+	serial = bytes(data[4:4 + data[3]]).strip(b" \0")
+	return serial if len(serial) > 0 else None
+
+# If data buffer is given, read into it instead of allocating a new one
+# READ/WRITE(10) reach 2 TiB and 65535 blocks per command, (16) the rest
+def _TransferCdb(op10, op16, lba, count):
+	if lba + count > 0xFFFFFFFF or count > 0xFFFF:
+		return CDB(16, [op16]).Put(2, lba, 8, False).PDB(10, count)
+	return CDB(12, [op10]).PDB(2, lba).PWB(7, count)
 
-def Inquiry(dctl, page=0, size=0x38):
-	cdb = [0] * 12
-	cdb[0] = 0x12
-	cdb[4] = size & 0xFF
-	data = [0] * (size)
-	return ScsiRequest(dctl, cdb, data)
-
-
-def ReadSectors(dctl, lba, count):
-	cdb = [0] * 12
-	cdb[0] = 0x28
-	cdb[2] = (lba >> 24) & 0xFF
-	cdb[3] = (lba >> 16) & 0xFF
-	cdb[4] = (lba >> 8) & 0xFF
-	cdb[5] = lba & 0xFF
-	cdb[7] = (count >> 8) & 0xFF
-	cdb[8] = count & 0xFF
-	data = [0] * (count * 512)
-	return ScsiRequest(dctl, cdb, data)
+def ReadSectors(dctl, lba, count, data=None):
+	cdb = _TransferCdb(0x28, 0x88, lba, count)
+	if data == None:
+		data = bytearray(count * 512)
+	return ScsiRequest(dctl, cdb.data, data)
 
 def WriteSectors(dctl, lba, data):
-	count = len(data) / 512
-	cdb = [0] * 12
-	cdb[0] = 0x2A
-	cdb[2] = (lba >> 24) & 0xFF
-	cdb[3] = (lba >> 16) & 0xFF
-	cdb[4] = (lba >> 8) & 0xFF
-	cdb[5] = lba & 0xFF
-	cdb[7] = (count >> 8) & 0xFF
-	cdb[8] = count & 0xFF
-	return ScsiRequest(dctl, cdb, data, dataIn=False)
+	count = len(data) // 512 if isinstance(data, list) else memoryview(data).nbytes // 512
+	cdb = _TransferCdb(0x2A, 0x8A, lba, count)
+	return ScsiRequest(dctl, cdb.data, data, dataIn=False)
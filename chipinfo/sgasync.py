@@ -0,0 +1,429 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+# Asynchronous sg transport (Linux)
+# Commands are queued to the kernel with write() of an sg_io_hdr on the sg
+# node and collected with read() once epoll reports the node readable (sg
+# v3 interface). One engine thread harvests completions of any number of
+# devices in order of arrival, Submit() returns a Future right away.
+# Device wraps an endpoint for scsi.ScsiRequest, so plugins run on top of
+# it unchanged. Regular files get an emulated endpoint
+#
+#	engine = sgasync.Engine()
+#	endpoints = [sgasync.Endpoint(path) for path in paths]
+#	futures = [engine.Submit(ep, [0x12, 0, 0, 0, 36, 0], 36) for ep in endpoints]
+#	for f in concurrent.futures.as_completed(futures):
+#		...	f.result().data, or await asyncio.wrap_future(f)
+
+import os
+import stat
+import time
+import struct
+import errno
+import heapq
+import select
+import ctypes
+import threading
+import collections
+import concurrent.futures
+import ioctl_linux
+import sysfs
+
+SG_IO_HDR = ioctl_linux.SG_IO_HDR
+SenseLength = ioctl_linux.SenseLength
+SG_INFO_CHECK = 0x1
+
+# sg driver limit of commands queued per file descriptor
+defaultDepth = 16
+
+"""
+	One command. Owns the sg_io_hdr, CDB, sense and data buffer until the
+	kernel is done with them
+"""
+class Request:
+	def __init__(self, cdb, data, dataIn=True, timeout=5):
+		cdb = bytes(x & 0xFF for x in cdb) if isinstance(cdb, list) else bytes(cdb)
+		self.cdblen = min(len(cdb), 16)
+		self.cdb = (ctypes.c_ubyte * 16)(*cdb[:self.cdblen])
+		self.sense = (ctypes.c_ubyte * SenseLength)()
+		self.dataIn = dataIn
+		self.timeout = timeout
+		self.future = concurrent.futures.Future()
+		self.endpoint = None
+		self.status = None
+		self.ok = False
+
+		self._list = data if isinstance(data, list) else None
+		if isinstance(data, int):
+			self.buffer = bytearray(data)
+		elif isinstance(data, list):
+			self.buffer = bytearray(len(data)) if dataIn else bytearray(x & 0xFF for x in data)
+		elif memoryview(data).readonly:
+			self.buffer = bytearray(data)
+		else:
+			self.buffer = data
+		self.length = memoryview(self.buffer).nbytes
+		self.data = self.buffer if self._list == None else data
+
+	def Header(self, packid):
+		hdr = SG_IO_HDR()
+		hdr.interface_id = ord('S')
+		hdr.cmd_len = self.cdblen
+		hdr.cmdp = ctypes.addressof(self.cdb)
+		hdr.mx_sb_len = SenseLength
+		hdr.sbp = ctypes.addressof(self.sense)
+		hdr.dxfer_len = self.length
+		if self.length > 0:
+			self._anchor = ctypes.c_char.from_buffer(self.buffer)
+			hdr.dxferp = ctypes.addressof(self._anchor)
+			hdr.dxfer_direction = ioctl_linux.SG_DXFER_FROM_DEV if self.dataIn else ioctl_linux.SG_DXFER_TO_DEV
+		else:
+			hdr.dxfer_direction = ioctl_linux.SG_DXFER_NONE
+		hdr.timeout = int(self.timeout * 1000)
+		hdr.pack_id = packid
+		self.hdr = hdr
+		return hdr
+
+	def Finish(self, hdr):
+		self._anchor = None
+		self.status = hdr.status
+		self.ok = (hdr.info & SG_INFO_CHECK) == 0
+		# caller buffers may be reused, clear what a short transfer did not reach
+		if self.dataIn and 0 < hdr.resid <= self.length:
+			memoryview(self.buffer).cast('B')[self.length - hdr.resid:self.length] = bytes(hdr.resid)
+		if self._list != None and self.dataIn:
+			self._list[:] = self.buffer
+		self.future.set_result(self)
+
+	def Fail(self, error):
+		self._anchor = None
+		self.future.set_exception(error)
+
+	def Sense(self):
+		return bytes(self.sense)
+
+"""
+	sg node opened for asynchronous use
+"""
+class SgEndpoint:
+	emulated = False
+
+	def __init__(self, path, depth=defaultDepth):
+		try:
+			self.fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+		except OSError as e:
+			raise Exception('Failed to open %s. errno: %d' % (path, e.errno))
+		self.path = path
+		self.depth = depth
+
+	def fileno(self):
+		return self.fd
+
+	def Send(self, request):
+		hdr = request.hdr
+		os.write(self.fd, ctypes.string_at(ctypes.addressof(hdr), ctypes.sizeof(hdr)))
+
+	# Next completed header, BlockingIOError if there is none
+	def Receive(self):
+		return SG_IO_HDR.from_buffer_copy(os.read(self.fd, ctypes.sizeof(SG_IO_HDR)))
+
+	def Close(self):
+		os.close(self.fd)
+
+"""
+	Completion delay for emulated endpoints, one thread for all of them
+"""
+class _Clock:
+	def __init__(self):
+		self._heap = []
+		self._cond = threading.Condition()
+		self._count = 0
+		self._thread = None
+
+	def Schedule(self, delay, action):
+		with self._cond:
+			if self._thread == None:
+				self._thread = threading.Thread(target=self._Run, name="chipinfo-sgclock", daemon=True)
+				self._thread.start()
+			self._count += 1
+			heapq.heappush(self._heap, (time.monotonic() + delay, self._count, action))
+			self._cond.notify()
+
+	def _Run(self):
+		while True:
+			with self._cond:
+				while len(self._heap) == 0 or self._heap[0][0] > time.monotonic():
+					self._cond.wait(self._heap[0][0] - time.monotonic() if len(self._heap) > 0 else None)
+				action = heapq.heappop(self._heap)[2]
+			action()
+
+_clock = _Clock()
+
+"""
+	Regular file as an sg endpoint, using the SG_IO emulation. Commands
+	complete after latency seconds, a pipe signals completions to epoll
+"""
+class EmulatedEndpoint:
+	emulated = True
+
+	def __init__(self, path, depth=defaultDepth, latency=0):
+		try:
+			self.fd = os.open(path, os.O_RDWR)
+		except OSError as e:
+			raise Exception('Failed to open %s. errno: %d' % (path, e.errno))
+		self.path = path
+		self.depth = depth
+		self.latency = latency
+		self._signal, self._notify = os.pipe()
+		os.set_blocking(self._signal, False)
+		self._done = collections.deque()
+
+	def fileno(self):
+		return self._signal
+
+	def Send(self, request):
+		# _Emulate takes the request itself as the device: cdb, sense, fd
+		request.fd = self.fd
+		status = ioctl_linux._Emulate(request, request.buffer, request.length, request.dataIn)
+		hdr = SG_IO_HDR()
+		hdr.pack_id = request.hdr.pack_id
+		hdr.status = status
+		hdr.info = SG_INFO_CHECK if status != 0 else 0
+		hdr.sb_len_wr = SenseLength if status != 0 else 0
+		if self.latency > 0:
+			_clock.Schedule(self.latency, lambda: self._Complete(hdr))
+		else:
+			self._Complete(hdr)
+
+	def _Complete(self, hdr):
+		self._done.append(hdr)
+		try:
+			os.write(self._notify, b"\0")
+		except OSError:
+			pass	# closed before the command completed
+
+	def Receive(self):
+		os.read(self._signal, 1)
+		return self._done.popleft()
+
+	def Close(self):
+		os.close(self.fd)
+		os.close(self._signal)
+		os.close(self._notify)
+
+"""
+	Endpoint for a device path: sg nodes as they are, disks through their
+	sg node, regular files emulated
+"""
+def Endpoint(path, depth=defaultDepth, latency=0):
+	mode = os.stat(path).st_mode
+	if stat.S_ISREG(mode):
+		return EmulatedEndpoint(path, depth, latency)
+	if stat.S_ISBLK(mode):
+		disk = sysfs.Find(path)
+		if disk == None or disk.sg == None:
+			raise Exception('No sg node for %s' % path)
+		path = disk.sg
+	return SgEndpoint(path, depth)
+
+"""
+	Submission and completion of commands on any number of endpoints.
+	Submit() may be called from any thread, completions are handled by
+	the engine thread. Futures are completed outside of the engine lock,
+	their callbacks may submit further commands
+"""
+class Engine:
+	def __init__(self):
+		self._epoll = select.epoll()
+		self._lock = threading.Lock()
+		self._requests = {}
+		self._endpoints = {}
+		self._next = 0
+		self._wake, self._stop = os.pipe()
+		self._epoll.register(self._wake, select.EPOLLIN)
+		self._thread = threading.Thread(target=self._Run, name="chipinfo-sg", daemon=True)
+		self._thread.start()
+
+	def Register(self, endpoint):
+		with self._lock:
+			if endpoint.fileno() in self._endpoints:
+				return
+			endpoint.inflight = 0
+			endpoint.backlog = collections.deque()
+			self._endpoints[endpoint.fileno()] = endpoint
+			self._epoll.register(endpoint.fileno(), select.EPOLLIN)
+
+	# Forget an endpoint, its unfinished commands fail
+	def Unregister(self, endpoint):
+		with self._lock:
+			if self._endpoints.pop(endpoint.fileno(), None) == None:
+				return
+			self._epoll.unregister(endpoint.fileno())
+			# backlogged requests are in _requests as well
+			orphans = [r for r in self._requests.values() if r.endpoint is endpoint]
+			for request in orphans:
+				self._requests.pop(request.hdr.pack_id, None)
+			endpoint.backlog.clear()
+		for request in orphans:
+			request.Fail(Exception('Device closed'))
+
+	def Submit(self, endpoint, cdb, data, dataIn=True, timeout=5):
+		if endpoint.fileno() not in self._endpoints:
+			self.Register(endpoint)
+		request = Request(cdb, data, dataIn, timeout)
+		request.endpoint = endpoint
+		failed = None
+		with self._lock:
+			self._next = self._next % 0x7FFFFFFF + 1
+			request.Header(self._next)
+			self._requests[self._next] = request
+			if endpoint.inflight < endpoint.depth:
+				failed = self._Send(request)
+			else:
+				endpoint.backlog.append(request)
+		if failed != None:
+			failed.Fail(failed.error)
+		return request.future
+
+	# Lock held. Return the request if sending failed for good
+	def _Send(self, request):
+		endpoint = request.endpoint
+		try:
+			endpoint.Send(request)
+		except OSError as e:
+			if e.errno in (errno.EAGAIN, errno.EDOM) and endpoint.inflight > 0:
+				endpoint.backlog.appendleft(request)
+				return None
+			self._requests.pop(request.hdr.pack_id, None)
+			request.error = Exception('SCSI request failure. errno: %d (%s)' % (e.errno, errno.errorcode.get(e.errno, "?")))
+			return request
+		endpoint.inflight += 1
+		return None
+
+	def _Run(self):
+		while True:
+			for fd, mask in self._epoll.poll():
+				if fd == self._wake:
+					return
+				with self._lock:
+					endpoint = self._endpoints.get(fd)
+				if endpoint != None:
+					self._Harvest(endpoint)
+
+	def _Harvest(self, endpoint):
+		while True:
+			try:
+				hdr = endpoint.Receive()
+			except OSError:
+				return
+			failed = []
+			with self._lock:
+				request = self._requests.pop(hdr.pack_id, None)
+				endpoint.inflight -= 1
+				while len(endpoint.backlog) > 0 and endpoint.inflight < endpoint.depth:
+					f = self._Send(endpoint.backlog.popleft())
+					if f != None:
+						failed.append(f)
+			if request != None:
+				request.Finish(hdr)
+			for f in failed:
+				f.Fail(f.error)
+
+	def Close(self):
+		os.write(self._stop, b"\0")
+		self._thread.join()
+		self._epoll.close()
+		os.close(self._wake)
+		os.close(self._stop)
+
+_default = None
+_defaultLock = threading.Lock()
+
+def DefaultEngine():
+	global _default
+	with _defaultLock:
+		if _default == None:
+			_default = Engine()
+		return _default
+
+"""
+	Device object for scsi.ScsiRequest on top of the engine. The calling
+	thread waits for its own command only, the engine keeps serving others
+"""
+class Device:
+	def __init__(self, path, engine=None, latency=0):
+		self.path = path
+		self.engine = engine if engine != None else DefaultEngine()
+		self.latency = latency
+		self.endpoint = None
+		self.status = 0
+		self.sense = bytes(SenseLength)
+
+	def __enter__(self):
+		self.endpoint = Endpoint(self.path, latency=self.latency)
+		self.engine.Register(self.endpoint)
+		return self
+
+	def __exit__(self, typ, val, tb):
+		if self.endpoint != None:
+			self.engine.Unregister(self.endpoint)
+			self.endpoint.Close()
+			self.endpoint = None
+
+	def ScsiRequest(self, cdb, data, dataIn=True, mayFail=False, timeout=5):
+		if self.endpoint == None:
+			raise Exception('No file handle')
+		# a submit that raises leaves no status of its own
+		self.status, self.sense = 0, bytes(SenseLength)
+		try:
+			request = self.engine.Submit(self.endpoint, cdb, data, dataIn, timeout).result()
+		except Exception:
+			if mayFail == False:
+				raise
+			return None
+		self.status, self.sense = request.status, request.Sense()
+		if request.ok:
+			return request.data if dataIn else True
+		if mayFail == False:
+			raise Exception('SCSI request failure. ScsiStatus: %d' % request.status)
+		return None
+
+	def GetCapacity(self):
+		if self.endpoint.emulated:
+			return os.fstat(self.endpoint.fd).st_size
+		data = self.ScsiRequest([0x25] + [0] * 9, 8, mayFail=True)
+		if data != None:
+			last, blocksize = struct.unpack_from(">II", data, 0)
+			if last != 0xFFFFFFFF:
+				return (last + 1) * blocksize
+		data = self.ScsiRequest([0x9E, 0x10] + [0] * 11 + [12, 0, 0], 12, mayFail=True)
+		if data != None:
+			last, blocksize = struct.unpack_from(">QI", data, 0)
+			return (last + 1) * blocksize
+		raise Exception('Unable to read capacity. ScsiStatus: %d' % self.status)
+
+	def LastStatus(self):
+		return self.status, self.sense
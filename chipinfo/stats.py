@@ -0,0 +1,108 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+# SCSI request statistics
+# Collected through scsi request hooks and grouped by plugin and command.
+# A command is the first two CDB bytes, which is the opcode and sub-command
+# for the vendor commands used by the plugins. Every retry attempt counts
+# as a request of its own
+
+import threading
+import collections
+import scsi
+
+"""
+	Counters for one plugin/command pair. Durations go to a log2
+	histogram of microseconds, so percentiles are upper bounds
+"""
+class Entry:
+	def __init__(self):
+		self.count = 0
+		self.errors = 0
+		self.retries = 0
+		self.total = 0.0
+		self.max = 0.0
+		self.bytes = 0
+		self.histogram = collections.Counter()
+		self.senses = collections.Counter()
+
+	def Add(self, info):
+		self.count += 1
+		if info.attempt > 0:
+			self.retries += 1
+		self.total += info.duration
+		self.max = max(self.max, info.duration)
+		self.histogram[int(info.duration * 1000000).bit_length()] += 1
+		if info.ok:
+			self.bytes += info.length
+		else:
+			self.errors += 1
+			if info.sense != None:
+				self.senses[info.sense] += 1
+
+	# Upper bound of the duration below which p percent of requests completed
+	def Percentile(self, p):
+		limit = self.count * p / 100.0
+		seen = 0
+		for bucket in sorted(self.histogram):
+			seen += self.histogram[bucket]
+			if seen >= limit:
+				return min((1 << bucket) / 1000000.0, self.max)
+		return self.max
+
+class Stats:
+	def __init__(self):
+		self.entries = {}
+		self._lock = threading.Lock()
+
+	def __call__(self, info):
+		key = (info.tag or "-", info.cdb[:2])
+		with self._lock:
+			entry = self.entries.get(key)
+			if entry == None:
+				entry = self.entries[key] = Entry()
+			entry.Add(info)
+
+	def Install(self):
+		scsi.AddHook(self)
+		return self
+
+	def Uninstall(self):
+		scsi.RemoveHook(self)
+
+	"""
+		Summary table, slowest plugin/command pairs (by total time) first
+	"""
+	def Summary(self):
+		with self._lock:
+			entries = sorted(self.entries.items(), key=lambda e: e[1].total, reverse=True)
+		lines = ["%-10s %-6s %6s %6s %7s %10s %9s %9s %9s %10s"%("Plugin", "Cmd", "Count", "Errors", "Retries", "Total ms", "Mean ms", "p99 ms", "Max ms", "Bytes")]
+		for (tag, cmd), e in entries:
+			lines.append("%-10s %-6s %6d %6d %7d %10.3f %9.3f %9.3f %9.3f %10d"%(tag, " ".join("%02X"%x for x in cmd), e.count, e.errors, e.retries,
+				e.total * 1000, e.total * 1000 / e.count, e.Percentile(99) * 1000, e.max * 1000, e.bytes))
+			for sense, count in e.senses.most_common():
+				lines.append("%-17s %6d x %s"%("", count, scsi.FormatSense(sense)))
+		return lines
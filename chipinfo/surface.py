@@ -0,0 +1,334 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+# Surface scan
+# The whole device is read front to back in large chunks, depth reads in
+# flight, each into its own page-aligned buffer: one thread per read for
+# the block and SCSI readers, a single thread for the IO engines. Wall
+# time per region gives a speed-vs-LBA profile, where fake capacity and
+# SLC cache cliffs show up.
+# Failed chunks are read again granule by granule to map unreadable ranges
+
+import mmap
+import time
+import threading
+import statistics
+import benchmark
+import ioengine
+import scsi
+
+SectorSize = benchmark.SectorSize
+
+# profile levels, lowest to highest speed
+_levels = " .:-=+*#%@"
+
+def AddParameters(parser):
+	group = parser.add_argument_group("Surface scan")
+	group.add_argument("--scan-mode", help="IO path: block device, SCSI commands or an IO engine (default: block)", choices=list(benchmark.readers) + ioengine.names, default="block")
+	group.add_argument("--scan-chunk", help="Read size, KiB (default: 1024)", type=int, default=1024)
+	group.add_argument("--scan-depth", help="Reads in flight (default: 2)", type=int, default=2)
+	group.add_argument("--scan-regions", help="Speed profile resolution (default: 64)", type=int, default=64)
+	group.add_argument("--scan-map", help="Write the unreadable chunk bitmap to a file", metavar="FILE")
+
+# Per worker statistics, merged once the scan is over
+class _Regions:
+	def __init__(self, count):
+		self.first = [None] * count
+		self.last = [0.0] * count
+		self.bytes = [0] * count
+		self.reads = [0] * count
+		self.latency = [0.0] * count
+		self.maxlatency = [0.0] * count
+		self.bad = []
+
+"""
+	One surface scan: depth workers read consecutive chunks until the end
+	of the device. Bad ranges are found with granularity bytes resolution
+"""
+class Scan:
+	def __init__(self, path, mode, capacity, chunk=1024 * 1024, depth=2, regions=64, granularity=4096):
+		self.path = path
+		self.mode = mode
+		self.capacity = capacity // SectorSize * SectorSize
+		self.granularity = granularity
+		self.chunk = max(granularity, chunk // granularity * granularity)
+		self.chunks = (self.capacity + self.chunk - 1) // self.chunk
+		self.depth = max(1, depth)
+		self.regions = max(1, min(regions, self.chunks))
+		self._lock = threading.Lock()
+		self._next = 0
+		self._done = 0
+		self._stop = False
+		self._error = None
+		self.engine = None
+
+	def _Region(self, index):
+		return index * self.regions // self.chunks
+
+	def _Worker(self, reader, stats):
+		with scsi.Context("Scan"):
+			buf = mmap.mmap(-1, self.chunk)
+			view = memoryview(buf)
+			try:
+				self._Loop(reader, view, stats)
+			except Exception as e:
+				self._error = e
+				self._stop = True
+			finally:
+				view.release()
+				buf.close()
+
+	def _Loop(self, reader, view, stats):
+		while True:
+			with self._lock:
+				index = self._next
+				if index >= self.chunks or self._stop:
+					return
+				self._next += 1
+			offset = index * self.chunk
+			size = min(self.chunk, self.capacity - offset)
+			start = time.perf_counter()
+			try:
+				reader.Read(offset, view[:size])
+				ok = True
+			except Exception:
+				ok = False
+			self._Account(stats, index, start, time.perf_counter(), size)
+			if not ok:
+				self._Locate(reader, offset, view[:size], stats.bad)
+			with self._lock:
+				self._done += size
+
+	def _Account(self, stats, index, start, end, size):
+		r = self._Region(index)
+		if stats.first[r] == None or start < stats.first[r]:
+			stats.first[r] = start
+		stats.last[r] = max(stats.last[r], end)
+		stats.bytes[r] += size
+		stats.reads[r] += 1
+		stats.latency[r] += end - start
+		stats.maxlatency[r] = max(stats.maxlatency[r], end - start)
+
+	# Read a failed chunk granule by granule, collect (offset, size) of failures
+	def _Locate(self, reader, offset, view, bad):
+		for pos in range(0, len(view), self.granularity):
+			part = view[pos:pos + self.granularity]
+			try:
+				reader.Read(offset + pos, part)
+			except Exception:
+				bad.append((offset + pos, len(part)))
+
+	# Whole scan through an IO engine from the calling thread, failed
+	# chunks are read again granule by granule once the pass is over
+	def _Stream(self, progress, start):
+		stats = _Regions(self.regions)
+		engine = ioengine.Create(self.path, self.mode, self.depth, self.chunk)
+		self.engine = engine.name
+		try:
+			failed = []
+			shown = start
+			jobs = ((i * self.chunk, min(self.chunk, self.capacity - i * self.chunk)) for i in range(self.chunks))
+			for offset, view, result, seconds in ioengine.Stream(engine, jobs):
+				end = time.perf_counter()
+				self._Account(stats, offset // self.chunk, end - seconds, end, len(view))
+				if result != len(view):
+					failed.append((offset, len(view)))
+				self._done += len(view)
+				if progress != None and end - shown >= 0.5:
+					shown = end
+					progress(self._done, self.capacity, self._done / (end - start))
+			granules = ((offset + pos, min(self.granularity, size - pos)) for offset, size in failed for pos in range(0, size, self.granularity))
+			for offset, view, result, seconds in ioengine.Stream(engine, granules):
+				if result != len(view):
+					stats.bad.append((offset, len(view)))
+		finally:
+			engine.Close()
+		return [stats]
+
+	"""
+		Scan the device. progress(done, total, rate) is called every half
+		second from the calling thread
+	"""
+	def Execute(self, progress=None):
+		if self.chunks == 0:
+			raise Exception("Device is empty")
+		if self.mode in ioengine.names:
+			start = time.perf_counter()
+			stats = self._Stream(progress, start)
+			return self._Merge(stats, time.perf_counter() - start)
+		readers = [benchmark.readers[self.mode](self.path) for i in range(self.depth)]
+		stats = [_Regions(self.regions) for i in range(self.depth)]
+		workers = [threading.Thread(target=self._Worker, args=(readers[i], stats[i])) for i in range(self.depth)]
+		start = time.perf_counter()
+		try:
+			for w in workers:
+				w.start()
+			for w in workers:
+				while w.is_alive():
+					w.join(0.5)
+					if progress != None:
+						elapsed = time.perf_counter() - start
+						progress(self._done, self.capacity, self._done / elapsed if elapsed > 0 else 0)
+		except BaseException:
+			self._stop = True
+			for w in workers:
+				w.join()
+			raise
+		finally:
+			for reader in readers:
+				reader.Close()
+		if self._error != None:
+			raise self._error
+		elapsed = time.perf_counter() - start
+		return self._Merge(stats, elapsed)
+
+	def _Merge(self, stats, elapsed):
+		profile = []
+		latency = []
+		maxlatency = []
+		for r in range(self.regions):
+			firsts = [s.first[r] for s in stats if s.first[r] != None]
+			wall = max(s.last[r] for s in stats) - min(firsts) if len(firsts) > 0 else 0
+			size = sum(s.bytes[r] for s in stats)
+			reads = sum(s.reads[r] for s in stats)
+			profile.append(size / wall / 1000000 if wall > 0 else 0)
+			latency.append(sum(s.latency[r] for s in stats) / reads if reads > 0 else 0)
+			maxlatency.append(max(s.maxlatency[r] for s in stats))
+
+		return {
+			"bytes": self._done,
+			"seconds": elapsed,
+			"mbps": self._done / elapsed / 1000000 if elapsed > 0 else 0,
+			"chunk": self.chunk,
+			"profile": profile,
+			"latency": latency,
+			"maxlatency": maxlatency,
+			"bad": MergeRanges(sum((s.bad for s in stats), [])),
+			"engine": self.engine,
+			}
+
+# Sorted (offset, size) list to sorted, merged (lba, sectors) ranges
+def MergeRanges(ranges):
+	result = []
+	for offset, size in sorted(ranges):
+		lba, count = offset // SectorSize, size // SectorSize
+		if len(result) > 0 and result[-1][0] + result[-1][1] >= lba:
+			last = result[-1]
+			result[-1] = (last[0], max(last[1], lba + count - last[0]))
+		else:
+			result.append((lba, count))
+	return result
+
+"""
+	Bad ranges as a bitmap, one bit per unit bytes, LSB first
+"""
+def Bitmap(bad, capacity, unit):
+	units = (capacity + unit - 1) // unit
+	bits = bytearray((units + 7) // 8)
+	for lba, count in bad:
+		first = lba * SectorSize // unit
+		last = ((lba + count) * SectorSize - 1) // unit
+		for i in range(first, last + 1):
+			bits[i >> 3] |= 1 << (i & 7)
+	return bytes(bits)
+
+"""
+	Lasting slowdown: split the profile where the two sides differ the
+	most (least squares), (region, speed before, speed after) if the median
+	speed before is at least ratio times the speed after, otherwise None.
+	A faster second part (e.g. a slow start) is not a cliff
+"""
+def FindCliff(profile, ratio=2.0):
+	n = len(profile)
+	total = sum(profile)
+	squares = sum(p * p for p in profile)
+	best = None
+	left = leftsq = 0.0
+	for i in range(1, n):
+		left += profile[i - 1]
+		leftsq += profile[i - 1] ** 2
+		right, rightsq = total - left, squares - leftsq
+		cost = leftsq - left * left / i + rightsq - right * right / (n - i)
+		if best == None or cost < best[0]:
+			best = (cost, i)
+	if best == None:
+		return None
+	i = best[1]
+	before = statistics.median(profile[:i])
+	after = statistics.median(profile[i:])
+	if min(before, after) <= 0 or before / after < ratio:
+		return None
+	return i, before, after
+
+def FormatResult(result):
+	profile = result["profile"]
+	text = "%.2f MB/s, regions %.2f..%.2f MB/s, latency avg/max %.3f/%.3f ms, %d bad sector(s)"%(
+		result["mbps"], min(profile), max(profile),
+		statistics.mean(result["latency"]) * 1000, max(result["maxlatency"]) * 1000,
+		sum(count for lba, count in result["bad"]))
+	if result.get("engine") != None:
+		text += " (%s)"%result["engine"]
+	return text
+
+# Speed profile as a row of characters, LBA 0 on the left
+def FormatProfile(profile):
+	top = max(profile) if len(profile) > 0 else 0
+	if top <= 0:
+		return "[%s]"%(" " * len(profile))
+	return "[%s] %.2f MB/s max"%("".join(_levels[min(len(_levels) - 1, int(p / top * len(_levels)))] for p in profile), top)
+
+def FormatRanges(bad, limit=8):
+	text = "LBA " + ", ".join("%d-%d"%(lba, lba + count - 1) for lba, count in bad[:limit])
+	if len(bad) > limit:
+		text += ", ... (%d ranges)"%len(bad)
+	return text
+
+"""
+	Scan the device and append results to the report
+"""
+def Surface(path, report, mode="block", chunk=1024 * 1024, depth=2, regions=64, mapfile=None, progress=None):
+	with scsi.Device(path) as dctl:
+		capacity = scsi.GetCapacity(dctl)
+
+	try:
+		result = Scan(path, mode, capacity, chunk, depth, regions).Execute(progress)
+	except Exception as e:
+		report.append(("Scan", e))
+		return report
+
+	report.append(("Scan result", result, "scan"))
+	report.append(("Scan profile", result["profile"], "profile"))
+	if len(result["bad"]) > 0:
+		report.append(("Scan bad ranges", FormatRanges(result["bad"])))
+	cliff = FindCliff(result["profile"])
+	if cliff != None:
+		region, before, after = cliff
+		report.append(("Scan warning", "Speed drops from %.2f to %.2f MB/s at %d%% of capacity"%(before, after, region * 100 // len(result["profile"]))))
+	if mapfile != None:
+		with open(mapfile, "wb") as f:
+			f.write(Bitmap(result["bad"], capacity, result["chunk"]))
+
+	return report
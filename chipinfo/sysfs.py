@@ -0,0 +1,188 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+# Linux disk enumeration from sysfs
+# /sys/block and /sys/bus/usb/devices are read once into a map of SCSI
+# disks: sg node, USB IDs, serial number, port path and link speed. No
+# device node is opened. Device arguments may select disks from the map:
+#	:VID:PID or :VID	USB IDs, hex
+#	@PORT				USB port path (2-1.3), glob patterns allowed
+#	#N					N-th disk
+#	/dev/sd? or sd*		glob over the disk nodes
+
+import os
+import fnmatch
+import threading
+import collections
+
+Disk = collections.namedtuple("Disk", "name node sg size removable vid pid serial port speed vendor product")
+
+_lock = threading.Lock()
+_disks = None
+_root = None
+
+def _Read(path):
+	try:
+		with open(path) as f:
+			return f.read().strip()
+	except OSError:
+		return None
+
+def _Int(text, base=10):
+	try:
+		return int(text, base)
+	except (TypeError, ValueError):
+		return None
+
+# USB device directories (not interfaces or root hubs) by real path
+def _UsbDevices(root):
+	base = os.path.join(root, "bus", "usb", "devices")
+	try:
+		names = os.listdir(base)
+	except OSError:
+		return {}
+	devices = {}
+	for name in names:
+		if ":" in name or name.startswith("usb"):
+			continue
+		devices[os.path.realpath(os.path.join(base, name))] = name
+	return devices
+
+def _Sg(device):
+	try:
+		names = os.listdir(os.path.join(device, "scsi_generic"))
+	except OSError:
+		return None
+	return "/dev/" + names[0] if len(names) > 0 else None
+
+def _Disk(root, name, usb):
+	block = os.path.join(root, "block", name)
+	sectors = _Int(_Read(os.path.join(block, "size")))
+	info = {
+		"name": name,
+		"node": "/dev/" + name,
+		"sg": _Sg(os.path.join(block, "device")),
+		"size": sectors * 512 if sectors != None else None,
+		"removable": _Read(os.path.join(block, "removable")) == "1",
+		"vid": None, "pid": None, "serial": None, "port": None, "speed": None, "vendor": None, "product": None,
+		}
+
+	# the USB device is the closest ancestor of the disk that is one
+	path = os.path.realpath(block)
+	while len(path) > len(os.path.realpath(root)):
+		port = usb.get(path)
+		if port != None:
+			info["vid"] = _Int(_Read(os.path.join(path, "idVendor")), 16)
+			info["pid"] = _Int(_Read(os.path.join(path, "idProduct")), 16)
+			info["serial"] = _Read(os.path.join(path, "serial"))
+			info["speed"] = _Int(_Read(os.path.join(path, "speed")))
+			info["vendor"] = _Read(os.path.join(path, "manufacturer"))
+			info["product"] = _Read(os.path.join(path, "product"))
+			info["port"] = port
+			break
+		path = os.path.dirname(path)
+	return Disk(**info)
+
+"""
+	Map of SCSI disks (sd*) by name. Built on first use, refresh=True
+	reads sysfs again
+"""
+def Disks(root="/sys", refresh=False):
+	global _disks, _root
+	with _lock:
+		if _disks == None or refresh or root != _root:
+			try:
+				names = sorted((n for n in os.listdir(os.path.join(root, "block")) if n.startswith("sd")), key=lambda n: (len(n), n))
+			except OSError:
+				names = []
+			usb = _UsbDevices(root) if len(names) > 0 else {}
+			_disks = collections.OrderedDict((n, _Disk(root, n, usb)) for n in names)
+			_root = root
+		return _disks
+
+# Disk by its block or sg node, None if unknown. A miss reads sysfs
+# again, the disk may have been plugged in since
+def Find(node, root="/sys"):
+	for refresh in (False, True):
+		for disk in Disks(root, refresh).values():
+			if node in (disk.node, disk.sg):
+				return disk
+	return None
+
+# Removable or USB attached: the disks -a and the device watch probe
+def IsRemovable(disk):
+	return disk.removable or disk.vid != None
+
+# (vid, pid) of a USB attached disk node, None otherwise
+def UsbId(node, root="/sys"):
+	if not node.startswith("/dev/"):
+		return None
+	disk = Find(node, root)
+	if disk == None or disk.vid == None:
+		return None
+	return disk.vid, disk.pid
+
+def Invalidate():
+	global _disks
+	with _lock:
+		_disks = None
+
+def IsSelector(text):
+	return text[:1] in (":", "@", "#") or any(c in text for c in "*?[")
+
+def _Match(selector, index, disk):
+	if selector.startswith(":"):
+		ids = selector[1:].split(":")
+		return disk.vid != None and disk.vid == _Int(ids[0], 16) and (len(ids) < 2 or ids[1] == "" or disk.pid == _Int(ids[1], 16))
+	if selector.startswith("@"):
+		return disk.port != None and fnmatch.fnmatchcase(disk.port, selector[1:])
+	if selector.startswith("#"):
+		return _Int(selector[1:]) == index
+	return fnmatch.fnmatchcase(disk.node, selector) or fnmatch.fnmatchcase(disk.name, selector)
+
+"""
+	Disks matching a selector, in name order
+"""
+def Select(selector, root="/sys"):
+	return [disk for index, disk in enumerate(Disks(root).values()) if _Match(selector, index, disk)]
+
+"""
+	Replace selectors in a list of device arguments with the device nodes
+	they match, anything else is kept as is. Return (devices, selectors
+	that matched nothing)
+"""
+def Expand(names, root="/sys"):
+	devices = []
+	unmatched = []
+	for name in names:
+		if not IsSelector(name):
+			devices.append(name)
+			continue
+		found = [disk.node for disk in Select(name, root)]
+		if len(found) == 0:
+			unmatched.append(name)
+		devices.extend(d for d in found if d not in devices)
+	return devices, unmatched
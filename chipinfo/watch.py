@@ -0,0 +1,145 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+# Device hot-plug watch
+# On Linux, kernel uevents are read from a netlink socket. Elsewhere, or
+# if netlink is not available, the device list is polled instead.
+# New devices go to a scan.Pool, reports are handed over as they complete
+
+import os
+import time
+import socket
+import select
+import scan
+import scsi
+import sysfs
+
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+
+"""
+	Kernel uevent listener. Reports whole-disk sd* block devices that are
+	removable or USB attached, the same ones the device list holds
+"""
+class NetlinkWatcher:
+	def __init__(self, root="/sys"):
+		self.root = root
+		self.known = set()
+		self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+		self.sock.bind((0, UEVENT_KERNEL_GROUP))
+
+	def _Parse(self, message):
+		fields = message.split(b"\0")
+		env = dict(f.split(b"=", 1) for f in fields[1:] if b"=" in f)
+		if env.get(b"SUBSYSTEM") != b"block" or env.get(b"DEVTYPE") != b"disk":
+			return None
+		name = env.get(b"DEVNAME", b"").decode()
+		if not name.startswith("sd"):
+			return None
+		action, node = env.get(b"ACTION", b"").decode(), "/dev/" + name
+		if action == "add":
+			disk = sysfs.Find(node, self.root)
+			if disk == None or not sysfs.IsRemovable(disk):
+				return None
+			self.known.add(node)
+		elif action == "remove":
+			if node not in self.known:
+				return None
+			self.known.discard(node)
+		return action, node
+
+	# Wait up to wait seconds, return a list of (action, device)
+	def Poll(self, wait):
+		events = []
+		while len(select.select([self.sock], [], [], wait)[0]) > 0:
+			event = self._Parse(self.sock.recv(65536))
+			if event != None:
+				events.append(event)
+			wait = 0
+		return events
+
+	def Close(self):
+		self.sock.close()
+
+"""
+	Fallback: compare the device list every interval seconds
+"""
+class PollingWatcher:
+	def __init__(self, interval=1.0):
+		self.interval = interval
+		self.known = set(scsi.EnumerateDevices())
+		self.next = time.monotonic() + interval
+
+	def Poll(self, wait):
+		now = time.monotonic()
+		if now < self.next:
+			time.sleep(min(wait, self.next - now))
+			return []
+		self.next = now + self.interval
+		current = set(scsi.EnumerateDevices())
+		events = [("add", d) for d in sorted(current - self.known)] + [("remove", d) for d in sorted(self.known - current)]
+		self.known = current
+		return events
+
+	def Close(self):
+		return
+
+def Watcher(interval=1.0):
+	try:
+		return NetlinkWatcher()
+	except (OSError, AttributeError):
+		return PollingWatcher(interval)
+
+# The kernel announces a disk before udev creates its device node
+def WaitForNode(path, wait=5.0):
+	deadline = time.monotonic() + wait
+	while not os.path.exists(path) and time.monotonic() < deadline:
+		time.sleep(0.05)
+
+"""
+	Watch for new devices until interrupted or stop() returns True.
+	probe(device) returns a report, callback(device, report) gets it.
+	event(action, device) is told about insertions and removals
+"""
+def Watch(probe, callback, workers=8, timeout=None, interval=1.0, event=None, stop=None, watcher=None):
+	if watcher == None:
+		watcher = Watcher(interval)
+	pool = scan.Pool(probe, workers, timeout)
+	active = set()
+	try:
+		while stop == None or not stop():
+			for action, device in watcher.Poll(0.1):
+				if event != None:
+					event(action, device)
+				if action == "add" and device not in active:
+					active.add(device)
+					pool.Submit(device)
+			for device, report in pool.Collect(0):
+				active.discard(device)
+				callback(device, report)
+	finally:
+		watcher.Close()
+		pool.Close()
@@ -0,0 +1,83 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+
+# Controller candidate selection as the number of plugins grows: the
+# signature index (controller.Candidates) against calling a Detect() per
+# plugin, which is what detection did before the index. Plugins are fakes
+# with one vendor tag each, and the device matches none of them
+#
+#	python tests/bench_index.py --plugins 3 30 300
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chipinfo"))
+
+import controller
+
+class FakePlugin:
+	def __init__(self, number):
+		self.tags = [(controller.VENDOR, b"VEND%04d"%number)]
+
+	def Signatures(self):
+		return self.tags
+
+	def Detect(self, dctl, inquiry):
+		return controller.MatchSignatures(inquiry, self.tags)
+
+inquiry = bytes(8) + b"Generic Flash Disk      8.07"
+
+def Measure(count, calls):
+	controller.plugins = dict(("fake%d"%i, FakePlugin(i)) for i in range(count))
+	controller._InvalidateIndex()
+	controller.Candidates(inquiry)
+
+	start = time.perf_counter()
+	for i in range(calls):
+		controller.Candidates(inquiry)
+	indexed = (time.perf_counter() - start) / calls
+
+	start = time.perf_counter()
+	for i in range(calls):
+		[pn for pn in controller.plugins if controller.plugins[pn].Detect(None, inquiry)]
+	polled = (time.perf_counter() - start) / calls
+	return indexed, polled
+
+def Main():
+	parser = argparse.ArgumentParser(description="Controller candidate selection cost")
+	parser.add_argument("--plugins", help="Plugin counts (default: 3 30 300)", type=int, nargs="+", default=[3, 30, 300])
+	parser.add_argument("--calls", help="Selections per plugin count (default: 2000)", type=int, default=2000)
+	args = parser.parse_args()
+
+	for count in args.plugins:
+		indexed, polled = Measure(count, args.calls)
+		print("%4d plugins: %6.1f us indexed, %7.1f us polled"%(count, indexed * 1e6, polled * 1e6))
+
+if __name__ == "__main__":
+	Main()
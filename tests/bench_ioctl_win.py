@@ -0,0 +1,79 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+
+# Per-call overhead of ioctl_win.ScsiRequest against the fake kernel32 of
+# fakewin.py, so it runs on any host. --compare DIR times another copy of
+# the module as well, e.g. an older one:
+#
+#	git show <commit>:chipinfo/ioctl_win.py > /tmp/old/ioctl_win.py
+#	python tests/bench_ioctl_win.py --compare /tmp/old
+#
+# Data is passed as a list of ints, the only form older versions take.
+# Those declare their structures with wintypes, whose DWORD is 64-bit off
+# Windows, so it is narrowed to the Windows size before they are imported
+
+import time
+import ctypes
+import argparse
+import ctypes.wintypes as wintypes
+
+import fakewin
+
+sizes = [36, 512, 9216]
+
+def Measure(module, calls):
+	dctl = module.DeviceIoControl("\\\\.\\PhysicalDrive9").__enter__()
+	results = []
+	for size in sizes:
+		data = [0] * size
+		cdb = [0x28, 0, 0, 0, 0, 0, 0, 0, max(1, size // 512), 0]
+		start = time.perf_counter()
+		for i in range(calls):
+			module.ScsiRequest(dctl, cdb, data)
+		results.append((time.perf_counter() - start) / calls)
+	return results
+
+def Main():
+	parser = argparse.ArgumentParser(description="ioctl_win.ScsiRequest per-call overhead")
+	parser.add_argument("--compare", help="Directory with another ioctl_win.py")
+	parser.add_argument("--calls", help="Calls per transfer size (default: 2000)", type=int, default=2000)
+	args = parser.parse_args()
+
+	current = Measure(fakewin.Import(fakewin.Kernel32()), args.calls)
+	other = None
+	if args.compare != None:
+		wintypes.DWORD = ctypes.c_uint32
+		other = Measure(fakewin.Import(fakewin.Kernel32(), args.compare), args.calls)
+
+	for i, size in enumerate(sizes):
+		if other != None:
+			print("%5d bytes: %7.1f us -> %7.1f us"%(size, other[i] * 1e6, current[i] * 1e6))
+		else:
+			print("%5d bytes: %7.1f us"%(size, current[i] * 1e6))
+
+if __name__ == "__main__":
+	Main()
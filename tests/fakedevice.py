@@ -0,0 +1,185 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+# Simulated counterfeit disk for tests
+# Reports sectors sectors, only real of them exist. What happens past the
+# real end depends on mode:
+#	wrap	the address wraps modulo real, as with missing address lines
+#	drop	writes are lost, reads return zeros
+#	reject	writes fail with CHECK CONDITION, reads return zeros
+# Sectors start out with contents made from their LBA, so a test can tell
+# whether everything was put back
+#
+# FakeController adds the INQUIRY data and vendor command responses of a
+# flash drive controller. Phison(), Smi() and Alcor() build the ones the
+# bundled plugins recognise, tests/mkcaptures.py records them
+
+import os
+import sys
+import struct
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chipinfo"))
+
+SectorSize = 512
+
+def Initial(lba):
+	return (b"ORIGINAL" + struct.pack("<Q", lba)) * (SectorSize // 16)
+
+class FakeDisk:
+	def __init__(self, sectors, real, mode="wrap"):
+		self.sectors = sectors
+		self.real = real
+		self.mode = mode
+		self.data = {}
+		self.status = 0
+		self.sense = b""
+		self.commands = 0
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, typ, val, tb):
+		return
+
+	# Physical sector of lba, None if there is none
+	def _Sector(self, lba):
+		if lba < self.real:
+			return lba
+		if self.mode == "wrap":
+			return lba % self.real
+		return None
+
+	def Read(self, lba):
+		sector = self._Sector(lba)
+		if sector == None:
+			return bytes(SectorSize)
+		return self.data.get(sector, Initial(sector))
+
+	def _Fail(self, mayFail, asc=0x21):
+		self.status = 2
+		self.sense = bytes([0x70, 0, 0x05, 0, 0, 0, 0, 10, 0, 0, 0, 0, asc, 0])
+		if mayFail:
+			return None
+		raise Exception("SCSI request failure. ScsiStatus: 2")
+
+	def ScsiRequest(self, cdb, data, dataIn=True, mayFail=False, timeout=None):
+		self.commands += 1
+		self.status = 0
+		self.sense = b""
+		cdb = bytes(x & 0xFF for x in cdb) if isinstance(cdb, list) else bytes(cdb)
+		if cdb[0] in (0x28, 0x2A):
+			lba = struct.unpack_from(">I", cdb, 2)[0]
+			count = struct.unpack_from(">H", cdb, 7)[0]
+		elif cdb[0] in (0x88, 0x8A):
+			lba = struct.unpack_from(">Q", cdb, 2)[0]
+			count = struct.unpack_from(">I", cdb, 10)[0]
+		else:
+			return self._Fail(mayFail, 0x20)	# invalid command opcode
+		if lba + count > self.sectors:
+			return self._Fail(mayFail)
+
+		view = memoryview(data).cast("B")
+		if cdb[0] in (0x28, 0x88):
+			for i in range(count):
+				view[i * SectorSize:(i + 1) * SectorSize] = self.Read(lba + i)
+			return data
+		for i in range(count):
+			sector = self._Sector(lba + i)
+			if sector == None:
+				if self.mode == "reject":
+					return self._Fail(mayFail)
+				continue
+			self.data[sector] = bytes(view[i * SectorSize:(i + 1) * SectorSize])
+		return True
+
+	def GetCapacity(self):
+		return self.sectors * SectorSize
+
+	def LastStatus(self):
+		return self.status, self.sense
+
+	# Sectors whose contents differ from what they started with
+	def Changed(self):
+		return sorted(sector for sector, data in self.data.items() if data != Initial(sector))
+
+class FakeController(FakeDisk):
+	def __init__(self, sectors, inquiry, responses):
+		FakeDisk.__init__(self, sectors, sectors)
+		self.inquiry = inquiry
+		# (opcode, second CDB byte) -> data-in payload
+		self.responses = responses
+
+	def ScsiRequest(self, cdb, data, dataIn=True, mayFail=False, timeout=None):
+		cdb = bytes(x & 0xFF for x in cdb) if isinstance(cdb, list) else bytes(cdb)
+		if cdb[0] == 0x12 and cdb[1] & 1 == 0:
+			payload = self.inquiry
+		else:
+			payload = self.responses.get((cdb[0], cdb[1]))
+			if payload == None:
+				return FakeDisk.ScsiRequest(self, cdb, data, dataIn, mayFail, timeout)
+		self.commands += 1
+		self.status = 0
+		self.sense = b""
+		if isinstance(data, int):
+			data = memoryview(bytearray(data))
+		view = memoryview(data).cast("B")
+		n = min(len(view), len(payload))
+		view[:n] = payload[:n]
+		view[n:] = bytes(len(view) - n)
+		return data
+
+def _Page(size, fields):
+	page = bytearray(size)
+	for offset, value in fields:
+		page[offset:offset + len(value)] = value
+	return bytes(page)
+
+# two CEs of Toshiba TC58NVG6D2G
+_flashIds = [(0, bytes.fromhex("98D794327656")), (16, bytes.fromhex("98D794327656"))]
+
+def _Inquiry(fields):
+	return _Page(36, [(0, bytes([0, 0x80, 6, 2, 31])), (8, b"Generic Flash Disk  8.07")] + fields)
+
+def Phison(sectors=1 << 24):
+	return FakeController(sectors, _Inquiry([(0x24, b"PMAP")]), {
+		(0x06, 0x05): _Page(528, [(0x17E, b"\x22\x51"), (0x1C6, b"\x0B"), (0x94, bytes([1, 0x10, 0x60, 19, 5, 17])), (512, b"IF")]),
+		(0x06, 0x56): _Page(512, _flashIds),
+		})
+
+def Smi(sectors=1 << 24):
+	return FakeController(sectors, _Inquiry([(5, b"smi")]), {
+		(0xF0, 0x2A): _Page(512, [(0x1AE, b"SM3257EN"), (0x190, b"ISP 12345 ")]),
+		(0xF0, 0x06): _Page(512, [(0x30 + offset, fid) for offset, fid in _flashIds]),
+		})
+
+def Alcor(sectors=1 << 24):
+	return FakeController(sectors, _Inquiry([(0x20, b"8.0")]), {
+		(0x9A, 0x00): _Page(512, [(4, b"\xCA\x03"), (0x2B, b"\xAA\x01")]),
+		(0xFA, 0x0E): _Page(512, [(4, b"\x12\x34\x56\x78"), (0xB, b"\x10")]),
+		(0xFA, 0x00): _Page(512, _flashIds),
+		})
+
+controllers = {"phison": Phison, "smi": Smi, "alcor": Alcor}
@@ -0,0 +1,102 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+
+# Fake kernel32, so ioctl_win can be imported and exercised on any host.
+# DeviceIoControl plays a SCSI device: INQUIRY returns 36 bytes, READ(10)
+# fills the transfer with 0xFF, WRITE(10) keeps the data, anything else
+# fails with CHECK CONDITION, ILLEGAL REQUEST sense
+
+import os
+import sys
+import types
+import ctypes
+import importlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chipinfo"))
+
+IOCTL_DISK_GET_DRIVE_GEOMETRY = 0x70000
+
+class Kernel32:
+	def __init__(self):
+		# (cdb, DataIn, DataTransferLength, TimeOutValue, DataBuffer, SPTD address)
+		self.requests = []
+		self.written = []
+
+	def DeviceIoControl(self, handle, ioctl, inbuf, insize, outbuf, outsize, returned, overlapped):
+		if ioctl == IOCTL_DISK_GET_DRIVE_GEOMETRY:
+			geometry = outbuf.contents
+			geometry.Cylinders, geometry.TracksPerCylinder, geometry.SectorsPerTrack, geometry.BytesPerSector = 1000, 255, 63, 512
+			return 1
+		sptd = inbuf.contents
+		cdb = bytes(sptd.Cdb)
+		# older versions declare DataBuffer as a typed pointer
+		address = ctypes.cast(sptd.DataBuffer, ctypes.c_void_p).value
+		self.requests.append((cdb, sptd.DataIn, sptd.DataTransferLength, sptd.TimeOutValue, address, ctypes.addressof(sptd)))
+		data = (ctypes.c_ubyte * sptd.DataTransferLength).from_address(address) if sptd.DataTransferLength > 0 else b""
+		if cdb[0] == 0x12:
+			data[:36] = b"\0\x80\x06\x02\x1f\0\0\0FAKEWIN Windows test disk   0001"[:36]
+		elif cdb[0] == 0x28:
+			ctypes.memset(data, 0xFF, len(data))
+		elif cdb[0] == 0x2A:
+			self.written.append(bytes(data))
+		else:
+			sptd.ScsiStatus = 2
+			sptd.Sense[:14] = [0x70, 0, 0x05, 0, 0, 0, 0, 10, 0, 0, 0, 0, 0x20, 0]
+		return 1
+
+	def Namespace(self):
+		# plain functions, ioctl_win sets argtypes/restype on them
+		return types.SimpleNamespace(
+			CreateFileW=lambda *args: 5,
+			CloseHandle=lambda handle: 1,
+			GetLastError=lambda: 0,
+			DeviceIoControl=lambda *args: self.DeviceIoControl(*args))
+
+"""
+	Import a fresh ioctl_win bound to kernel32. ctypes.windll is only
+	replaced for the import and the module is not left in sys.modules.
+	path selects another copy of the module, e.g. an older one to compare
+"""
+def Import(kernel32, path=None):
+	missing = object()
+	windll = getattr(ctypes, "windll", missing)
+	ctypes.windll = types.SimpleNamespace(kernel32=kernel32.Namespace())
+	saved = sys.modules.pop("ioctl_win", None)
+	if path != None:
+		sys.path.insert(0, path)
+	try:
+		return importlib.import_module("ioctl_win")
+	finally:
+		if path != None:
+			sys.path.remove(path)
+		sys.modules.pop("ioctl_win", None)
+		if saved != None:
+			sys.modules["ioctl_win"] = saved
+		if windll is missing:
+			del ctypes.windll
+		else:
+			ctypes.windll = windll
@@ -0,0 +1,53 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+
+# Record the capture fixtures in tests/captures: a probe of each simulated
+# controller in fakedevice.py, as the command line tool would run it
+#
+#	python tests/mkcaptures.py
+
+import os
+
+import fakedevice
+
+import capture
+import controller
+import devprobe
+import probecache
+
+def Record(name, filename):
+	with capture.RecordingDevice(fakedevice.controllers[name](), filename) as dctl:
+		return list(devprobe.ProbeDevice(dctl))
+
+if __name__ == "__main__":
+	probecache.enabled = False
+	controller.LoadPlugins()
+	folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "captures")
+	os.makedirs(folder, exist_ok=True)
+	for name in sorted(fakedevice.controllers):
+		report = Record(name, os.path.join(folder, name + ".cap"))
+		print("%s: %s"%(name, dict((entry[0], entry[1]) for entry in report)))
@@ -0,0 +1,68 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+# Alcor chip table lookup
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chipinfo"))
+
+import ctl_alcor
+
+class ChipTableTest(unittest.TestCase):
+	def test_keys_unique(self):
+		seen = {}
+		for chip in ctl_alcor.knownControllers:
+			key = (chip.Chip, chip.Rev, chip.Otp)
+			self.assertNotIn(key, seen, "%04X %s %s listed twice" % (chip.Chip, chip.Rev, chip.Otp))
+			seen[key] = chip
+
+	def test_every_entry_found(self):
+		for chip in ctl_alcor.knownControllers:
+			model, exact = ctl_alcor.LookupChip(chip.Chip, chip.Rev, chip.Otp)
+			self.assertIs(model, chip)
+			self.assertTrue(exact)
+
+	def test_otp_models_inexact_without_otp(self):
+		for chip in ctl_alcor.knownControllers:
+			if chip.Otp == None:
+				continue
+			model, exact = ctl_alcor.LookupChip(chip.Chip, chip.Rev)
+			self.assertEqual(model.Chip, chip.Chip)
+			self.assertFalse(exact)
+
+	def test_unknown_revision(self):
+		model, exact = ctl_alcor.LookupChip(0xF700, 0x42)
+		self.assertEqual(model.Chip, 0xF700)
+		self.assertFalse(exact)
+
+	def test_unknown_chip(self):
+		self.assertEqual(ctl_alcor.LookupChip(0x1234, 0), (None, False))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,150 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+
+# asyncio probes on replayed captures: timeout, cancellation and one
+# probe at a time per device
+
+import os
+import time
+import asyncio
+import threading
+import unittest
+
+import fakedevice
+
+import capture
+import devprobe
+import asyncprobe
+import probecache
+
+captures = os.path.join(os.path.dirname(os.path.abspath(__file__)), "captures")
+
+# Every command takes Delay seconds. The Alcor probe sends 6 of them
+Delay = 0.04
+
+"""
+	Replayed device taking Delay seconds per command. Counts commands and
+	open handles in a tracker shared by all opens of the device
+"""
+class SlowReplay(capture.ReplayDevice):
+	def __init__(self, filename, tracker):
+		capture.ReplayDevice.__init__(self, filename)
+		self.tracker = tracker
+
+	def __enter__(self):
+		with self.tracker.lock:
+			self.tracker.open += 1
+			self.tracker.peak = max(self.tracker.peak, self.tracker.open)
+		return capture.ReplayDevice.__enter__(self)
+
+	def __exit__(self, typ, val, tb):
+		with self.tracker.lock:
+			self.tracker.open -= 1
+
+	def ScsiRequest(self, cdb, data, dataIn=True, mayFail=False, timeout=5):
+		with self.tracker.lock:
+			self.tracker.requests += 1
+		time.sleep(Delay)
+		return capture.ReplayDevice.ScsiRequest(self, cdb, data, dataIn, mayFail, timeout)
+
+class Tracker:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.requests = 0
+		self.open = 0
+		self.peak = 0
+
+class ProberTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.enabled = probecache.enabled
+		probecache.enabled = False
+
+	@classmethod
+	def tearDownClass(cls):
+		probecache.enabled = cls.enabled
+
+	def setUp(self):
+		self.trackers = {}
+		self.prober = asyncprobe.Prober(workers=4, opener=self._Open)
+		self.path = os.path.join(captures, "alcor.cap")
+
+	def tearDown(self):
+		self.prober.Close()
+
+	def _Open(self, device):
+		return SlowReplay(device, self.trackers.setdefault(device, Tracker()))
+
+	# once the worker is done, no further command reaches the device
+	def _AssertStopped(self, tracker):
+		deadline = time.monotonic() + 5
+		while tracker.open > 0 and time.monotonic() < deadline:
+			time.sleep(0.01)
+		self.assertEqual(tracker.open, 0)
+		requests = tracker.requests
+		time.sleep(3 * Delay)
+		self.assertEqual(tracker.requests, requests)
+
+	def test_probe(self):
+		report = asyncio.run(self.prober.Probe(self.path))
+		with capture.ReplayDevice(self.path) as dctl:
+			self.assertEqual(report, [("Device", self.path)] + list(devprobe.ProbeDevice(dctl)))
+
+	def test_timeout(self):
+		with self.assertRaises(asyncio.TimeoutError):
+			asyncio.run(self.prober.Probe(self.path, timeout=3 * Delay))
+		tracker = self.trackers[self.path]
+		self._AssertStopped(tracker)
+		self.assertLess(tracker.requests, 6)
+
+	def test_cancel(self):
+		async def Cancel():
+			task = asyncio.ensure_future(self.prober.Probe(self.path))
+			await asyncio.sleep(2.5 * Delay)
+			task.cancel()
+			with self.assertRaises(asyncio.CancelledError):
+				await task
+		asyncio.run(Cancel())
+		tracker = self.trackers[self.path]
+		self._AssertStopped(tracker)
+		self.assertLess(tracker.requests, 6)
+
+	# the same device twice: the second probe waits for the first one;
+	# another device meanwhile runs in parallel
+	def test_one_probe_per_device(self):
+		other = os.path.join(captures, "smi.cap")
+		async def Run():
+			return await asyncio.gather(self.prober.Probe(self.path), self.prober.Probe(self.path), self.prober.Probe(other))
+		first, second, third = asyncio.run(Run())
+		self.assertEqual(first, second)
+		self.assertEqual(self.trackers[self.path].peak, 1)
+		self.assertEqual(self.trackers[other].peak, 1)
+		self.assertEqual(self.trackers[self.path].requests, 12)
+		self.assertIn(("Controller", "SMI SM3257EN"), [entry[:2] for entry in third])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,170 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+
+# Capture recording and replay
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import fakedevice
+import mkcaptures
+
+import scsi
+import capture
+import controller
+import devprobe
+import probecache
+
+captures = os.path.join(os.path.dirname(os.path.abspath(__file__)), "captures")
+
+# Fails the next failures requests with the given sense key and ASC
+class FlakyDisk(fakedevice.FakeDisk):
+	def __init__(self, sectors, key, asc, failures):
+		fakedevice.FakeDisk.__init__(self, sectors, sectors)
+		self.key = key
+		self.asc = asc
+		self.failures = failures
+
+	def ScsiRequest(self, cdb, data, dataIn=True, mayFail=False, timeout=None):
+		if self.failures > 0:
+			self.failures -= 1
+			self.status = 2
+			self.sense = bytes([0x70, 0, self.key, 0, 0, 0, 0, 10, 0, 0, 0, 0, self.asc, 0])
+			if mayFail:
+				return None
+			raise Exception("SCSI request failure. ScsiStatus: 2")
+		return fakedevice.FakeDisk.ScsiRequest(self, cdb, data, dataIn, mayFail, timeout)
+
+class CountingReplay(capture.ReplayDevice):
+	def __enter__(self):
+		self.requests = 0
+		return capture.ReplayDevice.__enter__(self)
+
+	def ScsiRequest(self, cdb, data, dataIn=True, mayFail=False, timeout=5):
+		self.requests += 1
+		return capture.ReplayDevice.ScsiRequest(self, cdb, data, dataIn, mayFail, timeout)
+
+class RoundTripTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, "session.cap")
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def test_round_trip(self):
+		with capture.RecordingDevice(fakedevice.FakeDisk(64, 64), self.path) as dctl:
+			capacity = scsi.GetCapacity(dctl)
+			scsi.WriteSectors(dctl, 3, b"\x3C" * 1024)
+			recorded = bytes(scsi.ReadSectors(dctl, 2, 4))
+			self.assertIsNone(scsi.ScsiRequest(dctl, scsi.CDB(12, [0xC6]).data, bytearray(16), mayFail=True))
+
+		records = capture.ReadCapture(self.path)
+		self.assertEqual([r.kind for r in records], [capture.KIND_CAPACITY] + [capture.KIND_SCSI] * 3)
+		failed = records[-1]
+		self.assertFalse(failed.ok)
+		self.assertEqual(failed.status, 2)
+		self.assertEqual(scsi.DecodeSense(failed.sense), (5, 0x20, 0))
+
+		with capture.ReplayDevice(self.path) as dctl:
+			self.assertEqual(scsi.GetCapacity(dctl), capacity)
+			self.assertTrue(scsi.WriteSectors(dctl, 3, b"\x3C" * 1024))
+			self.assertEqual(bytes(scsi.ReadSectors(dctl, 2, 4)), recorded)
+			self.assertIsNone(scsi.ScsiRequest(dctl, scsi.CDB(12, [0xC6]).data, bytearray(16), mayFail=True))
+			self.assertEqual(scsi.LastStatus(dctl), (2, failed.sense))
+			# never recorded
+			self.assertIsNone(scsi.ScsiRequest(dctl, scsi.CDB(12, [0xC7]).data, bytearray(16), mayFail=True))
+
+	# every attempt is recorded, the replayed sense drives the same retry
+	def test_replayed_retry(self):
+		with capture.RecordingDevice(FlakyDisk(64, 0x6, 0x28, 1), self.path) as dctl:
+			recorded = bytes(scsi.ReadSectors(dctl, 0, 1))
+		records = capture.ReadCapture(self.path)
+		self.assertEqual([(r.ok, r.status) for r in records], [(False, 2), (True, 0)])
+
+		with CountingReplay(self.path) as dctl:
+			self.assertEqual(bytes(scsi.ReadSectors(dctl, 0, 1)), recorded)
+			self.assertEqual(dctl.requests, 2)
+			self.assertEqual(scsi.LastStatus(dctl), (0, b""))
+
+	def test_replayed_failure(self):
+		# medium not present is not retried
+		with capture.RecordingDevice(FlakyDisk(64, 0x2, 0x3A, 1), self.path) as dctl:
+			with self.assertRaises(Exception):
+				scsi.ReadSectors(dctl, 0, 1)
+
+		with CountingReplay(self.path) as dctl:
+			with self.assertRaises(Exception) as raised:
+				scsi.ReadSectors(dctl, 0, 1)
+			self.assertEqual(dctl.requests, 1)
+			self.assertIn("NOT READY (ASC/ASCQ 3A/00)", str(raised.exception))
+
+class PluginReplayTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.enabled = probecache.enabled
+		probecache.enabled = False
+		if len(controller.plugins) == 0:
+			controller.LoadPlugins()
+
+	@classmethod
+	def tearDownClass(cls):
+		probecache.enabled = cls.enabled
+
+	def _Check(self, name, model):
+		with capture.ReplayDevice(os.path.join(captures, name + ".cap")) as dctl:
+			report = list(devprobe.ProbeDevice(dctl))
+		self.assertEqual(report, list(devprobe.ProbeDevice(fakedevice.controllers[name]())))
+		entries = dict((entry[0], entry[1]) for entry in report)
+		self.assertEqual(entries["Controller"], model)
+		self.assertEqual((entries["Flash CEs"], entries["Flash size"]), (2, 8 << 30))
+
+	def test_phison(self):
+		self._Check("phison", "Phison PS2251 (0x0B)")
+
+	def test_smi(self):
+		self._Check("smi", "SMI SM3257EN")
+
+	def test_alcor(self):
+		self._Check("alcor", "Alcor Micro AU6987 / AU6990 [CA03-10]")
+
+	def test_fixtures_current(self):
+		for name in fakedevice.controllers:
+			path = os.path.join(tempfile.mkdtemp(), name + ".cap")
+			try:
+				mkcaptures.Record(name, path)
+				fresh = [r._replace(latency=0) for r in capture.ReadCapture(path)]
+			finally:
+				shutil.rmtree(os.path.dirname(path))
+			# latencies differ between runs
+			fixture = [r._replace(latency=0) for r in capture.ReadCapture(os.path.join(captures, name + ".cap"))]
+			self.assertEqual(fresh, fixture, name)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,119 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+
+# Controller candidate selection from the signature and USB ID index
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chipinfo"))
+
+import controller
+
+class FakePlugin:
+	def __init__(self, vendor, vid=None):
+		self.vendor = vendor
+		self.vid = vid
+
+	def Signatures(self):
+		return [(controller.VENDOR, self.vendor)]
+
+	def UsbIds(self):
+		return [(self.vid, None)] if self.vid != None else []
+
+class PollingPlugin:
+	pass
+
+"""
+	Plugin dict running a function in another thread, and waiting for it,
+	whenever the building thread iterates over it after the first pass
+"""
+class Interleaved(dict):
+	def __init__(self, plugins, function):
+		dict.__init__(self, plugins)
+		self.function = function
+		self.builder = threading.get_ident()
+		self.passes = 0
+
+	def __iter__(self):
+		if threading.get_ident() != self.builder:
+			return dict.__iter__(self)
+		self.passes += 1
+		if self.passes > 1:
+			thread = threading.Thread(target=self.function)
+			thread.start()
+			thread.join()
+		return dict.__iter__(self)
+
+def Inquiry(vendor):
+	return bytes(8) + vendor.ljust(8) + b"Disk".ljust(16) + b"1.00"
+
+class CandidatesTest(unittest.TestCase):
+	def setUp(self):
+		self.saved = controller.plugins
+		controller.plugins = {}
+		controller.plugins["polled"] = PollingPlugin()
+		controller.plugins["b"] = FakePlugin(b"SAME", 0x1234)
+		controller.plugins["a"] = FakePlugin(b"SAME", 0x1234)
+		controller.plugins["c"] = FakePlugin(b"OTHER")
+		controller._InvalidateIndex()
+
+	def tearDown(self):
+		controller.plugins = self.saved
+		controller._InvalidateIndex()
+
+	def test_load_order(self):
+		self.assertEqual(controller.Candidates(Inquiry(b"SAME")), ["polled", "b", "a"])
+		self.assertEqual(controller.Candidates(Inquiry(b"OTHER")), ["polled", "c"])
+		self.assertEqual(controller.Candidates(Inquiry(b"NONE")), ["polled"])
+		self.assertEqual(controller.UsbCandidates(0x1234, 1), ["b", "a"])
+		self.assertEqual(controller.UsbCandidates(0x4321, 1), [])
+
+	def test_rebuilt_after_change(self):
+		self.assertEqual(controller.Candidates(Inquiry(b"NEW")), ["polled"])
+		controller.plugins["d"] = FakePlugin(b"NEW")
+		controller._InvalidateIndex()
+		self.assertEqual(controller.Candidates(Inquiry(b"NEW")), ["polled", "d"])
+
+	# another scan thread selects candidates while the index is being built
+	def test_select_during_build(self):
+		controller.Candidates(Inquiry(b"SAME"))
+		controller.plugins["d"] = FakePlugin(b"SAME")
+		controller._InvalidateIndex()
+		results = []
+		def Select():
+			results.append((controller.Candidates(Inquiry(b"SAME")), controller.UsbCandidates(0x1234, 1)))
+		controller.plugins = Interleaved(controller.plugins, Select)
+		controller.Candidates(Inquiry(b"OTHER"))
+		self.assertTrue(len(results) > 0)
+		for result in results:
+			self.assertEqual(result, (["polled", "b", "a", "d"], ["b", "a"]))
+
+if __name__ == "__main__":
+	unittest.main()
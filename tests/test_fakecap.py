@@ -0,0 +1,73 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+
+# Capacity check against simulated counterfeit disks
+
+import unittest
+
+import fakedevice
+import fakecap
+
+class VerifyTest(unittest.TestCase):
+	def _Verify(self, real, mode, sectors=1 << 20):
+		disk = fakedevice.FakeDisk(sectors, real, mode)
+		result = fakecap.Verify(disk, disk.GetCapacity())
+		# every sample written must have been put back
+		self.assertEqual(disk.Changed(), [])
+		self.assertEqual(result["unrestored"], [])
+		return result
+
+	def test_genuine(self):
+		result = self._Verify(1 << 20, "wrap")
+		self.assertEqual(result["bad"], [])
+		self.assertEqual(result["good"], 1 << 20)
+		self.assertIsNone(result["rejected"])
+
+	def test_wrap(self):
+		result = self._Verify(1 << 16, "wrap")
+		self.assertEqual(result["good"], 1 << 16)
+		self.assertEqual(result["bad"][0], 1 << 16)
+		self.assertTrue(len(result["wraps"]) > 0)
+		for lba, alias in result["wraps"].items():
+			self.assertEqual(alias, lba % (1 << 16))
+
+	def test_drop(self):
+		for real in (1 << 16, 50000):
+			result = self._Verify(real, "drop")
+			self.assertEqual(result["good"], real)
+			self.assertEqual(result["bad"][0], real)
+			self.assertIsNone(result["rejected"])
+
+	def test_reject(self):
+		for real in (1 << 16, 50000):
+			result = self._Verify(real, "reject")
+			self.assertEqual(result["good"], real)
+			self.assertEqual(result["bad"][0], real)
+			self.assertIsNotNone(result["rejected"])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,193 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+
+# Flash part database and ID decoding
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chipinfo"))
+
+import flash
+
+Header = "# id  part  nm  cell  page  ppb  planes  dies  gbit\n"
+
+def _Source(path, lines):
+	with open(path, "wt") as f:
+		f.write(Header + "".join(line + "\n" for line in lines))
+
+class LookupTest(unittest.TestCase):
+	def setUp(self):
+		parts = [
+			(bytes.fromhex("98DE"), "SHORT", 0, 0, 0, 0, 0, 0, 64),
+			(bytes.fromhex("98DE9493"), "LONG", 19, 2, 16384, 256, 2, 1, 64),
+			(bytes.fromhex("98DE949376"), "LONGEST", 15, 3, 16384, 256, 2, 1, 64),
+			(bytes.fromhex("EC"), "MAKER", 0, 0, 0, 0, 0, 0, 0),
+			]
+		self.db = flash.FlashDb(flash._Build(parts))
+
+	def _Part(self, fid):
+		part = self.db.Lookup(bytes.fromhex(fid))
+		return part["part"] if part != None else None
+
+	def test_longest_prefix(self):
+		self.assertEqual(self._Part("98DE949376D75614"), "LONGEST")
+		self.assertEqual(self._Part("98DE949372D75614"), "LONG")
+		self.assertEqual(self._Part("98DE849376D75614"), "SHORT")
+		self.assertEqual(self._Part("ECD7"), "MAKER")
+		self.assertIsNone(self._Part("98D7949376D75614"))
+		self.assertIsNone(self._Part("2C"))
+
+	def test_record(self):
+		part = self.db.Lookup(bytes.fromhex("98DE949376D75614"))
+		self.assertEqual(part, {"part": "LONGEST", "process": 15, "bits": 3, "planes": 2, "dies": 1,
+			"pagesize": 16384, "pagesperblock": 256, "density": 64})
+
+	# longer than 8 bytes: only the first 8 count
+	def test_long_id(self):
+		self.assertEqual(self._Part("98DE949376D75614AABB"), "LONGEST")
+
+	def test_duplicate(self):
+		with self.assertRaises(Exception):
+			flash._Build([(b"\x98", "A", 0, 0, 0, 0, 0, 0, 0), (b"\x98", "B", 0, 0, 0, 0, 0, 0, 0)])
+
+class RebuildTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.cache = os.environ.get("CHIPINFO_CACHE")
+		os.environ["CHIPINFO_CACHE"] = os.path.join(self.dir, "cache")
+		self.source = os.path.join(self.dir, "flashdb.txt")
+		self.compiled = os.path.join(self.dir, "cache", flash._compiledName)
+
+	def tearDown(self):
+		if self.cache == None:
+			del os.environ["CHIPINFO_CACHE"]
+		else:
+			os.environ["CHIPINFO_CACHE"] = self.cache
+		shutil.rmtree(self.dir)
+
+	def _Part(self, fid):
+		part = flash.LoadDatabase(self.source).Lookup(bytes.fromhex(fid))
+		return part["part"] if part != None else None
+
+	def test_rebuild(self):
+		_Source(self.source, ["98DE9493  OLD  19  MLC  16K  256  2  1  64"])
+		self.assertEqual(self._Part("98DE949376"), "OLD")
+		built = os.stat(self.compiled).st_mtime_ns
+
+		# unchanged source: the compiled file is used as it is
+		self.assertEqual(self._Part("98DE949376"), "OLD")
+		self.assertEqual(os.stat(self.compiled).st_mtime_ns, built)
+
+		_Source(self.source, ["98DE9493  NEW  19  MLC  16K  256  2  1  64", "ECD7  OTHER  -  -  -  -  -  -  -"])
+		os.utime(self.source, ns=(time.time_ns(), os.stat(self.source).st_mtime_ns + 1000000000))
+		self.assertEqual(self._Part("98DE949376"), "NEW")
+		self.assertEqual(self._Part("ECD7"), "OTHER")
+
+	def test_broken_cache(self):
+		_Source(self.source, ["98DE9493  PART  19  MLC  16K  256  2  1  64"])
+		os.makedirs(os.path.dirname(self.compiled))
+		with open(self.compiled, "wb") as f:
+			f.write(b"garbage")
+		self.assertEqual(self._Part("98DE949376"), "PART")
+
+	def test_bad_line(self):
+		_Source(self.source, ["98DE9493  PART  19  MLC"])
+		with self.assertRaises(Exception):
+			flash.LoadDatabase(self.source)
+
+class DecodeTest(unittest.TestCase):
+	def test_jedec_third_byte(self):
+		# Toshiba, 2 dies (bits 0-1 = 1), MLC (bits 2-3 = 1), device code D7
+		info = flash.DecodeFlashId(bytes.fromhex("98D7850000000000"))
+		self.assertEqual((info["bits"], info["dies"], info["density"]), (2, 2, 32))
+
+	# makers with another ID layout get nothing decoded from it
+	def test_other_maker(self):
+		for fid in ("C2D7850000000000", "EFD7850000000000", "9BD7850000000000", "42D7850000000000"):
+			info = flash.DecodeFlashId(bytes.fromhex(fid))
+			self.assertNotIn("bits", info, fid)
+			self.assertNotIn("dies", info, fid)
+			self.assertNotIn("density", info, fid)
+
+# Toshiba 32 Gbit, 2 dies per CE and 64 Gbit, 1 die per CE
+Twin = bytes.fromhex("98D7953276560000")
+Single = bytes.fromhex("98DE949376D70000")
+
+def _Page(ids, stride=16):
+	page = bytearray(len(ids) * stride)
+	for i, fid in enumerate(ids):
+		page[i * stride:i * stride + len(fid)] = fid
+	return page
+
+class TopologyTest(unittest.TestCase):
+	# decode from the ID bytes only, whatever the installed database says
+	def setUp(self):
+		self.db = flash._db
+		flash._db = flash.FlashDb(flash._Build([]))
+
+	def tearDown(self):
+		flash._db = self.db
+
+	def test_page(self):
+		page = _Page([Twin, bytes(8), Twin, b"\xFF" * 8, Twin, bytes(8), bytes(8), bytes(8)])
+		topology = flash.FlashTopology().AddPage(page, ces=2)
+		self.assertEqual([(chip.channel, chip.ce) for chip in topology.chips], [(0, 0), (1, 0), (2, 0)])
+		self.assertEqual(topology.Ids(), [Twin] * 3)
+
+	def test_report(self):
+		topology = flash.FlashTopology().AddPage(_Page([Twin, Twin]), count=2)
+		report = dict((entry[0], entry[1]) for entry in topology.Report([]))
+		self.assertEqual(report["Flash ID"], Twin)
+		self.assertEqual(report["Flash ID #2"], Twin)
+		self.assertEqual((report["Flash CEs"], report["Flash dies"]), (2, 4))
+		self.assertEqual(report["Flash size"], 2 * 32 << 27)
+		self.assertNotIn("Flash warning", report)
+
+	def test_mixed(self):
+		topology = flash.FlashTopology().Add(0, 0, Twin).Add(0, 1, Single)
+		report = dict((entry[0], entry[1]) for entry in topology.Report([]))
+		self.assertEqual((report["Flash CEs"], report["Flash dies"]), (2, 3))
+		self.assertEqual(report["Flash size"], (32 + 64) << 27)
+		self.assertEqual(report["Flash warning"], "Mixed flash chips")
+
+	# one chip of unknown density: no size rather than a wrong one
+	def test_unknown_density(self):
+		topology = flash.FlashTopology().Add(0, 0, Twin).Add(0, 1, bytes.fromhex("98AB953276560000"))
+		self.assertIsNone(topology.RawSize())
+		self.assertNotIn("Flash size", [entry[0] for entry in topology.Report([])])
+
+	def test_empty(self):
+		topology = flash.FlashTopology().AddPage(bytes(128))
+		self.assertEqual(topology.Report([]), [("Flash ID", "Unavailable")])
+
+if __name__ == "__main__":
+	unittest.main()
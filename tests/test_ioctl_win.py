@@ -0,0 +1,119 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+
+# Windows SPTI backend against a fake kernel32
+
+import ctypes
+import unittest
+
+import fakewin
+
+class StructureTest(unittest.TestCase):
+	def setUp(self):
+		self.win = fakewin.Import(fakewin.Kernel32())
+
+	def test_sptd_layout(self):
+		sptd = self.win.SCSI_PASS_THROUGH_DIRECT
+		pointer = ctypes.sizeof(ctypes.c_void_p)
+		self.assertTrue(self.win.ValidSptdLength(ctypes.sizeof(sptd), pointer))
+		offsets = [(name, getattr(sptd, name).offset) for name in ("ScsiStatus", "CdbLength", "DataIn", "DataTransferLength", "TimeOutValue", "DataBuffer")]
+		self.assertEqual(offsets, [("ScsiStatus", 2), ("CdbLength", 6), ("DataIn", 8), ("DataTransferLength", 12), ("TimeOutValue", 16), ("DataBuffer", 24 if pointer == 8 else 20)])
+		self.assertEqual(sptd.SenseInfoOffset.offset, 32 if pointer == 8 else 24)
+		self.assertEqual(sptd.Cdb.offset, 36 if pointer == 8 else 28)
+		withSense = self.win.SCSI_PASS_THROUGH_DIRECT_WITH_SENSE
+		self.assertEqual(withSense.Sense.offset, ctypes.sizeof(sptd))
+		self.assertEqual(ctypes.sizeof(withSense), ctypes.sizeof(sptd) + self.win.SenseLength)
+
+	def test_valid_lengths(self):
+		self.assertTrue(self.win.ValidSptdLength(0x2C, 4))
+		self.assertTrue(self.win.ValidSptdLength(0x38, 8))
+		self.assertFalse(self.win.ValidSptdLength(0x38, 4))
+		self.assertFalse(self.win.ValidSptdLength(0x30, 8))
+
+	def test_prepared_fields(self):
+		request = self.win.PreparedRequest()
+		sptd = request.sptd
+		self.assertEqual((sptd.Length, sptd.SenseInfoLength), (ctypes.sizeof(self.win.SCSI_PASS_THROUGH_DIRECT), self.win.SenseLength))
+		self.assertEqual(sptd.SenseInfoOffset, self.win.SCSI_PASS_THROUGH_DIRECT_WITH_SENSE.Sense.offset)
+		request.reserve(100)
+		request.prepare([0x28, 0, 0, 0, 0, 9, 0, 0, 1, 0x1FF], 512, True, timeout=2.5)
+		self.assertEqual(bytes(sptd.Cdb), bytes([0x28, 0, 0, 0, 0, 9, 0, 0, 1, 0xFF]) + bytes(6))
+		self.assertEqual((sptd.DataIn, sptd.DataTransferLength, sptd.TimeOutValue), (1, 512, 3))
+
+class RequestTest(unittest.TestCase):
+	def setUp(self):
+		self.kernel32 = fakewin.Kernel32()
+		self.win = fakewin.Import(self.kernel32)
+		self.dctl = self.win.DeviceIoControl("\\\\.\\PhysicalDrive9").__enter__()
+
+	def tearDown(self):
+		self.dctl.__exit__(None, None, None)
+
+	def test_buffer_reused(self):
+		self.win.ScsiRequest(self.dctl, [0x28, 0, 0, 0, 0, 0, 0, 0, 1, 0], 512)
+		self.win.ScsiRequest(self.dctl, [0x12, 0, 0, 0, 36, 0], bytearray(36))
+		self.win.ScsiRequest(self.dctl, [0x28, 0, 0, 0, 0, 0, 0, 0, 1, 0], bytearray(512))
+		buffers = set(r[4] for r in self.kernel32.requests)
+		blocks = set(r[5] for r in self.kernel32.requests)
+		self.assertEqual((len(buffers), len(blocks)), (1, 1))
+		# grows for a larger transfer, the pass-through block stays
+		self.win.ScsiRequest(self.dctl, [0x28, 0, 0, 0, 0, 0, 0, 0, 16, 0], bytearray(8192))
+		self.assertEqual(self.kernel32.requests[-1][5], blocks.pop())
+		self.assertGreaterEqual(len(self.dctl._request.buffer), 8192)
+
+	def test_data_in_cleared(self):
+		self.assertEqual(bytes(self.win.ScsiRequest(self.dctl, [0x28, 0, 0, 0, 0, 0, 0, 0, 1, 0], 512)), b"\xFF" * 512)
+		reply = bytes(self.win.ScsiRequest(self.dctl, [0x12, 0, 0, 0, 0xFF, 0], 512))
+		self.assertEqual(reply[8:15], b"FAKEWIN")
+		self.assertEqual(reply[36:], bytes(512 - 36))
+
+	def test_sense_cleared(self):
+		self.assertIsNone(self.win.ScsiRequest(self.dctl, [0xC6, 0x56], 16, mayFail=True))
+		status, sense = self.win.LastStatus(self.dctl)
+		self.assertEqual((status, sense[2], sense[12]), (2, 5, 0x20))
+		self.win.ScsiRequest(self.dctl, [0x12, 0, 0, 0, 36, 0], 36)
+		self.assertEqual(self.win.LastStatus(self.dctl), (0, bytes(self.win.SenseLength)))
+
+	def test_data_out(self):
+		self.win.ScsiRequest(self.dctl, [0x28, 0, 0, 0, 0, 0, 0, 0, 1, 0], 512)
+		self.assertTrue(self.win.ScsiRequest(self.dctl, [0x2A, 0, 0, 0, 0, 0, 0, 0, 1, 0], b"\x11" * 512, dataIn=False))
+		self.assertEqual(self.kernel32.written, [b"\x11" * 512])
+		self.assertEqual(self.kernel32.requests[-1][1:3], (0, 512))
+		# legacy list data-in
+		data = [0] * 36
+		self.win.ScsiRequest(self.dctl, [0x12, 0, 0, 0, 36, 0], data)
+		self.assertEqual(bytes(data[8:15]), b"FAKEWIN")
+
+	def test_failure_raises(self):
+		with self.assertRaises(Exception):
+			self.win.ScsiRequest(self.dctl, [0xC6, 0x56], 16)
+
+	def test_capacity(self):
+		self.assertEqual(self.win.GetCapacity(self.dctl), 1000 * 255 * 63 * 512)
+
+if __name__ == "__main__":
+	unittest.main()
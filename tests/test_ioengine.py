@@ -0,0 +1,124 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+
+# IO engines: same data from every engine, fallback when one is missing
+
+import os
+import sys
+import random
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chipinfo"))
+
+import ioengine
+
+Size = 4 * 1024 * 1024
+Block = 64 * 1024
+
+def _Pattern(offset, view):
+	seed = hashlib.sha256(b"%d"%offset).digest()
+	view[:] = (seed * (len(view) // len(seed) + 1))[:len(view)]
+
+def _Hash(path):
+	with open(path, "rb") as f:
+		return hashlib.sha256(f.read()).hexdigest()
+
+class EngineTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, "disk.img")
+		with open(self.path, "wb") as f:
+			f.write(os.urandom(Size))
+		self.available = dict(ioengine._available)
+
+	def tearDown(self):
+		ioengine._available.clear()
+		ioengine._available.update(self.available)
+		shutil.rmtree(self.dir)
+
+	def _Engines(self):
+		names = [name for name in ioengine.engines if ioengine.Available(name)]
+		self.assertIn("direct", names)
+		return names
+
+	# blocks in random order, odd-sized ones included
+	def _Jobs(self):
+		jobs = [(offset, Block) for offset in range(0, Size, Block)]
+		jobs[-1] = (Size - Block, Block - 512)
+		jobs.append((Size - 512, 512))
+		random.Random(1).shuffle(jobs)
+		return jobs
+
+	def test_read(self):
+		expected = _Hash(self.path)
+		for name in self._Engines():
+			image = bytearray(Size)
+			with ioengine.Create(self.path, name, depth=8, blocksize=Block) as engine:
+				self.assertEqual(engine.name, name)
+				for offset, view, result, seconds in ioengine.Stream(engine, self._Jobs()):
+					self.assertEqual(result, len(view), name)
+					image[offset:offset + len(view)] = view
+			self.assertEqual(hashlib.sha256(image).hexdigest(), expected, name)
+
+	def test_write(self):
+		image = bytearray(Size)
+		for offset, length in self._Jobs():
+			_Pattern(offset, memoryview(image)[offset:offset + length])
+		expected = hashlib.sha256(image).hexdigest()
+		for name in self._Engines():
+			with ioengine.Create(self.path, name, depth=8, blocksize=Block, write=True) as engine:
+				for offset, view, result, seconds in ioengine.Stream(engine, self._Jobs(), write=True, fill=_Pattern):
+					self.assertEqual(result, len(view), name)
+			self.assertEqual(_Hash(self.path), expected, name)
+			with open(self.path, "wb") as f:
+				f.write(os.urandom(Size))
+
+	def test_read_past_end(self):
+		for name in self._Engines():
+			with ioengine.Create(self.path, name, blocksize=Block) as engine:
+				results = [result for offset, view, result, seconds in ioengine.Stream(engine, [(Size, Block)])]
+				self.assertEqual(results, [0], name)
+
+	def test_fallback(self):
+		names = self._Engines()
+		ioengine._available["uring"] = False
+		with ioengine.Create(self.path) as engine:
+			self.assertEqual(engine.name, "libaio" if "libaio" in names else "direct")
+		with ioengine.Create(self.path, "uring") as engine:
+			self.assertNotEqual(engine.name, "uring")
+		ioengine._available["libaio"] = False
+		with ioengine.Create(self.path, "auto") as engine:
+			self.assertEqual(engine.name, "direct")
+		ioengine._available["direct"] = False
+		with self.assertRaises(Exception):
+			ioengine.Create(self.path)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,97 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+
+# Linux SG backend against its file backed disk emulation
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chipinfo"))
+
+import scsi
+
+Sectors = 2048
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "Linux SG backend")
+class FileDeviceTest(unittest.TestCase):
+	def setUp(self):
+		fd, self.path = tempfile.mkstemp()
+		os.ftruncate(fd, Sectors * 512)
+		os.close(fd)
+		self.dctl = scsi.Device(self.path).__enter__()
+
+	def tearDown(self):
+		self.dctl.__exit__(None, None, None)
+		os.unlink(self.path)
+
+	def test_inquiry(self):
+		inquiry = scsi.Inquiry(self.dctl)
+		self.assertEqual(bytes(inquiry[8:16]), b"CHIPINFO")
+		self.assertEqual(bytes(inquiry[16:32]), b"File backed disk")
+		self.assertEqual(scsi.SerialNumber(self.dctl), b"%016X"%os.stat(self.path).st_ino)
+
+	def test_capacity(self):
+		self.assertEqual(scsi.GetCapacity(self.dctl), Sectors * 512)
+
+	def test_read_write(self):
+		data = bytes(range(256)) * 8
+		self.assertTrue(scsi.WriteSectors(self.dctl, 100, data))
+		self.assertEqual(bytes(scsi.ReadSectors(self.dctl, 100, 4)), data)
+		with open(self.path, "rb") as f:
+			f.seek(100 * 512)
+			self.assertEqual(f.read(len(data)), data)
+
+	def test_read16(self):
+		scsi.WriteSectors(self.dctl, Sectors - 1, b"\xA5" * 512)
+		cdb = scsi.CDB(16, [0x88]).Put(2, Sectors - 1, 8, False).PDB(10, 1)
+		self.assertEqual(bytes(scsi.ScsiRequest(self.dctl, cdb.data, bytearray(512))), b"\xA5" * 512)
+
+	def test_out_of_range(self):
+		cdb = scsi.CDB(12, [0x28]).PDB(2, Sectors).PWB(7, 1)
+		self.assertIsNone(scsi.ScsiRequest(self.dctl, cdb.data, bytearray(512), mayFail=True))
+		status, sense = scsi.LastStatus(self.dctl)
+		self.assertEqual(status, 2)
+		self.assertEqual((sense[2] & 0x0F, sense[12]), (5, 0x21))
+
+	def test_vendor_command_rejected(self):
+		self.assertIsNone(scsi.ScsiRequest(self.dctl, [0xC6, 0x56] + [0] * 10, 512, mayFail=True))
+		status, sense = scsi.LastStatus(self.dctl)
+		self.assertEqual((status, sense[2] & 0x0F, sense[12]), (2, 5, 0x20))
+
+	# the device buffer is shared by requests, a short reply must not
+	# show the previous one's data
+	def test_buffer_cleared(self):
+		scsi.WriteSectors(self.dctl, 0, b"\xFF" * 512)
+		self.assertEqual(bytes(scsi.ScsiRequest(self.dctl, scsi.CDB(12, [0x28]).PWB(7, 1).data, 512)), b"\xFF" * 512)
+		reply = bytes(scsi.ScsiRequest(self.dctl, scsi.CDB(12, [0x25]).data, 512))
+		self.assertEqual(reply[:8], bytes.fromhex("000007FF00000200"))
+		self.assertEqual(reply[8:], bytes(512 - 8))
+
+if __name__ == "__main__":
+	unittest.main()
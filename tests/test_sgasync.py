@@ -0,0 +1,151 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+
+# Asynchronous sg engine on emulated endpoints, checked against the
+# synchronous SG backend
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import concurrent.futures
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chipinfo"))
+
+import scsi
+
+if sys.platform.startswith("linux"):
+	import sgasync
+
+Devices = 32
+Sectors = 128
+
+def _Read10(lba, count):
+	return scsi.CDB(12, [0x28]).PDB(2, lba).PWB(7, count).data
+
+class FailingEngine:
+	def Submit(self, endpoint, cdb, data, dataIn=True, timeout=5):
+		future = concurrent.futures.Future()
+		future.set_exception(Exception("Endpoint unregistered"))
+		return future
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "Linux sg transport")
+class EngineTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.paths = []
+		for i in range(Devices):
+			path = os.path.join(self.dir, "disk%d.img"%i)
+			with open(path, "wb") as f:
+				f.write(os.urandom(Sectors * 512))
+			self.paths.append(path)
+		self.engine = sgasync.Engine()
+
+	def tearDown(self):
+		self.engine.Close()
+		shutil.rmtree(self.dir)
+
+	def _Sync(self, path, cdb, length):
+		with scsi.Device(path) as dctl:
+			data = scsi.ScsiRequest(dctl, cdb, bytearray(length), mayFail=True)
+			return (bytes(data) if data != None else None), scsi.LastStatus(dctl)
+
+	def test_many_devices(self):
+		endpoints = [sgasync.Endpoint(path, latency=0.002) for path in self.paths]
+		try:
+			commands = [(_Read10(lba, 8), 8 * 512) for lba in (0, 17, Sectors - 8)]
+			commands.append((scsi.CDB(12, [0x12]).PB(4, 36).data, 36))
+			commands.append((scsi.CDB(12, [0x25]).data, 8))
+			futures = {}
+			for ep, path in zip(endpoints, self.paths):
+				for cdb, length in commands:
+					futures[self.engine.Submit(ep, cdb, bytearray(length))] = (path, cdb, length)
+			for future in concurrent.futures.as_completed(futures, timeout=30):
+				path, cdb, length = futures[future]
+				request = future.result()
+				self.assertTrue(request.ok)
+				data, status = self._Sync(path, cdb, length)
+				self.assertEqual(bytes(request.data), data)
+		finally:
+			for ep in endpoints:
+				self.engine.Unregister(ep)
+				ep.Close()
+
+	# more commands than the endpoint takes at once wait in its backlog
+	def test_backlog(self):
+		ep = sgasync.Endpoint(self.paths[0], depth=4, latency=0.001)
+		try:
+			futures = [self.engine.Submit(ep, _Read10(lba, 1), bytearray(512)) for lba in range(Sectors)]
+			with open(self.paths[0], "rb") as f:
+				image = f.read()
+			for lba, future in enumerate(futures):
+				self.assertEqual(bytes(future.result(timeout=30).data), image[lba * 512:(lba + 1) * 512])
+		finally:
+			self.engine.Unregister(ep)
+			ep.Close()
+
+	def test_device(self):
+		with sgasync.Device(self.paths[1], self.engine) as dctl:
+			self.assertEqual(scsi.GetCapacity(dctl), Sectors * 512)
+			self.assertEqual(bytes(scsi.Inquiry(dctl)), self._Sync(self.paths[1], scsi.CDB(12, [0x12]).PB(4, 0x38).data, 0x38)[0])
+			self.assertTrue(scsi.WriteSectors(dctl, 5, b"\x5A" * 1024))
+			self.assertEqual(bytes(scsi.ReadSectors(dctl, 5, 2)), b"\x5A" * 1024)
+
+			# failures carry the same status and sense as the synchronous path
+			cdb = _Read10(Sectors, 1)
+			self.assertIsNone(scsi.ScsiRequest(dctl, cdb, bytearray(512), mayFail=True))
+			self.assertEqual(scsi.LastStatus(dctl), self._Sync(self.paths[1], cdb, 512)[1])
+
+	# a request that never reached the device does not report the status
+	# of the one before it
+	def test_failed_submit(self):
+		with sgasync.Device(self.paths[3], self.engine) as dctl:
+			self.assertIsNone(scsi.ScsiRequest(dctl, _Read10(Sectors, 1), bytearray(512), mayFail=True))
+			self.assertEqual(scsi.LastStatus(dctl)[0], 2)
+			dctl.engine = FailingEngine()
+			try:
+				self.assertIsNone(dctl.ScsiRequest(_Read10(0, 1), bytearray(512), mayFail=True))
+				self.assertEqual(scsi.LastStatus(dctl), (0, bytes(sgasync.SenseLength)))
+			finally:
+				dctl.engine = self.engine
+
+	def test_unregister(self):
+		ep = sgasync.Endpoint(self.paths[2], depth=1, latency=0.2)
+		future = self.engine.Submit(ep, _Read10(0, 1), bytearray(512))
+		backlog = self.engine.Submit(ep, _Read10(1, 1), bytearray(512))
+		self.engine.Unregister(ep)
+		for f in (future, backlog):
+			with self.assertRaises(Exception):
+				f.result(timeout=5)
+		# let the emulated completion land before its pipe goes away
+		time.sleep(0.4)
+		ep.Close()
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,177 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+
+# Surface scan over a sparse file, with read errors injected
+
+import os
+import sys
+import mmap
+import errno
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chipinfo"))
+
+import benchmark
+import ioengine
+import surface
+
+Capacity = 8 * 1024 * 1024
+Chunk = 1024 * 1024
+# unreadable: one 4 KiB granule in the fourth chunk
+BadOffset = 3 * Chunk + 8192
+BadSize = 4096
+
+def _Hits(offset, length):
+	return offset < BadOffset + BadSize and BadOffset < offset + length
+
+class FaultyReader(benchmark.BlockReader):
+	def Read(self, offset, buf):
+		if _Hits(offset, len(buf)):
+			raise OSError(errno.EIO, "Input/output error")
+		benchmark.BlockReader.Read(self, offset, buf)
+
+class FaultyEngine(ioengine.DirectEngine):
+	name = "faulty"
+
+	def _Submit(self, index, offset, length, write):
+		if _Hits(offset, length):
+			self._done.append((index, -errno.EIO))
+			return
+		ioengine.DirectEngine._Submit(self, index, offset, length, write)
+
+class ScanTest(unittest.TestCase):
+	def setUp(self):
+		fd, self.path = tempfile.mkstemp()
+		os.ftruncate(fd, Capacity)
+		os.pwrite(fd, b"\xA5" * 4096, Capacity // 2)
+		os.close(fd)
+		benchmark.readers["faulty"] = FaultyReader
+		ioengine.engines["faulty"] = FaultyEngine
+		ioengine.names.append("faulty")
+
+	def tearDown(self):
+		del benchmark.readers["faulty"]
+		del ioengine.engines["faulty"]
+		ioengine.names.remove("faulty")
+		ioengine._available.pop("faulty", None)
+		os.unlink(self.path)
+
+	def _Scan(self, mode, depth=2):
+		return surface.Scan(self.path, mode, Capacity, Chunk, depth, regions=8).Execute()
+
+	def test_clean(self):
+		for mode in ("block", "scsi", "direct"):
+			result = self._Scan(mode)
+			self.assertEqual(result["bytes"], Capacity, mode)
+			self.assertEqual(result["bad"], [], mode)
+			self.assertEqual(len(result["profile"]), 8, mode)
+
+	def test_bad_granule_reader(self):
+		result = self._Scan("faulty")
+		self.assertEqual(result["bytes"], Capacity)
+		self.assertEqual(result["bad"], [(BadOffset // 512, BadSize // 512)])
+
+	def test_bad_granule_engine(self):
+		result = self._Scan("faulty", depth=4)
+		self.assertEqual(result["engine"], "faulty")
+		self.assertEqual(result["bad"], [(BadOffset // 512, BadSize // 512)])
+
+	def test_report_and_map(self):
+		mapfile = self.path + ".map"
+		try:
+			report = surface.Surface(self.path, [], mode="faulty", chunk=Chunk, regions=8, mapfile=mapfile)
+			entries = dict((entry[0], entry[1]) for entry in report)
+			self.assertEqual(entries["Scan bad ranges"], "LBA 6160-6167")
+			with open(mapfile, "rb") as f:
+				self.assertEqual(f.read(), bytes([1 << 3]))
+		finally:
+			if os.path.exists(mapfile):
+				os.unlink(mapfile)
+
+	# a device shorter than its reported capacity: the tail reads short
+	def test_short_device(self):
+		os.truncate(self.path, Capacity - Chunk // 2)
+		result = surface.Scan(self.path, "block", Capacity, Chunk, 2, regions=8).Execute()
+		self.assertEqual(result["bad"], [((Capacity - Chunk // 2) // 512, Chunk // 2 // 512)])
+
+class BlockReaderTest(unittest.TestCase):
+	def setUp(self):
+		fd, self.path = tempfile.mkstemp()
+		os.ftruncate(fd, 3 * 4096)
+		os.close(fd)
+		self.reader = benchmark.BlockReader(self.path)
+		self.buf = mmap.mmap(-1, 8192)
+
+	def tearDown(self):
+		self.reader.Close()
+		os.unlink(self.path)
+
+	def _Check(self):
+		self.reader.Read(4096, self.buf)
+		with self.assertRaises(Exception) as context:
+			self.reader.Read(8192, self.buf)
+		self.assertIn("4096 of 8192", str(context.exception))
+		with self.assertRaises(Exception):
+			self.reader.Read(3 * 4096, self.buf)
+
+	def test_short_read(self):
+		self._Check()
+
+	def test_short_read_without_preadv(self):
+		preadv = getattr(os, "preadv", None)
+		if preadv != None:
+			del os.preadv
+		try:
+			self._Check()
+		finally:
+			if preadv != None:
+				os.preadv = preadv
+
+class HelperTest(unittest.TestCase):
+	def test_merge_ranges(self):
+		self.assertEqual(surface.MergeRanges([]), [])
+		self.assertEqual(surface.MergeRanges([(8192, 4096), (0, 4096), (4096, 4096), (65536, 512)]), [(0, 24), (128, 1)])
+		# overlapping and contained ranges
+		self.assertEqual(surface.MergeRanges([(0, 8192), (4096, 1024), (8192, 512)]), [(0, 17)])
+
+	def test_bitmap(self):
+		self.assertEqual(surface.Bitmap([], 10 * 4096, 4096), bytes(2))
+		# LBA 8-23 covers units 1 and 2, LBA 72 unit 9
+		self.assertEqual(surface.Bitmap([(8, 16), (72, 1)], 10 * 4096, 4096), bytes([0x06, 0x02]))
+
+	def test_find_cliff(self):
+		region, before, after = surface.FindCliff([30.0] * 6 + [10.0] * 10)
+		self.assertEqual((region, before, after), (6, 30.0, 10.0))
+		self.assertIsNone(surface.FindCliff([30.0, 29.0, 31.0, 30.0, 28.0]))
+		self.assertIsNone(surface.FindCliff([30.0]))
+
+	def test_faster_second_half(self):
+		self.assertIsNone(surface.FindCliff([10.0] * 8 + [30.0] * 8))
+
+if __name__ == "__main__":
+	unittest.main()
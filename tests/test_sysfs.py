@@ -0,0 +1,154 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+
+# Disk enumeration and selectors on a fake sysfs tree
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chipinfo"))
+
+import sysfs
+
+def _Write(path, text):
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path, "w") as f:
+		f.write(text + "\n")
+
+def _Link(target, link):
+	os.makedirs(os.path.dirname(link), exist_ok=True)
+	os.symlink(os.path.relpath(target, os.path.dirname(link)), link)
+
+"""
+	count USB sticks on hubs of 8 ports (2-1.1 ... 2-1.8, 2-2.1 ...), every
+	third one Phison 13FE:4300 and the rest SMI 090C:1000, plus a SATA disk
+	sdzz and a virtio disk vda
+"""
+def BuildTree(root, count):
+	pci = os.path.join(root, "devices", "pci0000:00", "0000:00:14.0")
+	os.makedirs(os.path.join(root, "bus", "usb", "devices"))
+	os.makedirs(os.path.join(root, "block"))
+	_Link(pci + "/usb2", root + "/bus/usb/devices/usb2")
+	for i in range(count):
+		hub, port = i // 8 + 1, i % 8 + 1
+		hubdir = "%s/usb2/2-%d"%(pci, hub)
+		if port == 1:
+			_Write(hubdir + "/idVendor", "05e3")
+			_Write(hubdir + "/idProduct", "0610")
+			_Link(hubdir, root + "/bus/usb/devices/2-%d"%hub)
+		name = "2-%d.%d"%(hub, port)
+		dev = hubdir + "/" + name
+		vid, pid = ("13fe", "4300") if i % 3 == 0 else ("090c", "1000")
+		_Write(dev + "/idVendor", vid)
+		_Write(dev + "/idProduct", pid)
+		_Write(dev + "/serial", "SN%04d"%i)
+		_Write(dev + "/speed", "5000" if i % 2 else "480")
+		_Write(dev + "/manufacturer", "Maker")
+		_Write(dev + "/product", "Stick")
+		_Link(dev, root + "/bus/usb/devices/" + name)
+		_Link(dev + "/" + name + ":1.0", root + "/bus/usb/devices/" + name + ":1.0")
+		sd = "sd" + chr(97 + i)
+		scsidev = "%s/%s:1.0/host%d/target%d:0:0/%d:0:0:0"%(dev, name, i, i, i)
+		os.makedirs(scsidev + "/scsi_generic/sg%d"%(i + 1))
+		blk = scsidev + "/block/" + sd
+		_Write(blk + "/size", str((i + 1) * 2048))
+		_Write(blk + "/removable", "1")
+		_Link(scsidev, blk + "/device")
+		_Link(blk, root + "/block/" + sd)
+	sata = root + "/devices/pci0000:00/0000:00:1f.2/ata1/host0/target0:0:0/0:0:0:0"
+	os.makedirs(sata + "/scsi_generic/sg0")
+	_Write(sata + "/block/sdzz/size", "1000")
+	_Write(sata + "/block/sdzz/removable", "0")
+	_Link(sata, sata + "/block/sdzz/device")
+	_Link(sata + "/block/sdzz", root + "/block/sdzz")
+	_Write(root + "/devices/virtual/block/vda/size", "10")
+	_Link(root + "/devices/virtual/block/vda", root + "/block/vda")
+
+class SysfsTest(unittest.TestCase):
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+		BuildTree(self.root, 10)
+
+	def tearDown(self):
+		sysfs.Invalidate()
+		shutil.rmtree(self.root)
+
+	def _Names(self, disks):
+		return [disk.name for disk in disks]
+
+	def test_disks(self):
+		disks = sysfs.Disks(self.root, refresh=True)
+		self.assertEqual(list(disks), ["sd" + chr(97 + i) for i in range(10)] + ["sdzz"])
+
+		disk = disks["sdj"]
+		self.assertEqual((disk.node, disk.sg, disk.size, disk.removable), ("/dev/sdj", "/dev/sg10", 10 * 2048 * 512, True))
+		self.assertEqual((disk.vid, disk.pid, disk.serial, disk.port, disk.speed), (0x13FE, 0x4300, "SN0009", "2-2.2", 5000))
+		self.assertEqual((disk.vendor, disk.product), ("Maker", "Stick"))
+
+		sata = disks["sdzz"]
+		self.assertEqual((sata.sg, sata.size, sata.removable, sata.vid, sata.port), ("/dev/sg0", 1000 * 512, False, None, None))
+
+	def test_find(self):
+		self.assertEqual(sysfs.Find("/dev/sg3", self.root).name, "sdc")
+		self.assertEqual(sysfs.UsbId("/dev/sdb", self.root), (0x090C, 0x1000))
+		self.assertIsNone(sysfs.UsbId("/dev/sdzz", self.root))
+		self.assertIsNone(sysfs.UsbId("image.bin", self.root))
+		self.assertIsNone(sysfs.Find("/dev/sdq", self.root))
+
+	def test_select(self):
+		self.assertEqual(self._Names(sysfs.Select(":13fe", self.root)), ["sda", "sdd", "sdg", "sdj"])
+		self.assertEqual(self._Names(sysfs.Select(":13FE:4300", self.root)), ["sda", "sdd", "sdg", "sdj"])
+		self.assertEqual(self._Names(sysfs.Select(":090c:4300", self.root)), [])
+		self.assertEqual(self._Names(sysfs.Select("@2-2.*", self.root)), ["sdi", "sdj"])
+		self.assertEqual(self._Names(sysfs.Select("@2-1.3", self.root)), ["sdc"])
+		self.assertEqual(self._Names(sysfs.Select("#10", self.root)), ["sdzz"])
+		self.assertEqual(self._Names(sysfs.Select("/dev/sd[ab]", self.root)), ["sda", "sdb"])
+		self.assertEqual(self._Names(sysfs.Select("sdz*", self.root)), ["sdzz"])
+
+	def test_expand(self):
+		devices, unmatched = sysfs.Expand(["image.bin", ":13fe", "@2-1.1", ":dead", "#1"], self.root)
+		self.assertEqual(devices, ["image.bin", "/dev/sda", "/dev/sdd", "/dev/sdg", "/dev/sdj", "/dev/sdb"])
+		self.assertEqual(unmatched, [":dead"])
+
+	def test_refresh(self):
+		shutil.rmtree(self.root)
+		os.makedirs(self.root)
+		BuildTree(self.root, 2)
+		self.assertEqual(list(sysfs.Disks(self.root, refresh=True)), ["sda", "sdb", "sdzz"])
+		shutil.rmtree(self.root)
+		os.makedirs(self.root)
+		BuildTree(self.root, 10)
+		# cached until refreshed, a disk plugged in since is found by a miss
+		self.assertEqual(len(sysfs.Disks(self.root)), 3)
+		self.assertEqual(sysfs.Find("/dev/sdj", self.root).port, "2-2.2")
+		self.assertEqual(len(sysfs.Disks(self.root)), 11)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,77 @@
+"""
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 VL
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sub-license, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+
+# Device watch: uevent filtering on a fake sysfs tree
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chipinfo"))
+
+import sysfs
+import watch
+import test_sysfs
+
+def Uevent(action, name):
+	fields = ["%s@/devices/virtual/block/%s"%(action, name), "ACTION=" + action, "SUBSYSTEM=block", "DEVNAME=" + name, "DEVTYPE=disk"]
+	return "\0".join(fields).encode() + b"\0"
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "Linux uevents")
+class NetlinkTest(unittest.TestCase):
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+		test_sysfs.BuildTree(self.root, 2)
+		try:
+			self.watcher = watch.NetlinkWatcher(self.root)
+		except OSError as e:
+			shutil.rmtree(self.root)
+			self.skipTest("no uevent socket: %s"%e)
+
+	def tearDown(self):
+		self.watcher.Close()
+		sysfs.Invalidate()
+		shutil.rmtree(self.root)
+
+	def test_usb_disk(self):
+		self.assertEqual(self.watcher._Parse(Uevent("add", "sda")), ("add", "/dev/sda"))
+		self.assertEqual(self.watcher._Parse(Uevent("remove", "sda")), ("remove", "/dev/sda"))
+
+	# fixed SATA disks and disks missing from sysfs are not probed
+	def test_fixed_disk(self):
+		self.assertIsNone(self.watcher._Parse(Uevent("add", "sdzz")))
+		self.assertIsNone(self.watcher._Parse(Uevent("add", "sdq")))
+		self.assertIsNone(self.watcher._Parse(Uevent("remove", "sdzz")))
+
+	def test_not_a_disk(self):
+		self.assertIsNone(self.watcher._Parse(Uevent("add", "vda")))
+		self.assertIsNone(self.watcher._Parse(Uevent("add", "sda").replace(b"DEVTYPE=disk", b"DEVTYPE=partition")))
+
+if __name__ == "__main__":
+	unittest.main()